@@ -0,0 +1,171 @@
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeTelegram:
+	"""Local stand-in for telegram bot api server.
+	Serves scripted updates to getUpdates, records sent messages and can answer slowly or with 429"""
+
+	# methods which send something to chat, latency and 429 are injected only for them
+	SEND_METHODS = {'sendMessage', 'sendDocument', 'editMessageText', 'editMessageReplyMarkup'}
+
+	def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0, error_rate: float = 0, retry_after: int = 1):
+		self.latency = latency
+		self.error_rate = error_rate
+		self.retry_after = retry_after
+		# updates which are not confirmed by getUpdates offset yet
+		self.updates = []
+		self.next_update_id = 1
+		self.next_message_id = 1
+		# dicts with method, chat_id, text, data and utc time of every send request
+		self.sent = []
+		self.requests = 0
+		self.throttled = 0
+		# functions called with every recorded send request
+		self.listeners = []
+		self._cond = threading.Condition()
+		self.server = ThreadingHTTPServer((host, port), self._handler_class())
+		self.server.daemon_threads = True
+		self.host, self.port = self.server.server_address
+
+	@property
+	def url(self):
+		return 'http://{host}:{port}'.format(host=self.host, port=self.port)
+
+	def start(self):
+		threading.Thread(target=self.server.serve_forever, name='fake-telegram', daemon=True).start()
+		return self
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+	def push_message(self, chat_id: int, text: str):
+		"""adds message update as if user sent text to bot. returns update"""
+		with self._cond:
+			message_id = self.next_message_id
+			self.next_message_id += 1
+		return self.push_update({'message': {
+			'message_id': message_id,
+			'date': int(time.time()),
+			'chat': {'id': chat_id, 'type': 'private'},
+			'from': {'id': chat_id, 'is_bot': False, 'first_name': 'bench'},
+			'text': text
+		}})
+
+	def push_update(self, update: dict):
+		"""adds update, update_id is assigned if missing. returns update"""
+		with self._cond:
+			if 'update_id' not in update:
+				update['update_id'] = self.next_update_id
+			self.next_update_id = max(self.next_update_id, update['update_id']) + 1
+			self.updates.append(update)
+			self._cond.notify_all()
+		return update
+
+	def get_updates(self, params: dict):
+		offset = int(params.get('offset', 0))
+		limit = int(params.get('limit', 100))
+		deadline = time.monotonic() + float(params.get('timeout', 0))
+		with self._cond:
+			# offset confirms all earlier updates
+			self.updates = [update for update in self.updates if update['update_id'] >= offset]
+			while not self.updates:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					break
+				self._cond.wait(remaining)
+			return self.updates[:limit]
+
+	def record(self, method: str, params: dict):
+		chat_id = params.get('chat_id')
+		entry = {
+			'method': method,
+			'chat_id': int(chat_id) if chat_id is not None else None,
+			'text': params.get('text'),
+			'data': params,
+			'time': datetime.utcnow()
+		}
+		with self._cond:
+			self.sent.append(entry)
+			message_id = self.next_message_id
+			self.next_message_id += 1
+		for listener in self.listeners:
+			listener(entry)
+		return {'message_id': message_id, 'date': int(time.time()), 'chat': {'id': entry['chat_id']}, 'text': entry['text']}
+
+	def answer(self, method: str, params: dict):
+		"""returns status code and json body for api method"""
+		self.requests += 1
+		if method == 'getUpdates':
+			return 200, {'ok': True, 'result': self.get_updates(params)}
+
+		if method in self.SEND_METHODS:
+			if self.latency:
+				time.sleep(random.uniform(0, 2 * self.latency))
+			if self.error_rate and random.random() < self.error_rate:
+				self.throttled += 1
+				return 429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after {}'.format(self.retry_after), 'parameters': {'retry_after': self.retry_after}}
+			return 200, {'ok': True, 'result': self.record(method, params)}
+
+		# setWebhook, deleteWebhook, answerCallbackQuery and others just succeed
+		return 200, {'ok': True, 'result': True}
+
+	def _handler_class(self):
+		fake = self
+
+		class Handler(BaseHTTPRequestHandler):
+
+			def handle_request(self, body: bytes):
+				url = urlparse(self.path)
+				method = url.path.rsplit('/', 1)[-1]
+				params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+				content_type = self.headers.get('Content-Type', '')
+				if body and content_type.startswith('application/x-www-form-urlencoded'):
+					params.update({key: values[-1] for key, values in parse_qs(body.decode()).items()})
+				elif body and content_type.startswith('application/json'):
+					params.update(json.loads(body))
+
+				status, answer = fake.answer(method, params)
+				data = json.dumps(answer).encode()
+				self.send_response(status)
+				self.send_header('Content-Type', 'application/json')
+				self.send_header('Content-Length', str(len(data)))
+				self.end_headers()
+				self.wfile.write(data)
+
+			def do_GET(self):
+				self.handle_request(b'')
+
+			def do_POST(self):
+				length = int(self.headers.get('Content-Length', 0))
+				self.handle_request(self.rfile.read(length))
+
+			def log_message(self, format, *args):
+				pass
+
+		return Handler
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Runs fake telegram bot api server. Set REMEMBERANCER_API_URL to its url')
+	parser.add_argument('--port', type=int, default=8081)
+	parser.add_argument('--latency', type=float, default=0, help='mean delay of send requests in seconds')
+	parser.add_argument('--error-rate', type=float, default=0, help='share of send requests answered with 429')
+	parser.add_argument('--updates', help='json file with list of updates to serve')
+	args = parser.parse_args()
+
+	fake = FakeTelegram(port=args.port, latency=args.latency, error_rate=args.error_rate)
+	if args.updates:
+		with open(args.updates) as f:
+			for update in json.load(f):
+				fake.push_update(update)
+	fake.listeners.append(lambda entry: print(entry['time'], entry['method'], entry['chat_id'], repr(entry['text'])))
+	print('fake telegram listens on', fake.url)
+	fake.server.serve_forever()
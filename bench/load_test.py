@@ -0,0 +1,165 @@
+import os
+import time
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+from bench.fake_telegram import FakeTelegram
+
+
+# chat ids used by benchmark, far from real telegram chat ids
+CONVERSATION_CHAT_BASE = 9 * 10 ** 15
+REMINDER_CHAT_BASE = CONVERSATION_CHAT_BASE + 10 ** 9
+
+
+def percentile(values: list, p: float):
+	if not values:
+		return None
+	values = sorted(values)
+	return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def conversation(chat_index: int):
+	"""messages one chat sends to set reminder for tomorrow, every message gets exactly one reply"""
+	date = datetime.utcnow() + timedelta(days=1)
+	return [
+		'/cancel',
+		'/timezone',
+		'0',
+		'/reminder',
+		'{d.day}/{d.month}/{d.year}'.format(d=date),
+		'{h:0>2}:{m:0>2}'.format(h=12 + chat_index // 60 % 12, m=chat_index % 60),
+		'bench reminder'
+	]
+
+
+class LoadTest:
+	"""Walks N chats through /reminder conversation and makes M reminders due at once"""
+
+	def __init__(self, bot, fake: FakeTelegram, chats: int, reminders: int, due_in: float):
+		self.bot = bot
+		self.fake = fake
+		self.chats = chats
+		self.reminders = reminders
+		self.due_in = due_in
+		self.scripts = {CONVERSATION_CHAT_BASE + i: conversation(i) for i in range(chats)}
+		# chat id -> index of message waiting for reply and monotonic time it was sent
+		self.steps = {}
+		self.handling = []
+		self.lags = []
+		self.due = {}
+		self.finished_chats = 0
+		self.last_reply = None
+		self.done = threading.Event()
+		self._lock = threading.Lock()
+		fake.listeners.append(self.on_send)
+
+	def cleanup(self):
+		"""deletes chats and reminders left by previous runs"""
+		self.bot.DBHandler.delete_chats(CONVERSATION_CHAT_BASE)
+
+	def prepare_reminders(self):
+		# storage keeps reminders to the minute, so due date is rounded up to whole minute after due_in
+		due_date = (datetime.utcnow() + timedelta(seconds=self.due_in, minutes=1)).replace(second=0, microsecond=0)
+		for i in range(self.reminders):
+			chat_id = REMINDER_CHAT_BASE + i
+			self.bot.DBHandler.set_timezone(chat_id, 0)
+			self.bot.DBHandler.set_reminder(chat_id, due_date, 'bench {}'.format(i))
+			self.due[chat_id] = due_date
+		if datetime.utcnow() > due_date:
+			print('warning: reminders became due before bot started, increase --due-in')
+
+	def push(self, chat_id: int, index: int):
+		self.steps[chat_id] = (index, time.monotonic())
+		self.fake.push_message(chat_id, self.scripts[chat_id][index])
+
+	def on_send(self, entry: dict):
+		now = time.monotonic()
+		chat_id = entry['chat_id']
+		with self._lock:
+			if chat_id in self.due:
+				self.lags.append((entry['time'] - self.due.pop(chat_id)).total_seconds())
+			elif chat_id in self.steps:
+				index, pushed_at = self.steps.pop(chat_id)
+				self.handling.append(now - pushed_at)
+				self.last_reply = now
+				if index + 1 < len(self.scripts[chat_id]):
+					self.push(chat_id, index + 1)
+				else:
+					self.finished_chats += 1
+			if self.finished_chats == self.chats and not self.due:
+				self.done.set()
+
+	def run(self, timeout: float):
+		started = time.monotonic()
+		for chat_id in self.scripts:
+			self.push(chat_id, 0)
+		self.done.wait(timeout)
+		elapsed = (self.last_reply or time.monotonic()) - started
+		updates = len(self.handling)
+
+		return {
+			'updates': updates,
+			'updates_per_sec': updates / elapsed if elapsed > 0 else None,
+			'handling_p50': percentile(self.handling, 0.5),
+			'handling_p99': percentile(self.handling, 0.99),
+			'reminders_delivered': len(self.lags),
+			'reminders_missing': len(self.due),
+			'delivery_lag_p50': percentile(self.lags, 0.5),
+			'delivery_lag_p99': percentile(self.lags, 0.99),
+			'delivery_lag_max': max(self.lags) if self.lags else None,
+			'api_requests': self.fake.requests,
+			'throttled_429': self.fake.throttled,
+			'completed': self.done.is_set()
+		}
+
+
+def run_bot(bot):
+	while True:
+		try:
+			bot.start()
+		except Exception as e:
+			print('bot failed:', e)
+
+
+def main():
+	parser = argparse.ArgumentParser(description='End to end load benchmark against local fake telegram server. Uses storage chosen by REMEMBERANCER_STORAGE')
+	parser.add_argument('--chats', type=int, default=50, help='chats walking through /reminder conversation')
+	parser.add_argument('--reminders', type=int, default=200, help='reminders becoming due at the same time')
+	parser.add_argument('--due-in', type=float, default=15, help='seconds from start until reminders are due, rounded up to whole minute')
+	parser.add_argument('--latency', type=float, default=0, help='mean latency of fake send requests in seconds')
+	parser.add_argument('--error-rate', type=float, default=0, help='share of send requests answered with 429')
+	parser.add_argument('--runtime', choices=['sync', 'asyncio'], default='sync')
+	parser.add_argument('--timeout', type=float, default=120)
+	args = parser.parse_args()
+
+	fake = FakeTelegram(latency=args.latency, error_rate=args.error_rate).start()
+	# bot modules read configuration on import
+	os.environ['REMEMBERANCER_API_URL'] = fake.url
+	os.environ.setdefault('REMEMBERANCER_BOT_TOKEN', 'bench')
+	from bot.bot import Bot
+	from bot.async_bot import AsyncBot
+
+	bot = AsyncBot() if args.runtime == 'asyncio' else Bot()
+	test = LoadTest(bot, fake, args.chats, args.reminders, args.due_in)
+	test.cleanup()
+	test.prepare_reminders()
+
+	threading.Thread(target=run_bot, args=(bot,), daemon=True).start()
+	# bot is ready when scheduler is loaded
+	while bot.scheduler.window_end is None:
+		time.sleep(0.05)
+
+	report = test.run(args.timeout)
+	test.cleanup()
+	fake.stop()
+
+	width = max(map(len, report))
+	for key, value in report.items():
+		if isinstance(value, float):
+			value = '{:.4f}'.format(value)
+		print('{key:<{width}}  {value}'.format(key=key, width=width, value=value))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,70 @@
+import argparse
+import timeit
+from datetime import datetime
+
+from bot import datetime_parser
+
+
+# messages users send while setting reminders, repeated like in real traffic
+SAMPLES = ['25/12', '1/1/2030', '18:30', '9:05', '31/02', '25:00', 'hello', '25/12 18:30 call mom', 'tomorrow 9:00 call mom', 'in 2h']
+
+
+def strptime_date_is_valid(text: str):
+	"""date validation done before compiled parser"""
+	fmt = {1: '%d/%m', 2: '%d/%m/%Y'}.get(text.count('/'))
+	if fmt is None:
+		return False
+	try:
+		datetime.strptime(text, fmt)
+	except ValueError:
+		return False
+	return True
+
+
+def strptime_time_is_valid(text: str):
+	"""time validation done before compiled parser"""
+	if text.count(':') != 1:
+		return False
+	try:
+		datetime.strptime(text, '%H:%M')
+	except ValueError:
+		return False
+	return True
+
+
+def run_strptime():
+	for text in SAMPLES:
+		strptime_date_is_valid(text)
+		strptime_time_is_valid(text)
+
+
+def run_parser():
+	for text in SAMPLES:
+		datetime_parser.parse_date(text)
+		datetime_parser.parse_time(text)
+
+
+def run_parser_uncached():
+	for text in SAMPLES:
+		datetime_parser.parse_date.__wrapped__(text)
+		datetime_parser.parse_time.__wrapped__(text)
+
+
+def run_one_line():
+	now = datetime.utcnow()
+	for text in SAMPLES:
+		datetime_parser.parse_reminder(text, now)
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Compares date and time validation with strptime and with compiled parser')
+	parser.add_argument('--number', type=int, default=20000, help='runs over all samples')
+	args = parser.parse_args()
+
+	for name, fun in [('strptime', run_strptime), ('parser', run_parser), ('parser_uncached', run_parser_uncached), ('one_line_reminder', run_one_line)]:
+		seconds = min(timeit.repeat(fun, number=args.number, repeat=3))
+		print('{name:<18} {us:8.3f} us per message'.format(name=name, us=seconds / args.number / len(SAMPLES) * 1e6))
+
+
+if __name__ == '__main__':
+	main()
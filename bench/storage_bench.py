@@ -0,0 +1,101 @@
+import os
+import io
+import time
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+from bench.fake_telegram import FakeTelegram
+from bench.load_test import percentile
+
+
+# chat ids used by benchmark, far from real telegram chat ids
+CHAT_BASE = 8 * 10 ** 15
+# update ids saved as last processed one, postgres database must be scratch one because of them
+UPDATE_BASE = 10 ** 12
+START = datetime(2030, 1, 1, 12, 0)
+
+
+def measure(storage, count: int):
+	"""returns dict operation -> list of latencies in seconds"""
+	latencies = {}
+	chats = [CHAT_BASE + 100 + i for i in range(count)]
+
+	def timed(name, fun, *args, **kwargs):
+		started = time.perf_counter()
+		result = fun(*args, **kwargs)
+		latencies.setdefault(name, []).append(time.perf_counter() - started)
+		return result
+
+	for i, chat_id in enumerate(chats):
+		timed('set_timezone', storage.set_timezone, chat_id, 0)
+		timed('set_chat_mode', storage.set_chat_mode, chat_id, 'reminder', 'date')
+		timed('get_chat_mode', storage.get_chat_mode, chat_id)
+		timed('save_temp_date', storage.save_temp_date, chat_id, '1/1/2030')
+		timed('set_reminder', storage.set_reminder, chat_id, START + timedelta(minutes=i), 'bench')
+		timed('get_chat_reminder_by_dt', storage.get_chat_reminder_by_dt, chat_id, START + timedelta(minutes=i))
+
+	for i, chat_id in enumerate(chats):
+		started = time.perf_counter()
+		with storage.chat_context(chat_id, UPDATE_BASE + i):
+			storage.get_chat_mode(chat_id)
+			storage.save_temp_time(chat_id, '12:00')
+			storage.set_chat_mode(chat_id, 'reminder', 'text')
+		latencies.setdefault('update in chat_context', []).append(time.perf_counter() - started)
+
+	chat_id = chats[0]
+	rows = [(line, START + timedelta(days=1, minutes=line), 'import') for line in range(count)]
+	timed('import_reminders ({} rows)'.format(count), storage.import_reminders, chat_id, rows)
+	page = None
+	for _ in range(count):
+		page, _ = timed('get_reminders_page', storage.get_reminders_page, chat_id, 10, after=(page[-1]['reminder_date'], page[-1]['id']) if page else None)
+	for i in range(count):
+		timed('get_reminders_due_before', storage.get_reminders_due_before, START + timedelta(minutes=i))
+	f = io.BytesIO()
+	timed('export_reminders ({} rows)'.format(count + 1), storage.export_reminders, chat_id, 0, f)
+
+	reminders = storage.get_reminders_due_before(START + timedelta(minutes=count))
+	for reminder in reminders:
+		timed('complete_reminders', storage.complete_reminders, [reminder['id']], {})
+	timed('delete_reminders ({} rows)'.format(count), storage.delete_reminders, [reminder['id'] for reminder in storage.get_user_reminders(chat_id)])
+	return latencies
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Compares latency of storage backend operations, tests/test_storage.py checks they behave the same. postgres needs scratch database')
+	parser.add_argument('--backends', nargs='+', choices=['postgres', 'sqlite', 'memory'], default=['memory', 'sqlite'])
+	parser.add_argument('--count', type=int, default=200, help='chats and reminders every operation is measured on')
+	args = parser.parse_args()
+
+	fake = FakeTelegram().start()
+	# bot modules read configuration on import, conflict messages go to fake telegram
+	os.environ['REMEMBERANCER_API_URL'] = fake.url
+	os.environ.setdefault('REMEMBERANCER_BOT_TOKEN', 'bench')
+	from bot.extra.logger import logger
+	from bot.storage import create_storage
+	from bot import storage as storage_module
+
+	results = {}
+	with tempfile.TemporaryDirectory() as directory:
+		storage_module.SQLITE_PATH = os.path.join(directory, 'bench.db')
+		for kind in args.backends:
+			storage = create_storage(logger, kind)
+			storage.delete_chats(CHAT_BASE)
+			results[kind] = measure(storage, args.count)
+			storage.delete_chats(CHAT_BASE)
+	fake.stop()
+
+	first = args.backends[0]
+	operations = list(results[first])
+	width = max(map(len, operations))
+	print('{op:<{width}}  {backends}'.format(op='p50 / p95, ms', width=width, backends='  '.join('{:>17}'.format(kind) for kind in args.backends)))
+	for operation in operations:
+		cells = []
+		for kind in args.backends:
+			values = results[kind][operation]
+			cells.append('{:>8.3f} / {:>6.3f}'.format(percentile(values, 0.5) * 1000, percentile(values, 0.95) * 1000))
+		print('{op:<{width}}  {cells}'.format(op=operation, width=width, cells='  '.join(cells)))
+
+
+if __name__ == '__main__':
+	main()
@@ -1,32 +1,139 @@
 import os
+import json
 import requests
+from requests.adapters import HTTPAdapter
 from urllib.parse import urlencode
 
 from .extra.exceptions import TokenError, base_method
 from .extra.logger import logger
+from .extra.rate_limiter import RateLimiter
 
 
 TOKEN = os.getenv('REMEMBERANCER_BOT_TOKEN')
 if TOKEN is None:
 	raise TokenError
 
+# telegram bot api server, can be changed to local server for testing
+API_URL = os.getenv('REMEMBERANCER_API_URL', 'https://api.telegram.org').rstrip('/')
+# seconds added to long polling timeout so server answers before request times out
+POLL_TIMEOUT_MARGIN = 10
+CONNECT_TIMEOUT = float(os.getenv('REMEMBERANCER_HTTP_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.getenv('REMEMBERANCER_HTTP_READ_TIMEOUT', 30))
+# how many times request is repeated after 429 Too Many Requests
+MAX_RETRIES = 3
+# commands sending messages to chats, telegram limits how often they are called
+RATE_LIMITED_COMMANDS = {'sendMessage', 'sendDocument', 'editMessageText', 'editMessageReplyMarkup'}
+
+# one session keeps connections to telegram alive between requests
+session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=int(os.getenv('REMEMBERANCER_HTTP_POOL_SIZE', 32)))
+session.mount('https://', _adapter)
+session.mount('http://', _adapter)
+
+rate_limiter = RateLimiter(
+	global_rate=float(os.getenv('REMEMBERANCER_GLOBAL_RATE', 30)),
+	chat_rate=float(os.getenv('REMEMBERANCER_CHAT_RATE', 1)),
+	chat_burst=float(os.getenv('REMEMBERANCER_CHAT_BURST', 3))
+)
+
+
+def retry_after(response):
+	"""returns seconds telegram asked to wait in 429 response"""
+	try:
+		return response.json()['parameters']['retry_after']
+	except (ValueError, KeyError, TypeError):
+		return 1
+
 
 @base_method
-def get(command: str, data: dict = None):
+def get(command: str, data: dict = None, timeout: float = None):
 	"""function for making get request to telegram server with command"""
+	if timeout is None:
+		timeout = READ_TIMEOUT
 	if data:
-		response = requests.get('https://api.telegram.org/bot{token}/{command}?{data}'.format(token=TOKEN, command=command, data=urlencode(data)))
+		response = session.get('{api_url}/bot{token}/{command}?{data}'.format(api_url=API_URL, token=TOKEN, command=command, data=urlencode(data)), timeout=(CONNECT_TIMEOUT, timeout))
 	else:
-		response = requests.get('https://api.telegram.org/bot{token}/{command}'.format(token=TOKEN, command=command))
+		response = session.get('{api_url}/bot{token}/{command}'.format(api_url=API_URL, token=TOKEN, command=command), timeout=(CONNECT_TIMEOUT, timeout))
+	if response.status_code != 200:
+		logger.warning('status code is {}'.format(response.status_code))
+	return response
+
+
+@base_method
+def post(command: str, data: dict, files: dict = None):
+	"""function for making post request to telegram server with command.
+	files maps field name to (file name, file object) and is sent as multipart upload.
+	waits for rate limiter and repeats request if telegram answers 429 Too Many Requests"""
+	chat_id = data.get('chat_id') if data else None
+	for attempt in range(MAX_RETRIES + 1):
+		if command in RATE_LIMITED_COMMANDS:
+			rate_limiter.acquire(chat_id)
+		if files:
+			# repeated request uploads files from the beginning
+			for _, f in files.values():
+				f.seek(0)
+		response = session.post('{api_url}/bot{token}/{command}'.format(api_url=API_URL, token=TOKEN, command=command), data=data, files=files, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+		if response.status_code != 429 or attempt == MAX_RETRIES:
+			break
+		seconds = retry_after(response)
+		logger.warning('too many requests to chat {chat_id}, retrying after {seconds}s'.format(chat_id=chat_id, seconds=seconds))
+		rate_limiter.pause(chat_id, seconds)
+
 	if response.status_code != 200:
 		logger.warning('status code is {}'.format(response.status_code))
 	return response
 
 
 @base_method
-def post(command: str, data: dict):
-	"""function for making post request to telegram server with command"""
-	response = requests.post('https://api.telegram.org/bot{token}/{command}'.format(token=TOKEN, command=command), data=data)
+def get_updates(offset: int = None, timeout: int = 0, limit: int = 100, allowed_updates: list = None):
+	"""long polls telegram server for updates.
+	server holds request up to timeout seconds if there are no updates.
+	returns list of updates or None if request failed"""
+	data = {'timeout': timeout, 'limit': limit}
+	if offset is not None:
+		data['offset'] = offset
+	if allowed_updates is not None:
+		data['allowed_updates'] = json.dumps(allowed_updates)
+
+	try:
+		response = get('getUpdates', data=data, timeout=timeout + POLL_TIMEOUT_MARGIN)
+	except requests.exceptions.RequestException:
+		logger.warning('getUpdates request failed')
+		return None
+
 	if response.status_code != 200:
-		logger.warning('status code:', response.status_code)
+		return None
+	return response.json()['result']
+
+
+@base_method
+def set_webhook(url: str, secret_token: str = None, allowed_updates: list = None, drop_pending_updates: bool = False):
+	"""makes telegram push updates to url. returns True if webhook is set"""
+	data = {'url': url, 'drop_pending_updates': drop_pending_updates}
+	if secret_token is not None:
+		data['secret_token'] = secret_token
+	if allowed_updates is not None:
+		data['allowed_updates'] = json.dumps(allowed_updates)
+	return post('setWebhook', data=data).status_code == 200
+
+
+@base_method
+def delete_webhook():
+	"""removes webhook so updates can be received with getUpdates"""
+	return post('deleteWebhook', data={'drop_pending_updates': False}).status_code == 200
+
+
+@base_method
+def download_file(file_id: str):
+	"""returns streamed response with content of file sent to bot or None if file is unavailable"""
+	response = get('getFile', data={'file_id': file_id})
+	if response.status_code != 200:
+		return None
+	file_path = response.json()['result']['file_path']
+
+	response = session.get('{api_url}/file/bot{token}/{path}'.format(api_url=API_URL, token=TOKEN, path=file_path), stream=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+	if response.status_code != 200:
+		logger.warning('status code is {}'.format(response.status_code))
+		response.close()
+		return None
 	return response
@@ -0,0 +1,216 @@
+import os
+import time
+import asyncio
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from .bot import Bot
+from .extra.exceptions import base_method
+from .extra import metrics
+
+
+class AsyncBot(Bot):
+	"""Bot running update intake, update handling, reminder scheduling and sending as independent asyncio tasks.
+	Blocking telegram and database calls are run in thread pool, so slow call stalls only its own task"""
+
+	def __init__(self, webhook=None, cluster: bool = False):
+		super().__init__(webhook, cluster)
+		# threads for blocking calls, also limits number of updates handled at once
+		self.WORKERS = int(os.getenv('REMEMBERANCER_ASYNC_WORKERS', 16))
+		self.UPDATE_QUEUE_SIZE = 1000
+		# how often delivered reminders are deleted from database
+		self.FINALIZE_INTERVAL = 1
+		self.executor = ThreadPoolExecutor(max_workers=self.WORKERS + 2, thread_name_prefix='bot-io')
+		# how often event loop lag is measured
+		self.LAG_INTERVAL = 0.5
+		self.loop = None
+		self.updates = None
+		# updates which are being handled now
+		self.in_progress = 0
+		# ids of received updates which are not handled yet, updates are handled out of order
+		self.unfinished = set()
+		self.unfinished_lock = threading.Lock()
+		self.DBHandler.add_listener(self)
+
+	def start(self):
+		"""starts bot in asyncio event loop"""
+		asyncio.run(self.run())
+
+	async def run(self):
+		"""runs all bot tasks until one of them fails"""
+		self.loop = asyncio.get_running_loop()
+		self.loop.set_default_executor(self.executor)
+		self.updates = asyncio.Queue(maxsize=self.UPDATE_QUEUE_SIZE)
+		self.wakeup = asyncio.Event()
+		self.handling = asyncio.Semaphore(self.WORKERS)
+		# chat id -> [lock, number of tasks using it]
+		self.chat_locks = {}
+
+		metrics.start_server()
+		# outgoing messages are sent by outbox worker threads
+		self.outbox.start()
+		if self.cluster is None:
+			await self.io(self.start_intake)
+		else:
+			await self.io(self.cluster.heartbeat)
+		await self.io(self.scheduler.reconcile, self.cold_start)
+		self.cold_start = False
+
+		tasks = [self.intake(), self.dispatch(), self.schedule(), self.finalize()]
+		if metrics.ENABLED:
+			tasks.append(self.measure_lag())
+		await asyncio.gather(*tasks)
+
+	def pending_update_count(self):
+		"""returns number of queued updates and updates being handled"""
+		count = super().pending_update_count() + self.in_progress
+		if self.updates is not None:
+			count += self.updates.qsize()
+		return count
+
+	async def measure_lag(self):
+		"""measures how late event loop wakes sleeping tasks"""
+		while True:
+			started = time.monotonic()
+			await asyncio.sleep(self.LAG_INTERVAL)
+			self.loop_lag = time.monotonic() - started - self.LAG_INTERVAL
+
+	async def io(self, fun, *args, **kwargs):
+		"""runs blocking function in thread pool"""
+		return await self.loop.run_in_executor(None, functools.partial(fun, *args, **kwargs))
+
+	async def intake(self):
+		"""long polls telegram and puts updates to queue"""
+		while True:
+			try:
+				updates = await self.io(self.receive_updates, self.POLL_TIMEOUT)
+			except Exception:
+				updates = None
+			if updates is None:
+				await asyncio.sleep(self.POLL_RETRY_DELAY)
+				continue
+
+			with self.unfinished_lock:
+				self.unfinished.update(update['update_id'] for update in updates)
+			for update in updates:
+				await self.updates.put(update)
+			self.update_last_id(updates)
+
+	async def dispatch(self):
+		"""starts handling task for every update"""
+		while True:
+			update = await self.updates.get()
+			await self.handling.acquire()
+			asyncio.create_task(self.handle(update))
+
+	def checkpoint(self, update: dict):
+		"""returns id of update all updates up to which are handled once update is committed"""
+		with self.unfinished_lock:
+			others = [update_id for update_id in self.unfinished if update_id != update['update_id']]
+		if others:
+			return min(min(others) - 1, max(self.last_id, update['update_id']))
+		return max(self.last_id, update['update_id'])
+
+	def finish(self, update: dict):
+		with self.unfinished_lock:
+			self.unfinished.discard(update.get('update_id'))
+
+	async def handle(self, update: dict):
+		"""processes one update. updates of one chat are processed in order they came"""
+		try:
+			chat_id = self.update_chat_id(update)
+		except KeyError:
+			self.logger.warning('update {} has no chat'.format(update.get('update_id')))
+			self.finish(update)
+			self.handling.release()
+			return
+
+		entry = self.chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+		entry[1] += 1
+		self.in_progress += 1
+		try:
+			async with entry[0]:
+				try:
+					await self.io(self.process, update)
+				finally:
+					if self.cluster is not None:
+						await self.io(self.cluster.done, [update['update_id']])
+		except Exception:
+			# already logged by base_method
+			pass
+		finally:
+			self.finish(update)
+			self.in_progress -= 1
+			entry[1] -= 1
+			if entry[1] == 0:
+				del self.chat_locks[chat_id]
+			self.handling.release()
+
+	async def schedule(self):
+		"""waits until the nearest reminder is due and queues due reminders"""
+		while True:
+			try:
+				if self.scheduler.seconds_until_reconcile() == 0:
+					await self.io(self.scheduler.reconcile)
+			except Exception:
+				pass
+
+			wait = self.scheduler.seconds_until_reconcile()
+			until_next = self.scheduler.seconds_until_next()
+			if until_next is not None:
+				wait = min(wait, until_next)
+			if len(self.catchup):
+				wait = min(wait, 1)
+
+			if wait > 0:
+				self.wakeup.clear()
+				try:
+					await asyncio.wait_for(self.wakeup.wait(), timeout=wait)
+				except asyncio.TimeoutError:
+					pass
+
+			due = self.split_late(self.scheduler.pop_due())
+			if due:
+				try:
+					due = await self.io(self.claim, due)
+				except Exception:
+					for reminder in due:
+						self.scheduler.retry(reminder)
+					due = []
+
+			for reminder in due:
+				try:
+					self.send_reminder(reminder)
+				except Exception:
+					self.scheduler.retry(reminder)
+
+			if len(self.catchup):
+				try:
+					await self.io(self.send_catchup)
+				except Exception:
+					pass
+
+	async def finalize(self):
+		"""periodically deletes delivered reminders from database in one batch"""
+		while True:
+			await asyncio.sleep(self.FINALIZE_INTERVAL)
+			try:
+				await self.io(self.finalize_reminders)
+			except Exception:
+				pass
+
+	def reminder_sent(self, reminder: dict, response):
+		"""wakes scheduler task up if failed reminder is scheduled again"""
+		super().reminder_sent(reminder, response)
+		if (response is None or response.status_code != 200) and self.loop is not None:
+			self.loop.call_soon_threadsafe(self.wakeup.set)
+
+	@base_method
+	def on_reminder_set(self, reminder: dict):
+		"""wakes scheduler task up, new reminder may be due earlier than the nearest one"""
+		if self.loop is not None:
+			self.loop.call_soon_threadsafe(self.wakeup.set)
+
+	def on_reminder_deleted(self, reminder: dict):
+		pass
@@ -1,94 +1,453 @@
 import os
-from random import choice
+import math
+import time
+import threading
 from datetime import datetime, timedelta
-from pprint import pprint
 
 from .extra.exceptions import TokenError, base_method
 from .extra.logger import logger
-from .db_handler import DBHandler
+from .extra import metrics
+from .storage import create_storage
 from .command_handler import CommandHandler
-from .api_functions import get, post
+from .scheduler import ReminderScheduler
+from .catchup import CatchUp
+from .message_queue import MessageQueue
+from . import recurrence
+from .router import context_middleware, mode_middleware, log_middleware, timing_middleware
+from .api_functions import get_updates, set_webhook, delete_webhook, retry_after
 
 
 class Bot:
 	"""Main bot class. Interacts with user: operates with updates and sends reminders"""
 
-	def __init__(self):
+	def __init__(self, webhook=None, cluster: bool = False):
 		with open('bot/phrases.txt', 'r') as f:
 			self.PHRASES = f.readlines()
 		self.logger = logger
 		self.TOKEN = os.getenv('REMEMBERANCER_BOT_TOKEN')
 		if self.TOKEN is None:
 			raise TokenError
-		self.DBHandler = DBHandler(self.logger)
-		self.CommandHandler = CommandHandler(self.logger)
-		self.update_last_id()
+		# longest time in seconds telegram server holds getUpdates request
+		self.POLL_TIMEOUT = int(os.getenv('REMEMBERANCER_POLL_TIMEOUT', 25))
+		self.POLL_LIMIT = 100
+		self.ALLOWED_UPDATES = ['message', 'callback_query']
+		# delay before polling again after failed getUpdates request
+		self.POLL_RETRY_DELAY = 1
+		# id of the last update received, polling continues after it
+		self.last_id = 0
+		# True while updates received while bot was offline are processed
+		self.catching_up = False
+		self.backlog_processed = 0
+		self.poll_latency = None
+		# seconds main loop spent working, not waiting for updates, in last iteration
+		self.loop_lag = None
+		# received updates which are not processed yet
+		self.pending_updates = 0
+		# WebhookServer receiving updates, bot polls getUpdates if it is None
+		self.webhook = webhook
+		# sent reminders waiting to be deleted from database, filled by sender threads
+		self.delivered = []
+		# failed deliveries waiting to be saved, tuples (reminder id, next attempt time, status, error)
+		self.failed = []
+		self.delivered_lock = threading.Lock()
+		# failed delivery is tried again after delay doubling from RETRY_BASE_DELAY up to RETRY_MAX_DELAY,
+		# reminder fails after MAX_ATTEMPTS attempts or at once if telegram answers with PERMANENT_ERRORS
+		self.MAX_ATTEMPTS = int(os.getenv('REMEMBERANCER_DELIVERY_MAX_ATTEMPTS', 8))
+		self.RETRY_BASE_DELAY = 5
+		self.RETRY_MAX_DELAY = 3600
+		# 403 is bot blocked by user or removed from chat, 400 is chat not found or message rejected
+		self.PERMANENT_ERRORS = {400, 403}
+		# seconds reminder being sent is not loaded again, it is sent again after that if bot died while sending it
+		self.DELIVERY_LEASE = float(os.getenv('REMEMBERANCER_DELIVERY_LEASE', 300))
+		# reminders sent more than LATE_AFTER seconds late are delivered with late mark (deliver) or dropped (drop)
+		self.LATE_POLICY = os.getenv('REMEMBERANCER_LATE_POLICY', 'deliver')
+		self.LATE_AFTER = int(os.getenv('REMEMBERANCER_LATE_AFTER', 30))
+		# late reminders delivered after downtime, combined per chat and paced
+		self.catchup = CatchUp(self.logger)
+		self.outbox = MessageQueue(self.logger)
+		# postgres, sqlite or in-memory storage chosen by REMEMBERANCER_STORAGE
+		self.DBHandler = create_storage(self.logger)
+		self.CommandHandler = CommandHandler(self.logger, self.DBHandler, self.outbox)
+		# every update runs in chat context, then mode is loaded once for gating and handler
+		self.router = self.CommandHandler.router
+		self.router.use(context_middleware(self.DBHandler, self.checkpoint))
+		self.router.use(mode_middleware(self.DBHandler))
+		self.router.use(log_middleware(lambda: self.last_id))
+		self.router.use(timing_middleware)
+		self.scheduler = ReminderScheduler(self.DBHandler, self.logger)
+		self.DBHandler.add_listener(self.scheduler)
+		# coordinates with other instances sharing database, None if bot runs alone
+		self.cluster = None
+		if cluster:
+			if not self.DBHandler.SHARED:
+				raise ValueError('cluster needs storage shared by instances, {} is not'.format(type(self.DBHandler).__name__))
+			from .cluster import Cluster
+			self.cluster = Cluster(self.DBHandler, self.logger)
+		# cluster leader receives updates from telegram, True when intake is prepared
+		self.intake_started = False
+		# False after the first start. reminders in flight are kept in outbox when start is called again after failure
+		self.cold_start = True
+		self.register_metrics()
+
+	def register_metrics(self):
+		"""registers bot gauges in metrics registry"""
+		metrics.registry.gauge('bot_main_loop_lag_seconds', 'Time main loop spent working in last iteration', lambda: self.loop_lag)
+		metrics.registry.gauge('bot_pending_updates', 'Received updates which are not processed yet', self.pending_update_count)
+		metrics.registry.gauge('bot_due_unsent_reminders', 'Due reminders which are not delivered yet', self.scheduler.due_count)
+		metrics.registry.gauge('bot_outbox_depth', 'Messages waiting in outgoing queue', self.outbox.depth)
+		metrics.registry.gauge('bot_catchup_backlog', 'Overdue reminders waiting to be sent after downtime', lambda: len(self.catchup))
+		if self.DBHandler.chat_cache is not None:
+			metrics.registry.gauge('bot_chat_cache_hit_ratio', 'Share of chat lookups served from cache', lambda: self.DBHandler.chat_cache.stats()['hit_ratio'])
+
+	def pending_update_count(self):
+		"""returns number of received updates which are not processed yet"""
+		count = self.pending_updates
+		if self.webhook is not None:
+			count += self.webhook.updates.qsize()
+		return count
 
 	@base_method
 	def start(self):
 		"""starts bot"""
-		updates = get('getUpdates').json()['result']
-		if len(updates) > 0:
-			last_id = updates[-1]['update_id']
-			get('getUpdates', data={'offset': last_id + 1})
+		metrics.start_server()
+		self.outbox.start()
+		if self.cluster is None:
+			self.start_intake()
+		else:
+			self.cluster.heartbeat()
+
+		self.scheduler.reconcile(reset=self.cold_start)
+		self.cold_start = False
 
 		while True:
+			started = time.monotonic()
 			updates = self.process_updates()
 			self.update_last_id(updates)
 			self.send_reminders()
+			self.loop_lag = time.monotonic() - started - (self.poll_latency or 0)
+
+	def stop(self):
+		"""finalizes delivered reminders, stops receiving updates and closes database connections"""
+		try:
+			self.finalize_reminders()
+		except Exception:
+			# already logged by base_method, reminders are sent again after their lease
+			pass
+		if self.webhook is not None:
+			self.webhook.stop()
+		if self.cluster is not None:
+			self.cluster.disconnect()
+		self.DBHandler.close()
+
+	@base_method
+	def start_intake(self):
+		"""prepares receiving updates: registers webhook or resumes polling after the last processed update.
+		cluster leader continues from the last update received by previous leader.
+		updates are skipped only when no update was ever processed"""
+		resume_id = self.DBHandler.get_state('last_update_id')
+		if resume_id is not None:
+			self.last_id = max(self.last_id, resume_id)
+			# backlog is fetched in batches without waiting, reminders are sent between them
+			self.catching_up = True
+			self.backlog_processed = 0
+			self.logger.warning('resuming after update {}'.format(self.last_id))
+
+		if self.webhook is not None:
+			self.webhook.start()
+			secret_token = self.webhook.secret_token
+			set_webhook(self.webhook.url, secret_token=secret_token, allowed_updates=self.ALLOWED_UPDATES, drop_pending_updates=resume_id is None)
+		else:
+			delete_webhook()
+			if resume_id is None:
+				self.skip_old_updates()
+		self.intake_started = True
+
+	@base_method
+	def skip_old_updates(self):
+		"""skips updates received before bot was ever started. negative offset returns only the last update
+		and confirms older ones, the last one is confirmed by the next poll"""
+		updates = get_updates(offset=-1, limit=1, allowed_updates=self.ALLOWED_UPDATES)
+		if updates:
+			self.last_id = updates[-1]['update_id']
+			self.DBHandler.set_last_update_id(self.last_id)
+
+	@base_method
+	def fetch_updates(self, timeout: int):
+		"""long polls for updates after last_id or waits for updates pushed to webhook.
+		returns None if request failed"""
+		if self.catching_up:
+			timeout = 0
+		started = time.monotonic()
+		if self.webhook is not None:
+			updates = self.webhook.get_updates(timeout, limit=self.POLL_LIMIT)
+		else:
+			updates = get_updates(offset=self.last_id + 1, timeout=timeout, limit=self.POLL_LIMIT, allowed_updates=self.ALLOWED_UPDATES)
+		self.poll_latency = time.monotonic() - started
+
+		if updates is not None:
+			self.logger.info('poll returned {n} updates in {latency:.3f}s (timeout {timeout}s)'.format(n=len(updates), latency=self.poll_latency, timeout=timeout))
+			if self.catching_up:
+				self.backlog_processed += len(updates)
+				if len(updates) < self.POLL_LIMIT:
+					self.catching_up = False
+					self.logger.warning('caught up with {} updates received while bot was offline'.format(self.backlog_processed))
+		return updates
+
+	@base_method
+	def receive_updates(self, timeout: int):
+		"""returns updates this instance must process or None if receiving failed.
+		in cluster mode leader fetches updates and assigns them to instances, then every instance takes its own"""
+		if self.cluster is None:
+			return self.fetch_updates(timeout)
+
+		self.cluster.maybe_heartbeat()
+		timeout = min(timeout, self.cluster.HEARTBEAT_INTERVAL)
+		if not self.cluster.is_leader:
+			self.intake_started = False
+			self.cluster.wait(timeout)
+			return self.cluster.take_updates(self.POLL_LIMIT)
+
+		if not self.intake_started:
+			self.start_intake()
+		updates = self.fetch_updates(timeout)
+		if updates:
+			chat_ids = [self.update_chat_id(update) if 'message' in update or 'callback_query' in update else None for update in updates]
+			if not self.cluster.dispatch(updates, chat_ids):
+				# updates are fetched again, last_id is not moved
+				return None
+			self.update_last_id(updates)
+		return self.cluster.take_updates(self.POLL_LIMIT)
 
 	@base_method
 	def process_updates(self):
 		"""manages all new updates"""
+		updates = self.receive_updates(self.poll_timeout())
 
-		updates = get('getUpdates', data={'offset': self.last_id + 1}).json()['result']
+		if updates is None:
+			time.sleep(self.POLL_RETRY_DELAY)
+			return []
 
 		if len(updates) == 0:
 			return updates
 
-		for update in updates:
-			self.process(update)
+		self.pending_updates = len(updates)
+		processed = []
+		try:
+			for update in updates:
+				try:
+					self.process(update)
+				except Exception:
+					# already logged by base_method, one broken update doesn't restart bot
+					pass
+				finally:
+					self.pending_updates -= 1
+					processed.append(update['update_id'])
+		finally:
+			if self.cluster is not None:
+				self.cluster.done(processed)
+			elif processed:
+				# updates which failed or had no chat are not processed again either
+				self.DBHandler.set_last_update_id(processed[-1])
 
 		return updates
 
+	@base_method
+	def poll_timeout(self):
+		"""returns long polling timeout in seconds.
+		polling ends early enough to send the nearest reminder on time and reconcile scheduler"""
+		seconds = self.scheduler.seconds_until_reconcile()
+		until_next = self.scheduler.seconds_until_next()
+		if until_next is not None:
+			seconds = min(seconds, until_next)
+		if len(self.catchup):
+			# backlog is sent a bit every second
+			seconds = min(seconds, 1)
+
+		# telegram accepts only whole seconds, rest is waited in send_reminders
+		return max(0, min(self.POLL_TIMEOUT, math.floor(seconds)))
+
+	@staticmethod
+	def update_chat_id(update: dict):
+		"""returns id of chat which update came from"""
+		if 'callback_query' in update:
+			return update['callback_query']['message']['chat']['id']
+		return update['message']['chat']['id']
+
 	@base_method
 	def process(self, update: dict):
-		"""main function for processing updates"""
+		"""main function for processing updates. effects of update are committed together with its id,
+		so update is not processed again after restart"""
+		request = self.router.request(update)
 		if 'callback_query' in update:
-			chat_id = update['callback_query']['message']['chat']['id']
-			text = update['callback_query']['data']
-			message_id = update['callback_query']['message']['message_id']
-			print('last_id:', '{:>8}'.format(self.last_id), 'text:', '{:>15}'.format(text), 'id:', update['update_id'])
-		else:
-			chat_id = update['message']['chat']['id']
+			# stops loading animation on button
+			self.outbox.post('answerCallbackQuery', data={'callback_query_id': update['callback_query']['id']})
+		self.router.dispatch(request)
 
-			# if sticker or image or smth else(not text)
-			if 'text' not in update['message']:
-				print('last_id:', '{:>8}'.format(self.last_id), 'text:', '{:>15}'.format('Not text'), 'id:', update['update_id'])
-				post('sendMessage', data={'chat_id': update['message']['chat']['id'], 'text': choice(self.PHRASES)})
-				return
+	def checkpoint(self, update: dict):
+		"""returns update id saved as processed together with effects of update"""
+		return update['update_id']
 
-			print('last_id:', '{:>8}'.format(self.last_id), 'text:', '{:>15}'.format(update['message']['text']), 'id:', update['update_id'])
-			text = update['message']['text']
-			message_id = None
+	@base_method
+	def send_reminders(self):
+		"""queues reminders which time has come and deletes delivered ones"""
+		self.scheduler.maybe_reconcile()
 
-		if text.startswith('/'):
-			self.CommandHandler.process_command(chat_id, text)
-		else:
-			self.CommandHandler.process_text(chat_id, text, message_id)
+		# wait for reminder due in less than a second to send it exactly on time
+		until_next = self.scheduler.seconds_until_next()
+		if until_next is not None and 0 < until_next < 1:
+			time.sleep(until_next)
+
+		for reminder in self.claim(self.split_late(self.scheduler.pop_due())):
+			self.send_reminder(reminder)
+		self.send_catchup()
+
+		self.finalize_reminders()
+
+	def split_late(self, reminders: list):
+		"""moves late reminders to catch-up if they are delivered by late policy. returns the rest"""
+		if self.LATE_POLICY != 'deliver' or not reminders:
+			return reminders
+		limit = datetime.utcnow() - timedelta(seconds=self.LATE_AFTER)
+		late = [reminder for reminder in reminders if reminder['reminder_date'] < limit]
+		if late:
+			self.catchup.add(late)
+			reminders = [reminder for reminder in reminders if reminder['reminder_date'] >= limit]
+		return reminders
 
 	@base_method
-	def send_reminders(self):
-		"""sends reminders which time has come and delete it"""
-		rems_to_send = self.DBHandler.get_reminders_to_send()
-		for reminder in rems_to_send:
-			success = self.send_reminder(reminder)
-			if success:
-				self.DBHandler.delete_reminder(reminder)
+	def send_catchup(self):
+		"""sends late reminders as fast as catch-up rate allows, reminders of one chat in one message"""
+		groups = self.catchup.take()
+		if groups:
+			claimed = {reminder['id'] for reminder in self.claim([reminder for group in groups for reminder in group])}
+			for group in groups:
+				group = [reminder for reminder in group if reminder['id'] in claimed]
+				if len(group) == 1:
+					self.send_reminder(group[0], MessageQueue.CATCHUP)
+				elif group:
+					self.send_combined(group)
+		self.catchup.report()
+
+	@base_method
+	def send_combined(self, reminders: list):
+		"""queues one message with several late reminders of one chat"""
+		chat_id = reminders[0]['chat_id']
+		tz = self.DBHandler.get_timezone(chat_id) or 0
+		lines = ['<b>You have {} missed reminders</b>:'.format(len(reminders))]
+		for reminder in reminders:
+			dt = reminder['reminder_date'] + timedelta(hours=tz)
+			line = '{dt.day:0>2}/{dt.month:0>2} {dt.hour:0>2}:{dt.minute:0>2}'.format(dt=dt)
+			if reminder['reminder_text'] != '':
+				line += ' <i>' + reminder['reminder_text'] + '</i>'
+			lines.append(line)
+
+		def sent(response):
+			for reminder in reminders:
+				self.reminder_sent(reminder, response)
+
+		self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': '\n'.join(lines), 'parse_mode': 'HTML'}, priority=MessageQueue.CATCHUP, callback=sent)
+
+	@base_method
+	def claim(self, reminders: list):
+		"""returns reminders this instance must send. in cluster mode reminders claimed by other instances are dropped"""
+		if not reminders:
+			return reminders
+		if self.cluster is None:
+			self.DBHandler.start_delivery([reminder['id'] for reminder in reminders], self.DELIVERY_LEASE)
+			return reminders
+
+		claimed = self.cluster.claim(reminders)
+		if claimed is None:
+			for reminder in reminders:
+				self.scheduler.retry(reminder)
+			return []
+
+		claimed_ids = {reminder['id'] for reminder in claimed}
+		for reminder in reminders:
+			if reminder['id'] not in claimed_ids:
+				# other instance sends it, it is loaded again on reconcile if that instance dies
+				self.scheduler.finish(reminder['id'])
+		return claimed
+
+	@base_method
+	def finalize_reminders(self):
+		"""deletes delivered one-shot reminders and moves recurring ones to their next occurrence in one batch.
+		reminders stay in flight and are finalized later if database is unavailable"""
+		self.save_failures()
+		with self.delivered_lock:
+			batch, self.delivered = self.delivered, []
+		if not batch:
+			return
+
+		try:
+			completed, kept, deleted_ids, advanced = self.plan_completion(batch)
+			result = self.DBHandler.complete_reminders(deleted_ids, advanced) if completed else ([], [], [])
+		except BaseException:
+			self.restore_delivered(batch)
+			raise
+		if result is None:
+			self.restore_delivered(batch)
+			return
+
+		conflicting = set(result[2])
+		postponed = []
+		for reminder in completed:
+			if reminder['id'] in conflicting:
+				# next occurrence is taken by other reminder of chat, following one is tried in next batch
+				postponed.append(dict(reminder, reminder_date=advanced[reminder['id']]))
+			else:
+				self.scheduler.finish(reminder['id'])
+		self.restore_delivered(postponed + kept)
+
+	def plan_completion(self, batch: list):
+		"""returns (reminders completed now, reminders kept for next batch, ids to delete, id -> next occurrence).
+		recurring reminders which chat timezone can't be read are kept, rules without next occurrence are deleted"""
+		now = datetime.utcnow()
+		completed = []
+		kept = []
+		deleted_ids = []
+		advanced = {}
+		# occurrences taken by reminders of this batch
+		taken = set()
+		for reminder in batch:
+			rule = recurrence.parse_rule(reminder.get('recurrence'))
+			if rule is None:
+				completed.append(reminder)
+				deleted_ids.append(reminder['id'])
+				continue
+
+			tz = 0
+			if rule.interval is None:
+				# monthly and cron rules occur in chat timezone, chat is not told about database errors here
+				tz = self.DBHandler.get_timezone(reminder['chat_id'], quiet=True)
+				if tz is None:
+					kept.append(reminder)
+					continue
+
+			try:
+				next_date = rule.next(reminder['reminder_date'], max(now, reminder['reminder_date']), tz)
+				while (reminder['chat_id'], next_date) in taken:
+					next_date = rule.next(next_date, next_date, tz)
+			except ValueError as e:
+				self.logger.warning('reminder {} has no next occurrence of {}: {}'.format(reminder['id'], rule, e))
+				completed.append(reminder)
+				deleted_ids.append(reminder['id'])
+				continue
+			taken.add((reminder['chat_id'], next_date))
+			completed.append(reminder)
+			advanced[reminder['id']] = next_date
+		return completed, kept, deleted_ids, advanced
+
+	def restore_delivered(self, reminders: list):
+		"""puts reminders back to be finalized in next batch"""
+		if not reminders:
+			return
+		with self.delivered_lock:
+			self.delivered = reminders + self.delivered
 
 	@base_method
-	def send_reminder(self, reminder: dict):
-		"""sends one reminder with values in reminder dict"""
+	def send_reminder(self, reminder: dict, priority: int = MessageQueue.REMINDER):
+		"""queues one reminder with values in reminder dict. reminder_sent is called when it is sent"""
 		try:
 			date = reminder['reminder_date']
 			chat_id = reminder['chat_id']
@@ -99,26 +458,83 @@ class Bot:
 			self.logger.error('promblem with reminder')
 			raise err
 
-		if datetime.utcnow() - date > timedelta(seconds=30):
-			return True
+		late = datetime.utcnow() - date
+		if late > timedelta(seconds=self.LATE_AFTER):
+			if self.LATE_POLICY == 'drop':
+				self.logger.warning('reminder {} is dropped, it is {} late'.format(reminder['id'], late))
+				self.reminder_delivered(reminder)
+				return
+			text = text.replace('</b>', ' (late by {})</b>'.format(self.late_label(late)), 1)
 
-		response = post('sendMessage', data={'chat_id': chat_id, 'text': text, 'parse_mode': 'HTML'})
+		self.outbox.post(
+			'sendMessage',
+			data={'chat_id': chat_id, 'text': text, 'parse_mode': 'HTML'},
+			priority=priority,
+			callback=lambda response: self.reminder_sent(reminder, response)
+		)
 
-		if response.status_code != 200:
-			return False
-		else:
-			return True
+	@staticmethod
+	def late_label(late: timedelta):
+		minutes = int(late.total_seconds() // 60)
+		if minutes < 60:
+			return '{} min'.format(max(minutes, 1))
+		if minutes < 60 * 24:
+			return '{} h {} min'.format(minutes // 60, minutes % 60)
+		return '{} days'.format(minutes // (60 * 24))
 
 	@base_method
-	def update_last_id(self, updates: list = None):
+	def reminder_sent(self, reminder: dict, response):
+		"""called by sender thread with telegram response to reminder, None if request failed.
+		delivered reminders are completed in next batch, failed ones are tried again with exponential backoff
+		until they fail permanently"""
+		if response is not None and response.status_code == 200:
+			self.reminder_delivered(reminder)
+			return
 
-		if updates is None:
-			updates = get('getUpdates').json()['result']
+		attempts = (reminder.get('attempts') or 0) + 1
+		error = self.delivery_error(response)
+		if (response is not None and response.status_code in self.PERMANENT_ERRORS) or attempts >= self.MAX_ATTEMPTS:
+			self.logger.warning('reminder {} failed after {} attempts: {}'.format(reminder['id'], attempts, error))
+			self.scheduler.finish(reminder['id'])
+			failure = (reminder['id'], None, 'failed', error)
+		else:
+			delay = min(self.RETRY_MAX_DELAY, self.RETRY_BASE_DELAY * 2 ** (attempts - 1))
+			if response is not None and response.status_code == 429:
+				delay = max(delay, retry_after(response))
+			next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+			self.scheduler.retry(dict(reminder, attempts=attempts, next_attempt_at=next_attempt_at), delay)
+			failure = (reminder['id'], next_attempt_at, 'pending', error)
+
+		with self.delivered_lock:
+			self.failed.append(failure)
 
+	def reminder_delivered(self, reminder: dict):
+		with self.delivered_lock:
+			self.delivered.append(reminder)
+
+	@staticmethod
+	def delivery_error(response):
+		"""returns description of failed request saved as last error of reminder"""
+		if response is None:
+			return 'no response'
+		try:
+			description = response.json()['description']
+		except (ValueError, KeyError, TypeError):
+			description = ''
+		return '{} {}'.format(response.status_code, description).strip()[:200]
+
+	@base_method
+	def save_failures(self):
+		"""saves failed deliveries in one batch, they are saved later if database is unavailable"""
+		with self.delivered_lock:
+			failures, self.failed = self.failed, []
+		if failures and not self.DBHandler.delivery_failed(failures):
+			with self.delivered_lock:
+				self.failed = failures + self.failed
+
+	@base_method
+	def update_last_id(self, updates: list):
+		"""moves polling offset after received updates"""
 		if len(updates) > 0:
-			self.last_id = updates[-1]['update_id']
-		else:
-			try:
-				self.last_id
-			except AttributeError:
-				self.last_id = 0
+			# last_id never moves back, updates taken in cluster may be older than received ones
+			self.last_id = max(self.last_id, updates[-1]['update_id'])
@@ -0,0 +1,85 @@
+import os
+import time
+import heapq
+from logging import Logger
+
+from .extra.rate_limiter import TokenBucket
+
+
+class CatchUp:
+	"""Overdue reminders waiting to be sent after bot was offline.
+	Reminders of one chat are sent in one message, chats are taken in order of lateness
+	at most RATE messages per second, so fresh reminders and replies are not delayed by backlog"""
+
+	def __init__(self, logger: Logger, rate: float = None):
+		self.logger = logger
+		# below global rate limit of telegram, rest is left for replies and reminders sent on time
+		self.RATE = rate if rate is not None else float(os.getenv('REMEMBERANCER_CATCHUP_RATE', 20))
+		# reminders combined in one message, telegram message is at most 4096 characters
+		self.GROUP_SIZE = 15
+		# seconds between progress records
+		self.LOG_INTERVAL = 10
+		self.bucket = TokenBucket(self.RATE, self.RATE)
+		# heap of (date of the oldest reminder, sequence number, chat id)
+		self._heap = []
+		# chat id -> reminders waiting
+		self._groups = {}
+		self._seq = 0
+		self.waiting = 0
+		# progress of current backlog
+		self.total = 0
+		self.taken = 0
+		self.started = None
+		self.next_log = 0
+
+	def add(self, reminders: list):
+		"""queues overdue reminders. reminders of chat which already waits join its message"""
+		if self.started is None:
+			self.started = time.monotonic()
+			self.next_log = self.started + self.LOG_INTERVAL
+		for reminder in reminders:
+			chat_id = reminder['chat_id']
+			group = self._groups.get(chat_id)
+			if group is None:
+				group = self._groups[chat_id] = []
+				self._push(chat_id, reminder['reminder_date'])
+			group.append(reminder)
+		self.waiting += len(reminders)
+		self.total += len(reminders)
+
+	def take(self):
+		"""returns groups of reminders which can be sent now, the latest chat first"""
+		groups = []
+		now = time.monotonic()
+		while self._heap and self.bucket.take(now):
+			_, _, chat_id = heapq.heappop(self._heap)
+			group = sorted(self._groups.pop(chat_id), key=lambda reminder: reminder['reminder_date'])
+			if len(group) > self.GROUP_SIZE:
+				# rest of chat waits for its turn like another chat
+				self._groups[chat_id] = group[self.GROUP_SIZE:]
+				self._push(chat_id, group[self.GROUP_SIZE]['reminder_date'])
+				group = group[:self.GROUP_SIZE]
+			groups.append(group)
+			self.waiting -= len(group)
+			self.taken += len(group)
+		return groups
+
+	def report(self):
+		"""logs how much of backlog is sent, and time it took when it is drained"""
+		if self.started is None:
+			return
+		now = time.monotonic()
+		if self.waiting == 0:
+			self.logger.warning('catch-up done: {} overdue reminders sent in {:.1f}s'.format(self.total, now - self.started))
+			self.total = self.taken = 0
+			self.started = None
+		elif now >= self.next_log:
+			self.next_log = now + self.LOG_INTERVAL
+			self.logger.warning('catch-up: {} of {} overdue reminders sent, {} chats waiting'.format(self.taken, self.total, len(self._groups)))
+
+	def __len__(self):
+		return self.waiting
+
+	def _push(self, chat_id: int, oldest):
+		self._seq += 1
+		heapq.heappush(self._heap, (oldest, self._seq, chat_id))
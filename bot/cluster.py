@@ -0,0 +1,148 @@
+import os
+import time
+import uuid
+import select
+import socket
+from logging import Logger
+
+import psycopg2
+
+from .extra.exceptions import base_method
+from .storage.postgres import connect_to_db
+
+
+class Cluster:
+	"""Coordinates bot instances sharing one database.
+	Leader is chosen with postgres advisory lock, it receives updates and assigns them to live instances by chat.
+	Every instance processes updates assigned to it and claims due reminders before sending them,
+	so each update and reminder is handled by exactly one instance"""
+
+	# key of advisory lock held by leader
+	LEADER_LOCK = 5271031
+
+	def __init__(self, db_handler, logger: Logger, instance_id: str = None):
+		self.logger = logger
+		self.DBHandler = db_handler
+		self.instance_id = instance_id or '{host}-{pid}-{suffix}'.format(host=socket.gethostname(), pid=os.getpid(), suffix=uuid.uuid4().hex[:6])
+		self.HEARTBEAT_INTERVAL = float(os.getenv('REMEMBERANCER_HEARTBEAT_INTERVAL', 5))
+		# instance is dead if it did not send heartbeat for this many seconds
+		self.INSTANCE_TIMEOUT = float(os.getenv('REMEMBERANCER_INSTANCE_TIMEOUT', 20))
+		# seconds claimed reminder is reserved for instance
+		self.LEASE = float(os.getenv('REMEMBERANCER_REMINDER_LEASE', 60))
+		self.members = [self.instance_id]
+		self.is_leader = False
+		self.next_heartbeat = 0
+		# ids of taken updates which are not processed yet
+		self.taken = set()
+		# dedicated connection: holds leader lock and listens for new updates
+		self.con = None
+
+	def maybe_heartbeat(self):
+		"""sends heartbeat if heartbeat interval has passed"""
+		if time.monotonic() >= self.next_heartbeat:
+			self.heartbeat()
+
+	@base_method
+	def heartbeat(self):
+		"""records this instance as alive, refreshes list of live instances and tries to become leader"""
+		self.next_heartbeat = time.monotonic() + self.HEARTBEAT_INTERVAL
+		members = self.DBHandler.heartbeat(self.instance_id, self.INSTANCE_TIMEOUT)
+		if members is None:
+			return
+
+		if members != self.members:
+			self.logger.warning('cluster members changed: {}'.format(', '.join(members)))
+			self.members = members
+			# chats may move between instances, so cached chat rows can be stale
+			self.DBHandler.chat_cache.clear()
+
+		self.update_leadership()
+		if self.is_leader:
+			self.DBHandler.reassign_updates(self.members)
+
+	def update_leadership(self):
+		"""takes leader lock if it is free, checks that held lock is not lost"""
+		if not self.connect():
+			return
+
+		try:
+			with self.con.cursor() as cur:
+				if self.is_leader:
+					cur.execute('SELECT 1')
+				else:
+					cur.execute('SELECT pg_try_advisory_lock(%s)', (self.LEADER_LOCK,))
+					if cur.fetchone()[0]:
+						self.is_leader = True
+						self.logger.warning('instance {} is leader now'.format(self.instance_id))
+		except psycopg2.Error:
+			# lock is released by server when connection is lost
+			self.logger.error('lost cluster connection')
+			self.disconnect()
+
+	def connect(self):
+		"""opens dedicated connection if it is not open. returns False if database is unavailable"""
+		if self.con is not None and not self.con.closed:
+			return True
+		try:
+			self.con = connect_to_db()
+			self.con.autocommit = True
+			with self.con.cursor() as cur:
+				cur.execute('LISTEN pending_update')
+		except psycopg2.OperationalError:
+			self.disconnect()
+			return False
+		return True
+
+	def disconnect(self):
+		self.is_leader = False
+		if self.con is not None:
+			try:
+				self.con.close()
+			except psycopg2.Error:
+				pass
+		self.con = None
+
+	def owner(self, chat_id: int):
+		"""returns id of instance processing updates of chat"""
+		return self.members[abs(chat_id or 0) % len(self.members)]
+
+	@base_method
+	def dispatch(self, updates: list, chat_ids: list):
+		"""assigns updates received by leader to instances. chat keeps its instance while it has pending updates.
+		returns False if updates are not saved"""
+		owners = self.DBHandler.get_update_owners([chat_id for chat_id in chat_ids if chat_id is not None])
+		assigned = [(chat_id, owners.get(chat_id) or self.owner(chat_id)) for chat_id in chat_ids]
+		return self.DBHandler.queue_updates(updates, assigned)
+
+	@base_method
+	def take_updates(self, limit: int):
+		"""returns updates assigned to this instance which are not taken yet"""
+		updates = self.DBHandler.get_assigned_updates(self.instance_id, limit, exclude=list(self.taken))
+		self.taken.update(update['update_id'] for update in updates)
+		return updates
+
+	@base_method
+	def done(self, update_ids: list):
+		"""deletes processed updates"""
+		self.DBHandler.delete_pending_updates(update_ids)
+		self.taken.difference_update(update_ids)
+
+	@base_method
+	def wait(self, timeout: float):
+		"""waits up to timeout seconds for notification about new updates"""
+		if not self.connect():
+			time.sleep(timeout)
+			return
+
+		try:
+			if not self.con.notifies:
+				select.select([self.con], [], [], timeout)
+			self.con.poll()
+			self.con.notifies.clear()
+		except psycopg2.Error:
+			self.disconnect()
+
+	@base_method
+	def claim(self, reminders: list):
+		"""returns reminders this instance claimed for sending or None if database is unavailable"""
+		return self.DBHandler.claim_reminders([reminder['id'] for reminder in reminders], self.instance_id, self.LEASE)
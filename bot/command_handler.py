@@ -1,55 +1,83 @@
 from datetime import datetime, timedelta
 from random import choice
+import tempfile
 import calendar
 import json
 
-from .api_functions import post
-from .db_handler import DBHandler
+from . import datetime_parser, reminder_files
+from .api_functions import download_file
+from .storage import Storage, create_storage
+from .message_queue import MessageQueue
+from .router import Router, Request, chatter
 from .extra.exceptions import base_method
 
 
 class CommandHandler:
 	"""Class for executing bot commands"""
 
-	def __init__(self, logger):
+	def __init__(self, logger, db_handler: Storage = None, outbox: MessageQueue = None):
 		# all code uses one logger
-		self.COMMAND_LIST = ['/start', '/help', '/commands', '/reminder', '/format', '/cancel', '/list', '/timezone', '/delete']
+		self.COMMAND_LIST = ['/start', '/help', '/commands', '/reminder', '/format', '/cancel', '/list', '/timezone', '/delete', '/import', '/export']
+		# reminders imported with one COPY
+		self.IMPORT_BATCH = 500
+		self.MAX_IMPORT_SIZE = 5 * 1024 * 1024
+		# skipped rows listed in import report
+		self.MAX_REPORTED_ROWS = 20
+		# exports bigger than this are spooled to disk
+		self.EXPORT_SPOOL_SIZE = 1024 * 1024
+		# reminders shown on one page of /list and /delete
+		self.PAGE_SIZE = 10
 		self.logger = logger
-		self.DBHandler = DBHandler(logger)
+		# bot shares its handler so that reminder changes reach scheduler
+		self.DBHandler = db_handler if db_handler is not None else create_storage(logger)
+		# replies are sent through queue so they don't block update handling
+		self.outbox = outbox if outbox is not None else MessageQueue(logger)
 		with open('bot/phrases.txt', 'r') as f:
 			self.PHRASES = f.readlines()
-
-	@base_method
-	def process_command(self, chat_id: int, text: str):
-		"""processes one command"""
-		mode, _ = self.DBHandler.get_chat_mode(chat_id)
-		command = text.split(' ')[0]
-		if mode != 'normal' and command != '/cancel' and command != '/format' and mode is not None:
-			post('sendMessage', data={'chat_id': chat_id, 'text': "You can't do this in {mode} mode".format(mode=mode)})
-			return
-		if command in self.COMMAND_LIST:
-
-			if command == '/start':
-				self.start_command(chat_id)
-			elif command == '/help':
-				self.help_command(chat_id)
-			elif command == '/commands':
-				self.commands_command(chat_id)
-			elif command == '/reminder':
-				self.reminder_command(chat_id)
-			elif command == '/format':
-				self.format_command(chat_id)
-			elif command == '/cancel':
-				self.cancel_command(chat_id)
-			elif command == '/list':
-				self.list_command(chat_id)
-			elif command == '/timezone':
-				self.timezone_command(chat_id)
-			elif command == '/delete':
-				self.delete_command(chat_id)
-
-		else:
-			post('sendMessage', data={'chat_id': chat_id, 'text': 'Command {} not found'.format(command)})
+		# finds handler of update, bot adds middleware to it
+		self.router = Router(logger)
+		self.register(self.router)
+
+	def register(self, router: Router):
+		"""registers handlers of commands, text in every chat mode, inline buttons and documents"""
+		commands = {
+			'/start': lambda request: self.start_command(request.chat_id),
+			'/help': lambda request: self.help_command(request.chat_id),
+			'/commands': lambda request: self.commands_command(request.chat_id),
+			'/reminder': lambda request: self.reminder_command(request.chat_id, request.args),
+			'/format': lambda request: self.format_command(request.chat_id),
+			'/cancel': lambda request: self.cancel_command(request.chat_id),
+			'/list': lambda request: self.list_command(request.chat_id),
+			'/timezone': lambda request: self.timezone_command(request.chat_id),
+			'/delete': lambda request: self.delete_command(request.chat_id),
+			'/import': lambda request: self.import_command(request.chat_id),
+			'/export': lambda request: self.export_command(request.chat_id),
+		}
+		# commands which work in any mode
+		anywhere = ['/cancel', '/format']
+		for command in self.COMMAND_LIST:
+			router.command(command, commands[command], None if command in anywhere else ('normal',), self.wrong_mode)
+		router.kind('unknown_command', self.unknown_command, ('normal',), self.wrong_mode)
+
+		router.mode('normal', lambda request: self.process_normal_text(request.chat_id, request.text))
+		router.mode('reminder', lambda request: self.process_reminder_text(request.chat_id, request.awaits_for, request.text))
+		router.mode('timezone', lambda request: self.process_timezone_text(request.chat_id, request.text))
+		router.mode('delete', lambda request: self.process_delete_text(request.chat_id, request.text, request.message_id))
+		router.mode('import', lambda request: self.outbox.post('sendMessage', data={'chat_id': request.chat_id, 'text': 'Send file with reminders or /cancel'}))
+
+		callback = lambda request: self.process_callback(request.chat_id, request.text, request.message_id)
+		router.callback('list', callback)
+		router.callback('del', callback, ('delete',), lambda request: self.outbox.post('sendMessage', data={'chat_id': request.chat_id, 'text': 'Send /delete to delete reminders'}))
+
+		phrase = chatter(self.outbox, self.PHRASES, MessageQueue.CHATTER)
+		router.kind('document', lambda request: self.process_document(request.chat_id, request.update['message']['document']), ('import',), phrase)
+		router.kind('other', phrase)
+
+	def wrong_mode(self, request: Request):
+		self.outbox.post('sendMessage', data={'chat_id': request.chat_id, 'text': "You can't do this in {mode} mode".format(mode=request.mode)})
+
+	def unknown_command(self, request: Request):
+		self.outbox.post('sendMessage', data={'chat_id': request.chat_id, 'text': 'Command {} not found'.format(request.key)})
 
 	@base_method
 	def start_command(self, chat_id: int):
@@ -62,7 +90,7 @@ But first better check /format
 
 To get help /help
 """
-		post('sendMessage', data={'chat_id': chat_id, 'text': text})
+		self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': text})
 
 	@base_method
 	def help_command(self, chat_id: int):
@@ -78,42 +106,49 @@ List all your reminders which aren't sent yet
 Change or set timezone /timezone
 I need this to be able to record date and time in right form
 
+Load reminders from csv or icalendar file /import
+Get all your reminders in csv file /export
+
 Exit if there is something to exit /cancel
 
 If you do not understand what is the format of all this messages check /format
 """
-		post('sendMessage', data={'chat_id': chat_id, 'text': text})
+		self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': text})
 
 	@base_method
 	def commands_command(self, chat_id: int):
 		"""sends list of commands"""
-		post('sendMessage', data={'chat_id': chat_id, 'text': '<b>Available commands</b>:\n' + '\n'.join(self.COMMAND_LIST), 'parse_mode': 'HTML'})
+		self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': '<b>Available commands</b>:\n' + '\n'.join(self.COMMAND_LIST), 'parse_mode': 'HTML'})
 
 	@base_method
-	def reminder_command(self, chat_id: int):
-		"""enters reminder mode
+	def reminder_command(self, chat_id: int, args: str = ''):
+		"""enters reminder mode or sets reminder given in one line after command
 		commands: /format, /cancel"""
 		chat_mode, _ = self.DBHandler.get_chat_mode(chat_id)
 		tz = self.DBHandler.get_timezone(chat_id)
 		if tz is None:
-			post('sendMessage', data={'chat_id': chat_id, 'text': "Wait. I don't know your timezone. Let me record it"})
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': "Wait. I don't know your timezone. Let me record it"})
 			self.timezone_command(chat_id)
 			return
+		if args:
+			if not self.process_one_line_reminder(chat_id, args):
+				self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'Reminder is invalid(/format)'})
+			return
 		if chat_mode != 'reminder':
 			self.DBHandler.set_chat_mode(chat_id, 'reminder', 'date')
-			post('sendMessage', data={'chat_id': chat_id, 'text': 'Enter date'})
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'Enter date'})
 		else:
-			post('sendMessage', data={'chat_id': chat_id, 'text': 'You are already in reminder mode'})
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'You are already in reminder mode'})
 
 	@base_method
 	def cancel_command(self, chat_id: int):
 		"""goes to normal mode"""
 		mode, awaits_for = self.DBHandler.get_chat_mode(chat_id)
 		if mode == 'normal':
-			post('sendMessage', data={'chat_id': chat_id, 'text': 'You are already in normal mode'})
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'You are already in normal mode'})
 		else:
 			self.DBHandler.set_chat_mode(chat_id, 'normal')
-			post('sendMessage', data={'chat_id': chat_id, 'text': 'Now you are in normal mode'})
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'Now you are in normal mode'})
 
 	@base_method
 	def format_command(self, chat_id: int):
@@ -127,26 +162,20 @@ If you do not understand what is the format of all this messages check /format
 
 		reply = 'Date format: {d}/{mon} or {d}/{mon}/{y}\n'.format(d=dt.day, mon=dt.month, y=dt.year)
 		reply += 'Time format: {h:0>2}:{m:0>2}\n'.format(h=dt.hour, m=dt.minute)
-		reply += 'Timezone format: {tz} or -{tz}'.format(tz=tz)
-		post('sendMessage', data={'chat_id': chat_id, 'text': reply})
+		reply += 'Timezone format: {tz} or -{tz}\n'.format(tz=tz)
+		reply += 'One line reminder: {d}/{mon} {h:0>2}:{m:0>2} text, tomorrow 9:00 text or in 2h text\n'.format(d=dt.day, mon=dt.month, h=dt.hour, m=dt.minute)
+		reply += 'Recurring reminder: every day 9:00 text, every 2 hours text, every weekday 9:00 text, every month 1/{mon} 10:00 text or cron */30 9-18 * * 1-5 text'.format(mon=dt.month)
+		self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': reply})
 
 	@base_method
 	def list_command(self, chat_id: int):
-		"""sends to user list of his reminders"""
-		reminders = self.DBHandler.get_user_reminders(chat_id)
-		if reminders == []:
-			post('sendMessage', data={'chat_id': chat_id, 'text': 'You have no reminders'})
-		else:
-			reminders_str = ''
-			for i in range(len(reminders)):
-				dt = self.dt_with_tz(chat_id, reminders[i]['reminder_date'])
-				if dt is None:
-					post('sendMessage', data={'chat_id': chat_id, 'text': "Wait. I don't know your timezone. Let me record it"})
-					self.timezone_command(chat_id)
-					return
-				text = reminders[i]['reminder_text']
-				reminders_str += '\n{i}. {dt.day:0>2}/{dt.month:0>2}/{dt.year} {dt.hour:0>2}:{dt.minute:0>2} <i>{text}</i>'.format(i=i + 1, dt=dt, text=text)
-			post('sendMessage', data={'chat_id': chat_id, 'text': 'Your reminders:' + reminders_str, 'parse_mode': 'HTML'})
+		"""sends to user first page of his reminders"""
+		tz = self.DBHandler.get_timezone(chat_id)
+		if tz is None:
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': "Wait. I don't know your timezone. Let me record it"})
+			self.timezone_command(chat_id)
+			return
+		self.show_reminders(chat_id, 'list')
 
 	@base_method
 	def timezone_command(self, chat_id: int):
@@ -155,59 +184,206 @@ If you do not understand what is the format of all this messages check /format
 
 		tz = self.DBHandler.get_timezone(chat_id)
 		if tz is None:
-			post('sendMessage', data={'chat_id': chat_id, 'text': 'Enter timezone'})
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'Enter timezone'})
 		else:
 			if tz > 0:
 				tz = '+' + str(tz)
 			else:
 				tz = str(tz)
-			post('sendMessage', data={'chat_id': chat_id, 'text': 'Your timezone is {tz}. Enter timezone to change it or /cancel to keep it'.format(tz=tz)})
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'Your timezone is {tz}. Enter timezone to change it or /cancel to keep it'.format(tz=tz)})
 
 	@base_method
 	def delete_command(self, chat_id: int):
 		"""enters delete mode"""
-		mode = self.DBHandler.get_chat_mode(chat_id)
+		mode, _ = self.DBHandler.get_chat_mode(chat_id)
 		if mode == 'delete':
-			post('sendMessage', data={'chat_id': chat_id, 'text': 'You are already in delete mode'})
-		else:
-			reminders = self.DBHandler.get_user_reminders(chat_id)
-			if reminders == []:
-				post('sendMessage', data={'chat_id': chat_id, 'text': 'You have no reminders'})
-				return
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'You are already in delete mode'})
+			return
+		tz = self.DBHandler.get_timezone(chat_id)
+		if tz is None:
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': "Wait. I don't know your timezone. Let me record it"})
+			self.timezone_command(chat_id)
+			return
+		if self.show_reminders(chat_id, 'del'):
 			self.DBHandler.set_chat_mode(chat_id, 'delete')
-			reply_markup = json.dumps({
-				"inline_keyboard": [[{'text': '{dt.day:0>2}/{dt.month:0>2}/{dt.year} {dt.hour:0>2}:{dt.minute:0>2}'.format(dt=self.dt_with_tz(chat_id, rem['reminder_date'])), 'callback_data': '{dt.day:0>2}/{dt.month:0>2}/{dt.year} {dt.hour:0>2}:{dt.minute:0>2}'.format(dt=self.dt_with_tz(chat_id, rem['reminder_date']))}] for rem in reminders]
-			})
-			post('sendMessage', data={'chat_id': chat_id, 'text': 'Select reminder to delete', 'reply_markup': reply_markup})
 
 	@base_method
-	def process_text(self, chat_id: int, text: str, message_id: int = None):
-		"""processes all text except commands"""
-		mode, awaits_for = self.DBHandler.get_chat_mode(chat_id)
-		if mode == 'normal':
-			post('sendMessage', data={'chat_id': chat_id, 'text': choice(self.PHRASES)})
-		elif mode == 'reminder':
-			self.process_reminder_text(chat_id, awaits_for, text)
-		elif mode == 'timezone':
-			self.process_timezone_text(chat_id, text)
-		elif mode == 'delete':
-			self.process_delete_text(chat_id, text, message_id)
+	def show_reminders(self, chat_id: int, prefix: str, direction: str = None, key: tuple = None, message_id: int = None):
+		"""sends page of reminders for /list (prefix list) or buttons to delete them for /delete (prefix del).
+		page goes after key (direction n) or before it (direction p), message_id is message edited in place.
+		returns number of shown reminders"""
+		if direction == 'p':
+			reminders, has_prev = self.DBHandler.get_reminders_page(chat_id, self.PAGE_SIZE, before=key)
+			has_next = True
+		else:
+			reminders, has_next = self.DBHandler.get_reminders_page(chat_id, self.PAGE_SIZE, after=key)
+			has_prev = key is not None
+		if reminders == [] and key is not None:
+			# reminders of page were deleted meanwhile
+			reminders, has_next = self.DBHandler.get_reminders_page(chat_id, self.PAGE_SIZE)
+			has_prev = False
+		if reminders is None:
+			return 0
+
+		data = {'chat_id': chat_id, 'parse_mode': 'HTML'}
+		if reminders == []:
+			data['text'] = 'You have no reminders'
+			data['reply_markup'] = json.dumps({'inline_keyboard': []})
+		else:
+			tz = self.DBHandler.get_timezone(chat_id) or 0
+			keyboard = []
+			if prefix == 'list':
+				lines = []
+				for reminder in reminders:
+					line = '{label} <i>{text}</i>'.format(label=self.reminder_label(reminder, tz), text=reminder['reminder_text'])
+					if reminder['recurrence'] is not None:
+						# only next occurrence is stored, rule shows the rest
+						line += ' (repeats {})'.format(reminder['recurrence'])
+					lines.append(line)
+				data['text'] = 'Your reminders:\n' + '\n'.join(lines)
+			else:
+				data['text'] = 'Select reminder to delete'
+				keyboard = [[{'text': self.reminder_label(reminder, tz), 'callback_data': 'del:x:{}'.format(reminder['id'])}] for reminder in reminders]
+
+			navigation = []
+			if has_prev:
+				navigation.append({'text': '<', 'callback_data': '{}:p:{}'.format(prefix, self.page_key(reminders[0]))})
+			if has_next:
+				navigation.append({'text': '>', 'callback_data': '{}:n:{}'.format(prefix, self.page_key(reminders[-1]))})
+			if navigation:
+				keyboard.append(navigation)
+			data['reply_markup'] = json.dumps({'inline_keyboard': keyboard})
+
+		if message_id is None:
+			self.outbox.post('sendMessage', data=data)
+		else:
+			data['message_id'] = message_id
+			self.outbox.post('editMessageText', data=data)
+		return len(reminders)
+
+	def reminder_label(self, reminder: dict, tz: int):
+		dt = reminder['reminder_date'] + timedelta(hours=tz)
+		return '{dt.day:0>2}/{dt.month:0>2}/{dt.year} {dt.hour:0>2}:{dt.minute:0>2}'.format(dt=dt)
+
+	def page_key(self, reminder: dict):
+		# keyset of reminder packed into callback data, telegram allows 64 bytes
+		return '{}:{}'.format(calendar.timegm(reminder['reminder_date'].timetuple()), reminder['id'])
+
+	@base_method
+	def process_callback(self, chat_id: int, data: str, message_id: int):
+		"""processes inline button of /list or /delete page: list:n:KEY, list:p:KEY, del:n:KEY, del:p:KEY or del:x:ID"""
+		prefix, action, *args = data.split(':')
+		if action in ('n', 'p') and len(args) == 2:
+			key = (datetime.utcfromtimestamp(int(args[0])), int(args[1]))
+			self.show_reminders(chat_id, prefix, action, key, message_id)
+		elif prefix == 'del' and action == 'x' and len(args) == 1:
+			reminder = self.DBHandler.delete_chat_reminder(chat_id, int(args[0]))
+			text = 'Reminder deleted' if reminder is not None else 'There is no such reminder'
+			self.outbox.post('editMessageText', data={'chat_id': chat_id, 'message_id': message_id, 'text': text})
+			self.DBHandler.set_chat_mode(chat_id, 'normal')
+
+	@base_method
+	def import_command(self, chat_id: int):
+		"""enters import mode"""
+		tz = self.DBHandler.get_timezone(chat_id)
+		if tz is None:
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': "Wait. I don't know your timezone. Let me record it"})
+			self.timezone_command(chat_id)
+			return
+		self.DBHandler.set_chat_mode(chat_id, 'import')
+		self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'Send csv file with rows "dd/mm/yyyy hh:mm,text" or icalendar (.ics) file'})
+
+	@base_method
+	def export_command(self, chat_id: int):
+		"""sends csv file with all chat reminders"""
+		tz = self.DBHandler.get_timezone(chat_id)
+		if tz is None:
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': "Wait. I don't know your timezone. Let me record it"})
+			self.timezone_command(chat_id)
+			return
+
+		f = tempfile.SpooledTemporaryFile(max_size=self.EXPORT_SPOOL_SIZE)
+		if not self.DBHandler.export_reminders(chat_id, tz, f):
+			f.close()
+			return
+		self.outbox.post('sendDocument', data={'chat_id': chat_id}, files={'document': ('reminders.csv', f)}, callback=lambda response: f.close())
+
+	@base_method
+	def process_normal_text(self, chat_id: int, text: str):
+		"""sets one line reminder or chats"""
+		if not self.process_one_line_reminder(chat_id, text):
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': choice(self.PHRASES)}, priority=MessageQueue.CHATTER)
+
+	@base_method
+	def process_document(self, chat_id: int, document: dict):
+		"""imports reminders from csv or icalendar document, router calls it in import mode"""
+		if document.get('file_size', 0) > self.MAX_IMPORT_SIZE:
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'File is too big'})
+			return
+
+		tz = self.DBHandler.get_timezone(chat_id)
+		response = download_file(document['file_id'])
+		if response is None:
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': "Can't download file. Try again"})
+			return
+
+		imported = 0
+		skipped = []
+		batch = []
+		now = datetime.utcnow()
+		with response:
+			response.encoding = 'utf-8-sig'
+			for row in reminder_files.read_reminders(document.get('file_name'), response.iter_lines(decode_unicode=True)):
+				dt = row.dt if row.utc or row.error is not None else row.dt - timedelta(hours=tz)
+				if row.error is not None:
+					skipped.append((row.line, row.error))
+				elif dt <= now:
+					skipped.append((row.line, 'time is in the past'))
+				elif len(row.text) > 200:
+					skipped.append((row.line, 'text is longer than 200 characters'))
+				else:
+					batch.append((row.line, dt, row.text))
+
+				if len(batch) >= self.IMPORT_BATCH:
+					imported += self.import_batch(chat_id, batch, skipped)
+					batch = []
+			imported += self.import_batch(chat_id, batch, skipped)
+
+		skipped.sort()
+		reply = 'Imported {} reminders'.format(imported)
+		if skipped:
+			reply += '\nSkipped {} rows:\n'.format(len(skipped))
+			reply += '\n'.join('line {}: {}'.format(line, reason) for line, reason in skipped[:self.MAX_REPORTED_ROWS])
+			if len(skipped) > self.MAX_REPORTED_ROWS:
+				reply += '\n...'
+		self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': reply})
+		self.DBHandler.set_chat_mode(chat_id, 'normal')
+
+	@base_method
+	def import_batch(self, chat_id: int, batch: list, skipped: list):
+		"""saves batch of validated rows, adds conflicting rows to skipped. returns number of imported reminders"""
+		conflicts = self.DBHandler.import_reminders(chat_id, batch)
+		if conflicts is None:
+			skipped.extend((line, 'database is unavailable') for line, _, _ in batch)
+			return 0
+		skipped.extend((line, 'reminder at this time already exists') for line in conflicts)
+		return len(batch) - len(conflicts)
 
 	@base_method
 	def process_reminder_text(self, chat_id: int, awaits_for: str, text: str):
 		"""processes text in reminder mode, sets reminder date, time and text"""
 		if awaits_for == 'date':
 			if not self.date_is_valid(text):
-				post('sendMessage', data={'chat_id': chat_id, 'text': 'Date is invalid(/format)'})
+				self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'Date is invalid(/format)'})
 				return
 
 			self.DBHandler.save_temp_date(chat_id, text)
 			self.DBHandler.set_chat_mode(chat_id, 'reminder', 'time')
-			post('sendMessage', data={'chat_id': chat_id, 'text': 'Enter time'})
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'Enter time'})
 
 		elif awaits_for == 'time':
 			if not self.time_is_valid(text):
-				post('sendMessage', data={'chat_id': chat_id, 'text': 'Time is invalid(/format)'})
+				self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'Time is invalid(/format)'})
 				return
 
 			temp_date = self.DBHandler.get_temp_date(chat_id)
@@ -215,38 +391,65 @@ If you do not understand what is the format of all this messages check /format
 				dt = self.get_datetime(chat_id, temp_date, text)
 				dt = self.dt_utc(chat_id, dt)
 			else:
-				post('sendMessage', data={'chat_id': chat_id, 'text': 'Something went wrong'})
+				self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'Something went wrong'})
 				self.DBHandler.set_chat_mode(chat_id, 'normal')
 				return
 
 			if not self.is_future(dt):
-				post('sendMessage', data={'chat_id': chat_id, 'text': "You are trying to set reminder in the past. I can't do that"})
+				self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': "You are trying to set reminder in the past. I can't do that"})
 				self.DBHandler.set_chat_mode(chat_id, 'normal')
 				return
 
 			self.DBHandler.save_temp_time(chat_id, text)
 			self.DBHandler.set_chat_mode(chat_id, 'reminder', 'text')
-			post('sendMessage', data={'chat_id': chat_id, 'text': 'Enter reminder text (- to make remidner without text)'})
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'Enter reminder text (- to make remidner without text)'})
 
 		elif awaits_for == 'text':
 			date = self.DBHandler.get_temp_date(chat_id)
 			time = self.DBHandler.get_temp_time(chat_id)
 			if time is None or date is None:
-				post('sendMessage', data={'chat_id': chat_id, 'text': 'Something went wrong'})
+				self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'Something went wrong'})
 				self.DBHandler.set_chat_mode(chat_id, 'normal')
 				return
 
 			dt = self.get_datetime(chat_id, date, time)
 			dt = self.dt_utc(chat_id, dt)
-			success = self.DBHandler.set_reminder(chat_id, dt, text)
+			self.set_reminder(chat_id, dt, text)
+			self.DBHandler.set_chat_mode(chat_id, 'normal')
 
-			if success:
-				dt = self.dt_with_tz(chat_id, dt)
-				post('sendMessage', data={'chat_id': chat_id, 'text': 'Reminder is set on {day} {month} {year}, {hour:0>2}:{minute:0>2}'.format(day=dt.day, month=calendar.month_name[dt.month], year=dt.year, hour=dt.hour, minute=dt.minute)})
-			else:
-				post('sendMessage', data={'chat_id': chat_id, 'text': 'Something went wrong. Reminder is not set'})
+	@base_method
+	def process_one_line_reminder(self, chat_id: int, text: str):
+		"""sets reminder written in one line like 'tomorrow 9:00 call mom'. returns False if text is not such reminder"""
+		if datetime_parser.match_reminder(text) is None:
+			return False
+		tz = self.DBHandler.get_timezone(chat_id)
+		if tz is None:
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': "Wait. I don't know your timezone. Let me record it"})
+			self.timezone_command(chat_id)
+			return True
 
-			self.DBHandler.set_chat_mode(chat_id, 'normal')
+		dt, reminder_text, rule = datetime_parser.parse_reminder(text, datetime.utcnow() + timedelta(hours=tz))
+		dt -= timedelta(hours=tz)
+		if not self.is_future(dt):
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': "You are trying to set reminder in the past. I can't do that"})
+			return True
+
+		self.set_reminder(chat_id, dt, reminder_text, str(rule) if rule is not None else None)
+		return True
+
+	@base_method
+	def set_reminder(self, chat_id: int, dt: datetime, text: str, recurrence: str = None):
+		"""sets reminder on utc datetime and tells user result. recurring reminder repeats by recurrence rule"""
+		success = self.DBHandler.set_reminder(chat_id, dt, text, recurrence)
+
+		if success:
+			dt = self.dt_with_tz(chat_id, dt)
+			reply = 'Reminder is set on {day} {month} {year}, {hour:0>2}:{minute:0>2}'.format(day=dt.day, month=calendar.month_name[dt.month], year=dt.year, hour=dt.hour, minute=dt.minute)
+			if recurrence is not None:
+				reply += ' and repeats {}'.format(recurrence)
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': reply})
+		else:
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'Something went wrong. Reminder is not set'})
 
 	@base_method
 	def process_timezone_text(self, chat_id: int, text: str):
@@ -256,11 +459,11 @@ If you do not understand what is the format of all this messages check /format
 			if tz < -24 or tz > 24:
 				raise ValueError
 		except ValueError:
-			post('sendMessage', data={'chat_id': chat_id, 'text': 'Wrong format. Check /format'})
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'Wrong format. Check /format'})
 			return
 
 		self.DBHandler.set_timezone(chat_id, tz)
-		post('sendMessage', data={'chat_id': chat_id, 'text': 'Timezone is set'})
+		self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'Timezone is set'})
 		self.DBHandler.set_chat_mode(chat_id, 'normal')
 
 	@base_method
@@ -268,75 +471,54 @@ If you do not understand what is the format of all this messages check /format
 		"""deletes reminder with specified date and time"""
 		date_and_time = text.split()
 		if len(date_and_time) != 2:
-			post('sendMessage', data={'chat_id': chat_id, 'text': 'Wrong format. Check /format'})
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'Wrong format. Check /format'})
 			return
-		date, time = date_and_time
-		if not self.date_is_valid(date) or not self.time_is_valid(time):
-			post('sendMessage', data={'chat_id': chat_id, 'text': 'Wrong format. Check /format'})
+		date = datetime_parser.parse_date(date_and_time[0])
+		time = datetime_parser.parse_time(date_and_time[1])
+		if date is None or time is None:
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'Wrong format. Check /format'})
 			return
-		dt = datetime.strptime(date + ' ' + time, '%d/%m/%Y %H:%M')
+		dt = datetime_parser.combine(date, time, self.local_now(chat_id))
 		dt = self.dt_utc(chat_id, dt)
 		reminder = self.DBHandler.get_chat_reminder_by_dt(chat_id, dt)
 		if reminder is None:
-			post('sendMessage', data={'chat_id': chat_id, 'text': 'There is no reminders at this time'})
+			self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'There is no reminders at this time'})
 			return
 		self.DBHandler.delete_reminder(reminder)
-		post('sendMessage', data={'chat_id': chat_id, 'text': 'Reminder deleted'})
+		self.outbox.post('sendMessage', data={'chat_id': chat_id, 'text': 'Reminder deleted'})
 		self.DBHandler.set_chat_mode(chat_id, 'normal')
-		post('editMessageReplyMarkup', data={'chat_id': chat_id, 'message_id': message_id, 'reply_markup': ""})
+		self.outbox.post('editMessageReplyMarkup', data={'chat_id': chat_id, 'message_id': message_id, 'reply_markup': ""})
 
 	@base_method
 	def date_is_valid(self, text: str):
 		# checks if text is date in format dd/mm or dd/mm/yyyy
-		if text.count('/') == 1:
-			try:
-				datetime.strptime(text, '%d/%m')
-			except ValueError:
-				return False
-			return True
-		elif text.count('/') == 2:
-			try:
-				datetime.strptime(text, '%d/%m/%Y')
-			except ValueError:
-				return False
-			return True
-		else:
-			return False
+		return datetime_parser.parse_date(text) is not None
 
 	@base_method
 	def time_is_valid(self, text: str):
 		# checks if text is time in format hh:mm
-		if text.count(':') == 1:
-			try:
-				datetime.strptime(text, '%H:%M')
-			except ValueError:
-				return False
-			return True
-
-		else:
-			return False
+		return datetime_parser.parse_time(text) is not None
 
 	@base_method
 	def is_future(self, dt: datetime):
 		"""checks if datetime is future(input dt must be in utc)"""
 		return dt > datetime.utcnow()
 
+	@base_method
+	def local_now(self, chat_id: int):
+		"""current time in chat timezone, utc if timezone is unknown"""
+		return self.dt_with_tz(chat_id, datetime.utcnow()) or datetime.utcnow()
+
 	@base_method
 	def get_date(self, chat_id: int, text: str):
 		"""adds a year to date if date is not future. returns date in format d/m/year"""
-
-		if text.count('/') == 1:
-			text += '/' + str(datetime.now().year)
-			if not self.is_future(self.dt_utc(chat_id, datetime.strptime(text + ' 23:59', '%d/%m/%Y %H:%M'))):
-				text = text[:-4] + str(datetime.now().year + 1)
-
-		return text
+		dt = datetime_parser.resolve_date(datetime_parser.parse_date(text), self.local_now(chat_id))
+		return '{d.day}/{d.month}/{d.year}'.format(d=dt)
 
 	@base_method
 	def get_datetime(self, chat_id: int, date: str, time: str):
 		"""combines date and time considering timezone"""
-		date = self.get_date(chat_id, date)
-		return datetime.strptime(date + ' ' + time, '%d/%m/%Y %H:%M')
+		return datetime_parser.combine(datetime_parser.parse_date(date), datetime_parser.parse_time(time), self.local_now(chat_id))
 
 	@base_method
 	def dt_with_tz(self, chat_id: int, dt: datetime):
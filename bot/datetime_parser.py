@@ -0,0 +1,154 @@
+import re
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from . import recurrence
+
+
+# all patterns are compiled once on import
+DATE_RE = re.compile(r'(\d{1,2})/(\d{1,2})(?:/(\d{4}))?')
+TIME_RE = re.compile(r'(\d{1,2}):(\d{2})')
+# "25/12 18:30 text", "tomorrow 9:00 text", text is optional
+ONE_LINE_RE = re.compile(
+	r'\s*(?:(?P<day>today|tomorrow)|(?P<date>\d{1,2}/\d{1,2}(?:/\d{4})?))\s+(?P<time>\d{1,2}:\d{2})(?:\s+(?P<text>.*))?',
+	re.IGNORECASE | re.DOTALL
+)
+# "in 2h", "in 15 minutes text"
+RELATIVE_RE = re.compile(
+	r'\s*in\s+(?P<amount>\d{1,4})\s*(?P<unit>minutes?|mins?|m|hours?|h|days?|d|weeks?|w)(?:\s+(?P<text>.*))?',
+	re.IGNORECASE | re.DOTALL
+)
+
+UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+
+CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_date(text: str):
+	"""parses date in format dd/mm or dd/mm/yyyy. returns (day, month, year) with year None if it is not given,
+	or None if text is not valid date"""
+	match = DATE_RE.fullmatch(text)
+	if match is None:
+		return None
+
+	day, month, year = int(match.group(1)), int(match.group(2)), match.group(3)
+	year = int(year) if year is not None else None
+	try:
+		# date without year is checked against 1900 like strptime('%d/%m') does
+		datetime(year or 1900, month, day)
+	except ValueError:
+		return None
+	return day, month, year
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_time(text: str):
+	"""parses time in format hh:mm. returns (hour, minute) or None if text is not valid time"""
+	match = TIME_RE.fullmatch(text)
+	if match is None:
+		return None
+
+	hour, minute = int(match.group(1)), int(match.group(2))
+	if hour > 23 or minute > 59:
+		return None
+	return hour, minute
+
+
+def resolve_date(date: tuple, now: datetime):
+	"""returns datetime of parsed date. date without year is the nearest one which is not over yet"""
+	day, month, year = date
+	if year is not None:
+		return datetime(year, month, day)
+
+	dt = datetime(now.year, month, day)
+	if dt.replace(hour=23, minute=59) <= now:
+		dt = dt.replace(year=now.year + 1)
+	return dt
+
+
+def combine(date: tuple, time: tuple, now: datetime):
+	"""returns datetime of parsed date and time"""
+	return resolve_date(date, now).replace(hour=time[0], minute=time[1])
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def match_reminder(text: str):
+	"""splits one line reminder into parts not depending on current time.
+	returns ('absolute', date, time, reminder text), ('relative', timedelta, reminder text),
+	('recurring', Rule, start, reminder text) or None.
+	start of recurring reminder is None, ('at', time) or (date, time)"""
+	recurring = recurrence.split_rule(text)
+	if recurring is not None:
+		rule, rest = recurring
+		if rule.cron is not None or not rest:
+			return 'recurring', rule, None, rest
+		parts = match_reminder(rest)
+		if parts is not None and parts[0] == 'absolute':
+			return 'recurring', rule, parts[1:3], parts[3]
+		first, _, reminder_text = rest.partition(' ')
+		time = parse_time(first)
+		if time is not None:
+			return 'recurring', rule, ('at', time), reminder_text.strip()
+		return 'recurring', rule, None, rest
+
+	match = RELATIVE_RE.fullmatch(text)
+	if match is not None:
+		unit = UNITS[match.group('unit')[0].lower()]
+		return 'relative', timedelta(**{unit: int(match.group('amount'))}), (match.group('text') or '').strip()
+
+	match = ONE_LINE_RE.fullmatch(text)
+	if match is None:
+		return None
+
+	time = parse_time(match.group('time'))
+	if time is None:
+		return None
+	if match.group('day') is not None:
+		# resolved against current date later
+		date = match.group('day').lower()
+	else:
+		date = parse_date(match.group('date'))
+		if date is None:
+			return None
+	return 'absolute', date, time, (match.group('text') or '').strip()
+
+
+def parse_reminder(text: str, now: datetime):
+	"""parses one line reminder like 'tomorrow 9:00 call mom', 'in 2h', '25/12 18:30 text' or 'every day 9:00 text'.
+	now is current time in user timezone.
+	returns (datetime in user timezone, reminder text, recurrence Rule or None) or None"""
+	parts = match_reminder(text)
+	if parts is None:
+		return None
+
+	if parts[0] == 'relative':
+		_, delta, reminder_text = parts
+		return now.replace(second=0, microsecond=0) + delta, reminder_text, None
+
+	if parts[0] == 'recurring':
+		_, rule, start, reminder_text = parts
+		now = now.replace(second=0, microsecond=0)
+		if start is None:
+			dt = rule.next(now, now)
+		elif start[0] == 'at':
+			dt = now.replace(hour=start[1][0], minute=start[1][1])
+			if dt <= now:
+				dt += timedelta(days=1)
+		else:
+			dt, _, _ = parse_absolute(start[0], start[1], '', now)
+		return dt, reminder_text, recurrence.anchored(rule, dt)
+
+	_, date, time, reminder_text = parts
+	return parse_absolute(date, time, reminder_text, now)
+
+
+def parse_absolute(date, time: tuple, reminder_text: str, now: datetime):
+	"""returns (datetime, reminder text, None) of reminder on date or 'today' or 'tomorrow' at time"""
+	if date == 'today':
+		dt = datetime(now.year, now.month, now.day)
+	elif date == 'tomorrow':
+		dt = datetime(now.year, now.month, now.day) + timedelta(days=1)
+	else:
+		dt = resolve_date(date, now)
+	return dt.replace(hour=time[0], minute=time[1]), reminder_text, None
@@ -0,0 +1,133 @@
+import time
+import threading
+from logging import Logger
+
+import psycopg2
+from psycopg2 import extensions
+
+from .extra.exceptions import PoolTimeoutError
+
+
+class ConnectionPool:
+	"""Thread safe pool of long-lived database connections"""
+
+	def __init__(self, connect, logger: Logger, minconn: int = 1, maxconn: int = 10, timeout: float = 5.0, check_interval: float = 30.0):
+		# connect is function without arguments which opens new connection
+		self.connect = connect
+		self.logger = logger
+		self.minconn = minconn
+		self.maxconn = maxconn
+		# how long getconn waits for free connection
+		self.timeout = timeout
+		# connections idle longer than this are checked before checkout
+		self.check_interval = check_interval
+		self.closed = False
+		# idle connections with time when they were returned to pool
+		self._idle = []
+		# number of open connections, idle and checked out
+		self._size = 0
+		self._cond = threading.Condition()
+
+		self.fill()
+
+	def fill(self):
+		"""opens connections until pool has minconn of them"""
+		while self._size < self.minconn:
+			try:
+				con = self.connect()
+			except psycopg2.OperationalError as e:
+				self.logger.error("can't open database connection: {}".format(e))
+				return
+			with self._cond:
+				self._size += 1
+				self._idle.append((con, time.monotonic()))
+				self._cond.notify()
+
+	def getconn(self, timeout: float = None):
+		"""returns healthy connection. opens new one if there are no idle connections and pool is not full.
+		raises PoolTimeoutError if no connection is freed in timeout seconds"""
+		if timeout is None:
+			timeout = self.timeout
+		deadline = time.monotonic() + timeout
+
+		with self._cond:
+			while True:
+				if self.closed:
+					raise psycopg2.InterfaceError('connection pool is closed')
+				if self._idle:
+					con, returned_at = self._idle.pop()
+					break
+				if self._size < self.maxconn:
+					# reserve place for new connection
+					self._size += 1
+					con, returned_at = None, None
+					break
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					raise PoolTimeoutError(timeout)
+				self._cond.wait(remaining)
+
+		# connecting and checking are done without lock
+		if con is not None:
+			if self.is_healthy(con, returned_at):
+				return con
+			self.logger.warning('dropping broken database connection')
+			self._close(con)
+
+		try:
+			return self.connect()
+		except Exception:
+			self._release_place()
+			raise
+
+	def putconn(self, con, discard: bool = False):
+		"""returns connection to pool. broken or discarded connections are closed"""
+		if not discard and not con.closed and con.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+			try:
+				con.rollback()
+			except psycopg2.Error:
+				discard = True
+
+		if discard or con.closed or self.closed:
+			self._close(con)
+			self._release_place()
+			return
+
+		with self._cond:
+			self._idle.append((con, time.monotonic()))
+			self._cond.notify()
+
+	def is_healthy(self, con, returned_at: float):
+		"""checks connection which was idle since returned_at"""
+		if con.closed:
+			return False
+		if time.monotonic() - returned_at < self.check_interval:
+			return True
+		try:
+			with con.cursor() as cur:
+				cur.execute('SELECT 1')
+			con.rollback()
+		except psycopg2.Error:
+			return False
+		return True
+
+	def closeall(self):
+		"""closes all idle connections. checked out connections are closed when returned"""
+		with self._cond:
+			self.closed = True
+			idle, self._idle = self._idle, []
+			self._size -= len(idle)
+			self._cond.notify_all()
+		for con, _ in idle:
+			self._close(con)
+
+	def _release_place(self):
+		with self._cond:
+			self._size -= 1
+			self._cond.notify()
+
+	def _close(self, con):
+		try:
+			con.close()
+		except psycopg2.Error:
+			pass
@@ -0,0 +1,55 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+	"""Thread safe cache with least recently used eviction and entries expiring after ttl seconds"""
+
+	def __init__(self, maxsize: int = 10000, ttl: float = 300):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.hits = 0
+		self.misses = 0
+		# key -> (value, expiration time)
+		self._data = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key, default=None):
+		"""returns cached value or default if key is missing or expired"""
+		with self._lock:
+			entry = self._data.get(key)
+			if entry is None or entry[1] < time.monotonic():
+				if entry is not None:
+					del self._data[key]
+				self.misses += 1
+				return default
+			self._data.move_to_end(key)
+			self.hits += 1
+			return entry[0]
+
+	def set(self, key, value):
+		"""caches value, evicts least recently used entry if cache is full"""
+		with self._lock:
+			self._data[key] = (value, time.monotonic() + self.ttl)
+			self._data.move_to_end(key)
+			while len(self._data) > self.maxsize:
+				self._data.popitem(last=False)
+
+	def clear(self):
+		with self._lock:
+			self._data.clear()
+
+	def stats(self):
+		"""returns dict with size, hits, misses and hit ratio"""
+		with self._lock:
+			total = self.hits + self.misses
+			return {
+				'size': len(self._data),
+				'hits': self.hits,
+				'misses': self.misses,
+				'hit_ratio': self.hits / total if total else 0.0
+			}
+
+	def __len__(self):
+		return len(self._data)
@@ -1,7 +1,8 @@
+import time
 import functools
-import traceback
 
 from .logger import logger
+from . import metrics
 
 
 class BotError(Exception):
@@ -15,14 +16,37 @@ class TokenError(BotError):
 		super().__init__(self.message)
 
 
+class PoolTimeoutError(BotError):
+
+	def __init__(self, timeout: float):
+		self.message = 'No free database connection in {} seconds'.format(timeout)
+		super().__init__(self.message)
+
+
 def base_method(fun):
-	"""wrapper for all methods and functions. handles exceptions occured in fun"""
+	"""wrapper for all methods and functions. handles exceptions occured in fun.
+	counts calls, errors and latency of fun if metrics are enabled"""
+	if metrics.ENABLED:
+		stats = metrics.registry.function(fun.__qualname__)
+
+		@functools.wraps(fun)
+		def timed(*args, **kwargs):
+			started = time.perf_counter()
+			try:
+				result = fun(*args, **kwargs)
+			except Exception as e:
+				stats.observe(time.perf_counter() - started, error=True)
+				logger.error(e, exc_info=True)
+				raise e
+			stats.observe(time.perf_counter() - started)
+			return result
+		return timed
+
 	@functools.wraps(fun)
 	def inner(*args, **kwargs):
 		try:
 			return fun(*args, **kwargs)
 		except Exception as e:
-			print(traceback.format_exc())
-			logger.error(e)
+			logger.error(e, exc_info=True)
 			raise e
 	return inner
@@ -1,5 +1,104 @@
+import os
+import sys
+import json
+import time
+import queue
+import random
+import atexit
 import logging
+import threading
 from logging import config
+from logging.handlers import QueueHandler, QueueListener
+from contextlib import contextmanager
+
+from .rate_limiter import TokenBucket
+
+
+LOG_FILE = os.getenv('REMEMBERANCER_LOG_FILE', 'bot.log')
+# bot.log is rotated when it grows over this size, LOG_BACKUPS old files are kept
+LOG_MAX_BYTES = int(os.getenv('REMEMBERANCER_LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUPS = int(os.getenv('REMEMBERANCER_LOG_BACKUPS', 5))
+# records waiting for writer thread, records are dropped when queue is full
+LOG_QUEUE_SIZE = int(os.getenv('REMEMBERANCER_LOG_QUEUE_SIZE', 10000))
+# share of per update records which are logged and most of them logged per second, 0 is no limit
+UPDATE_LOG_SAMPLE = float(os.getenv('REMEMBERANCER_LOG_UPDATE_SAMPLE', 1))
+UPDATE_LOG_RATE = float(os.getenv('REMEMBERANCER_LOG_UPDATE_RATE', 0))
+
+# fields of update being processed by thread, added to all its records
+CONTEXT_FIELDS = ('chat_id', 'update_id', 'handler')
+_context = threading.local()
+
+
+class JsonFormatter(logging.Formatter):
+	"""Formats record as one line json object"""
+
+	def format(self, record):
+		data = {
+			'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+			'level': record.levelname,
+			'logger': record.name,
+			'where': '{}.{}'.format(record.module, record.funcName),
+			'message': record.getMessage(),
+		}
+		for field in CONTEXT_FIELDS:
+			value = getattr(record, field, None)
+			if value is not None:
+				data[field] = value
+		if record.exc_info:
+			data['traceback'] = self.formatException(record.exc_info)
+		return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class ContextFilter(logging.Filter):
+	"""Adds fields of update processed by current thread to record"""
+
+	def filter(self, record):
+		fields = getattr(_context, 'fields', None) or {}
+		for field in CONTEXT_FIELDS:
+			if getattr(record, field, None) is None:
+				setattr(record, field, fields.get(field))
+		return True
+
+
+class SampleFilter(logging.Filter):
+	"""Passes sample share of records and at most rate records per second"""
+
+	def __init__(self, sample: float = 1, rate: float = 0):
+		super().__init__()
+		self.sample = sample
+		self.bucket = TokenBucket(rate, max(rate, 1)) if rate > 0 else None
+		self._lock = threading.Lock()
+		self.dropped = 0
+
+	def filter(self, record):
+		passed = self.sample >= 1 or random.random() < self.sample
+		if passed and self.bucket is not None:
+			with self._lock:
+				passed = self.bucket.take(time.monotonic())
+		if not passed:
+			self.dropped += 1
+		return passed
+
+
+class NonBlockingQueueHandler(QueueHandler):
+	"""Puts records to queue without waiting, record is dropped if queue is full.
+	records are formatted by writer thread"""
+
+	def __init__(self, log_queue):
+		super().__init__(log_queue)
+		self.dropped = 0
+
+	def prepare(self, record):
+		# queue stays in process, so record is not copied. message is resolved while its arguments are valid
+		record.msg = record.getMessage()
+		record.args = None
+		return record
+
+	def enqueue(self, record):
+		try:
+			self.queue.put_nowait(record)
+		except queue.Full:
+			self.dropped += 1
 
 
 config_dict = {
@@ -9,27 +108,66 @@ config_dict = {
 			'format': '%(levelname)s %(asctime)s in %(module)s.%(funcName)s: %(message)s',
 			'datefmt': '%Y-%m-%d %H:%M:%S'
 		},
+		'json': {
+			'()': JsonFormatter
+		},
 	},
 	'handlers': {
-		'simple': {
-			'class': 'logging.FileHandler',
-			'filename': 'bot.log',
+		'file': {
+			'class': 'logging.handlers.RotatingFileHandler',
+			'filename': LOG_FILE,
+			'maxBytes': LOG_MAX_BYTES,
+			'backupCount': LOG_BACKUPS,
+			'encoding': 'utf-8',
 			'level': 'WARNING',
+			'formatter': 'json'
+		},
+		'console': {
+			'class': 'logging.StreamHandler',
+			'stream': sys.stdout,
+			'level': 'INFO',
 			'formatter': 'simple'
 		}
 	},
 	'loggers': {
-		'bot_logger': {
-			'level': 'WARNING',
-			'handlers': {
-				'simple'
-			}
+		# handlers used only by writer thread
+		'bot_writer': {
+			'level': 'DEBUG',
+			'handlers': ['file', 'console'],
+			'propagate': False
 		}
 	}
 }
 
-# configure logger
+# configure writer handlers
 config.dictConfig(config_dict)
 
-# create logger
+log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+queue_handler = NonBlockingQueueHandler(log_queue)
+queue_handler.addFilter(ContextFilter())
+listener = QueueListener(log_queue, *logging.getLogger('bot_writer').handlers, respect_handler_level=True)
+listener.start()
+atexit.register(listener.stop)
+
+# create logger, records are written by listener thread
 logger = logging.getLogger('bot_logger')
+logger.setLevel(logging.WARNING)
+logger.addHandler(queue_handler)
+logger.propagate = False
+
+# one record per processed update, sampled and rate limited
+update_logger = logging.getLogger('bot_logger.updates')
+update_logger.setLevel(logging.INFO)
+update_sampler = SampleFilter(UPDATE_LOG_SAMPLE, UPDATE_LOG_RATE)
+update_logger.addFilter(update_sampler)
+
+
+@contextmanager
+def log_context(**fields):
+	"""adds fields to all records logged by current thread until block ends"""
+	previous = getattr(_context, 'fields', None)
+	_context.fields = dict(previous or {}, **fields)
+	try:
+		yield
+	finally:
+		_context.fields = previous
@@ -0,0 +1,129 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# metrics cost nothing when disabled: base_method does not wrap functions with timing
+ENABLED = os.getenv('REMEMBERANCER_METRICS', '').lower() not in ('', '0', 'false', 'no')
+
+# upper bounds of latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class FunctionStats:
+	"""Call count, error count and latency histogram of one function"""
+
+	def __init__(self, name: str):
+		self.name = name
+		self.calls = 0
+		self.errors = 0
+		self.total = 0.0
+		self.buckets = [0] * len(LATENCY_BUCKETS)
+		self._lock = threading.Lock()
+
+	def observe(self, seconds: float, error: bool = False):
+		with self._lock:
+			self.calls += 1
+			self.total += seconds
+			if error:
+				self.errors += 1
+			for i, bound in enumerate(LATENCY_BUCKETS):
+				if seconds <= bound:
+					self.buckets[i] += 1
+					break
+
+
+class Registry:
+	"""Keeps metrics of wrapped functions and gauges and renders them in prometheus text format"""
+
+	def __init__(self):
+		self.functions = {}
+		# name -> (help text, function returning current value)
+		self.gauges = {}
+		self._lock = threading.Lock()
+
+	def function(self, name: str):
+		"""returns stats of function with name, creates them on first call"""
+		with self._lock:
+			stats = self.functions.get(name)
+			if stats is None:
+				stats = self.functions[name] = FunctionStats(name)
+			return stats
+
+	def gauge(self, name: str, help_text: str, value):
+		"""registers gauge. value is function without arguments called when metrics are rendered"""
+		with self._lock:
+			self.gauges[name] = (help_text, value)
+
+	def render(self):
+		"""returns all metrics in prometheus text format"""
+		lines = [
+			'# HELP bot_function_calls_total Calls of functions wrapped by base_method',
+			'# TYPE bot_function_calls_total counter'
+		]
+		with self._lock:
+			functions = sorted(self.functions.values(), key=lambda stats: stats.name)
+			gauges = sorted(self.gauges.items())
+
+		for stats in functions:
+			lines.append('bot_function_calls_total{{function="{}"}} {}'.format(stats.name, stats.calls))
+		lines += ['# HELP bot_function_errors_total Exceptions raised by wrapped functions', '# TYPE bot_function_errors_total counter']
+		for stats in functions:
+			lines.append('bot_function_errors_total{{function="{}"}} {}'.format(stats.name, stats.errors))
+		lines += ['# HELP bot_function_duration_seconds Duration of wrapped function calls', '# TYPE bot_function_duration_seconds histogram']
+		for stats in functions:
+			with stats._lock:
+				cumulative = 0
+				for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+					cumulative += count
+					lines.append('bot_function_duration_seconds_bucket{{function="{}",le="{}"}} {}'.format(stats.name, bound, cumulative))
+				lines.append('bot_function_duration_seconds_bucket{{function="{}",le="+Inf"}} {}'.format(stats.name, stats.calls))
+				lines.append('bot_function_duration_seconds_sum{{function="{}"}} {}'.format(stats.name, stats.total))
+				lines.append('bot_function_duration_seconds_count{{function="{}"}} {}'.format(stats.name, stats.calls))
+
+		for name, (help_text, value) in gauges:
+			try:
+				current = value()
+			except Exception:
+				continue
+			if current is None:
+				continue
+			lines += ['# HELP {} {}'.format(name, help_text), '# TYPE {} gauge'.format(name), '{} {}'.format(name, float(current))]
+
+		return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+_server = None
+
+
+def start_server(host: str = None, port: int = None):
+	"""serves metrics on http://host:port/metrics in background thread. does nothing if metrics are disabled"""
+	global _server
+	if not ENABLED or _server is not None:
+		return
+	if host is None:
+		host = os.getenv('REMEMBERANCER_METRICS_HOST', '127.0.0.1')
+	if port is None:
+		port = int(os.getenv('REMEMBERANCER_METRICS_PORT', 9100))
+
+	class Handler(BaseHTTPRequestHandler):
+
+		def do_GET(self):
+			if self.path != '/metrics':
+				self.send_response(404)
+				self.end_headers()
+				return
+			body = registry.render().encode()
+			self.send_response(200)
+			self.send_header('Content-Type', 'text/plain; version=0.0.4')
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, format, *args):
+			pass
+
+	_server = ThreadingHTTPServer((host, port), Handler)
+	_server.daemon_threads = True
+	threading.Thread(target=_server.serve_forever, name='metrics', daemon=True).start()
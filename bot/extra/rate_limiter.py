@@ -0,0 +1,82 @@
+import time
+import threading
+
+
+class TokenBucket:
+	"""Token bucket refilled with rate tokens per second up to capacity.
+	Tokens are reserved in advance, so waiting is done without holding any lock"""
+
+	def __init__(self, rate: float, capacity: float):
+		self.rate = rate
+		self.capacity = capacity
+		self.tokens = capacity
+		self.updated = time.monotonic()
+
+	def reserve(self, now: float):
+		"""takes one token. returns seconds to wait until the token is available"""
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+		self.tokens -= 1
+		if self.tokens >= 0:
+			return 0.0
+		return -self.tokens / self.rate
+
+	def take(self, now: float):
+		"""takes one token if it is available now. returns whether token is taken"""
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+		if self.tokens < 1:
+			return False
+		self.tokens -= 1
+		return True
+
+	def pause(self, now: float, seconds: float):
+		"""makes bucket give no tokens for seconds"""
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+		# next reserved token becomes available in seconds
+		self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+	def is_full(self, now: float):
+		return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class RateLimiter:
+	"""Limits messages sent by bot overall and to every chat"""
+
+	def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3):
+		self.global_bucket = TokenBucket(global_rate, global_rate)
+		self.chat_rate = chat_rate
+		self.chat_burst = chat_burst
+		self.chat_buckets = {}
+		self._lock = threading.Lock()
+
+	def acquire(self, chat_id: int = None):
+		"""blocks until message to chat can be sent"""
+		with self._lock:
+			now = time.monotonic()
+			wait = self.global_bucket.reserve(now)
+			if chat_id is not None:
+				wait = max(wait, self._chat_bucket(chat_id, now).reserve(now))
+		if wait > 0:
+			time.sleep(wait)
+		return wait
+
+	def pause(self, chat_id: int = None, seconds: float = 1):
+		"""stops sending to chat, or to all chats if chat_id is None, for seconds"""
+		with self._lock:
+			now = time.monotonic()
+			if chat_id is None:
+				self.global_bucket.pause(now, seconds)
+			else:
+				self._chat_bucket(chat_id, now).pause(now, seconds)
+
+	def _chat_bucket(self, chat_id: int, now: float):
+		bucket = self.chat_buckets.get(chat_id)
+		if bucket is None:
+			if len(self.chat_buckets) > 10000:
+				# forget chats which did not get messages long enough to refill their buckets
+				self.chat_buckets = {key: value for key, value in self.chat_buckets.items() if not value.is_full(now)}
+			bucket = TokenBucket(self.chat_rate, self.chat_burst)
+			self.chat_buckets[chat_id] = bucket
+		return bucket
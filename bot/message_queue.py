@@ -0,0 +1,143 @@
+import os
+import time
+import heapq
+import threading
+from logging import Logger
+from collections import deque
+
+from .api_functions import post
+
+
+class MessageQueue:
+	"""Priority queue of outgoing telegram requests sent by pool of worker threads.
+	Requests to one chat are sent one at a time in priority order, requests of the same priority in order they were queued"""
+
+	# priorities, lower is sent first
+	REMINDER = 0
+	REPLY = 1
+	# overdue reminders sent after downtime
+	CATCHUP = 2
+	CHATTER = 3
+
+	def __init__(self, logger: Logger, workers: int = None):
+		self.logger = logger
+		self.WORKERS = workers if workers is not None else int(os.getenv('REMEMBERANCER_SENDERS', 4))
+		# heap of (priority, sequence number, message)
+		self._heap = []
+		# chat id -> messages waiting while other message to this chat is being sent
+		self._waiting = {}
+		# chats which messages are being sent now
+		self._busy = set()
+		self._seq = 0
+		self._cond = threading.Condition()
+		self._workers = []
+		self.sent = 0
+		self.failed = 0
+		# seconds from queueing to telegram answer for recent messages
+		self.latencies = deque(maxlen=1000)
+
+	def start(self):
+		"""starts worker threads if they are not running"""
+		with self._cond:
+			if self._workers:
+				return
+			for i in range(self.WORKERS):
+				worker = threading.Thread(target=self._work, name='sender-{}'.format(i), daemon=True)
+				self._workers.append(worker)
+				worker.start()
+
+	def post(self, command: str, data: dict, priority: int = REPLY, callback=None, files: dict = None):
+		"""queues request. callback is called with response, or None if request failed, after it is sent"""
+		if not self._workers:
+			self.start()
+
+		message = {
+			'command': command,
+			'data': data,
+			'files': files,
+			'chat_id': data.get('chat_id'),
+			'priority': priority,
+			'callback': callback,
+			'queued_at': time.monotonic()
+		}
+		with self._cond:
+			self._seq += 1
+			message['seq'] = self._seq
+			heapq.heappush(self._heap, (priority, message['seq'], message))
+			self._cond.notify()
+
+	def depth(self):
+		"""returns number of messages which are not sent yet"""
+		with self._cond:
+			return len(self._heap) + sum(len(messages) for messages in self._waiting.values())
+
+	def stats(self):
+		"""returns dict with queue depth, counts of sent and failed messages and latency percentiles"""
+		latencies = sorted(self.latencies)
+		stats = {
+			'depth': self.depth(),
+			'sent': self.sent,
+			'failed': self.failed,
+			'latency_p50': None,
+			'latency_p99': None,
+			'latency_max': None
+		}
+		if latencies:
+			stats['latency_p50'] = latencies[len(latencies) // 2]
+			stats['latency_p99'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+			stats['latency_max'] = latencies[-1]
+		return stats
+
+	def _next(self):
+		# waits for message which chat is not busy and marks chat busy
+		with self._cond:
+			while True:
+				while not self._heap:
+					self._cond.wait()
+				_, _, message = heapq.heappop(self._heap)
+				chat_id = message['chat_id']
+				if chat_id is None:
+					return message
+				if chat_id in self._busy:
+					self._waiting.setdefault(chat_id, deque()).append(message)
+					continue
+				self._busy.add(chat_id)
+				return message
+
+	def _done(self, message: dict):
+		# frees chat and puts its next waiting message back to heap
+		chat_id = message['chat_id']
+		if chat_id is None:
+			return
+		with self._cond:
+			self._busy.discard(chat_id)
+			waiting = self._waiting.get(chat_id)
+			if waiting:
+				following = waiting.popleft()
+				if not waiting:
+					del self._waiting[chat_id]
+				heapq.heappush(self._heap, (following['priority'], following['seq'], following))
+				self._cond.notify()
+
+	def _work(self):
+		while True:
+			message = self._next()
+			try:
+				response = post(message['command'], message['data'], files=message['files'])
+			except Exception:
+				# already logged by base_method
+				response = None
+			finally:
+				self._done(message)
+
+			self.latencies.append(time.monotonic() - message['queued_at'])
+			if response is not None and response.status_code == 200:
+				self.sent += 1
+			else:
+				self.failed += 1
+
+			if message['callback'] is not None:
+				try:
+					message['callback'](response)
+				except Exception as e:
+					self.logger.error('message callback failed: {}'.format(e))
@@ -0,0 +1,211 @@
+import os
+import re
+import argparse
+from logging import Logger
+from datetime import datetime
+
+import psycopg2
+
+from .extra.exceptions import base_method
+from .extra.logger import logger
+from .storage.postgres import connect_to_db
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+MIGRATION_RE = re.compile(r'(\d{4})_(\w+)\.sql')
+PARTITION_RE = re.compile(r'reminder_(\d{4})_(\d{2})')
+# held while migrating, so instances started together don't apply migrations twice
+MIGRATION_LOCK = 5271032
+# months ahead partitions are created for, later reminders go to default partition
+PARTITION_MONTHS_AHEAD = int(os.getenv('REMEMBERANCER_PARTITION_MONTHS_AHEAD', 12))
+
+# reminder table partitioned by month of reminder_date. primary and unique keys must contain reminder_date
+PARTITIONED_REMINDER = """
+CREATE TABLE reminder(
+	id BIGINT NOT NULL DEFAULT nextval('reminder_id_seq'),
+	chat_id	BIGINT NOT NULL REFERENCES chat,
+	reminder_date TIMESTAMPTZ NOT NULL,
+	reminder_text VARCHAR(200),
+	claimed_by VARCHAR(100),
+	claimed_until TIMESTAMPTZ,
+	recurrence VARCHAR(100),
+	status VARCHAR(20) NOT NULL DEFAULT 'pending',
+	attempts INTEGER NOT NULL DEFAULT 0,
+	next_attempt_at TIMESTAMPTZ,
+	last_error VARCHAR(200)
+) PARTITION BY RANGE (reminder_date)
+"""
+
+
+def migrations(path: str = MIGRATIONS_DIR):
+	"""returns sorted list of (version, name, file path) of migration files"""
+	found = []
+	for file_name in os.listdir(path):
+		match = MIGRATION_RE.fullmatch(file_name)
+		if match is not None:
+			found.append((int(match.group(1)), match.group(2), os.path.join(path, file_name)))
+	return sorted(found)
+
+
+@base_method
+def upgrade(con, logger: Logger, path: str = MIGRATIONS_DIR):
+	"""applies migrations which are not applied yet, every one in its own transaction.
+	returns list of applied versions"""
+	with con.cursor() as cur:
+		cur.execute('SELECT pg_advisory_lock(%s)', (MIGRATION_LOCK,))
+		cur.execute('CREATE TABLE IF NOT EXISTS schema_version(version INTEGER PRIMARY KEY, name VARCHAR(200) NOT NULL, applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW())')
+		cur.execute('SELECT version FROM schema_version')
+		done = {row[0] for row in cur.fetchall()}
+	con.commit()
+
+	applied = []
+	try:
+		for version, name, file_path in migrations(path):
+			if version in done:
+				continue
+			with open(file_path) as f:
+				sql = f.read()
+			try:
+				with con.cursor() as cur:
+					cur.execute(sql)
+					cur.execute('INSERT INTO schema_version(version, name) VALUES(%s, %s)', (version, name))
+				con.commit()
+			except psycopg2.Error:
+				con.rollback()
+				logger.error('migration {:04}_{} failed'.format(version, name))
+				raise
+			logger.warning('applied migration {:04}_{}'.format(version, name))
+			applied.append(version)
+	finally:
+		with con.cursor() as cur:
+			cur.execute('SELECT pg_advisory_unlock(%s)', (MIGRATION_LOCK,))
+		con.commit()
+	return applied
+
+
+def add_months(month: datetime, months: int):
+	month_index = month.month - 1 + months
+	return month.replace(year=month.year + month_index // 12, month=month_index % 12 + 1, day=1)
+
+
+def month_start(dt: datetime):
+	return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+
+
+def is_partitioned(cur):
+	cur.execute("SELECT relkind FROM pg_class WHERE oid = 'reminder'::regclass")
+	return cur.fetchone()[0] == 'p'
+
+
+def ensure_partition(cur, month: datetime):
+	"""creates partition of reminder for month if it does not exist.
+	rows of this month from default partition are moved to it"""
+	name = 'reminder_{:%Y_%m}'.format(month)
+	cur.execute('SELECT to_regclass(%s)', (name,))
+	if cur.fetchone()[0] is not None:
+		return False
+
+	start, end = month, add_months(month, 1)
+	cur.execute('CREATE TABLE {name} (LIKE reminder INCLUDING DEFAULTS)'.format(name=name))
+	cur.execute('WITH moved AS (DELETE FROM reminder_default WHERE reminder_date >= %s AND reminder_date < %s RETURNING *) INSERT INTO {name} SELECT * FROM moved'.format(name=name), (start, end))
+	cur.execute('ALTER TABLE reminder ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)'.format(name=name), (start, end))
+	return True
+
+
+@base_method
+def ensure_partitions(con, logger: Logger, months_ahead: int = PARTITION_MONTHS_AHEAD):
+	"""creates monthly partitions from current month to months_ahead months ahead if reminder is partitioned"""
+	with con.cursor() as cur:
+		if not is_partitioned(cur):
+			return
+		month = month_start(datetime.utcnow())
+		for i in range(months_ahead + 1):
+			if ensure_partition(cur, add_months(month, i)):
+				logger.warning('created partition reminder_{:%Y_%m}'.format(add_months(month, i)))
+	con.commit()
+
+
+@base_method
+def partition_reminders(con, logger: Logger, months_ahead: int = PARTITION_MONTHS_AHEAD):
+	"""turns reminder into table partitioned by month, so months of old reminders can be dropped at once.
+	returns False if it is partitioned already"""
+	with con.cursor() as cur:
+		if is_partitioned(cur):
+			return False
+
+		cur.execute('LOCK TABLE reminder IN ACCESS EXCLUSIVE MODE')
+		cur.execute('SELECT MIN(reminder_date) FROM reminder')
+		first = cur.fetchone()[0] or datetime.utcnow()
+		cur.execute('ALTER TABLE reminder RENAME TO reminder_unpartitioned')
+		# sequence would be dropped together with old table
+		cur.execute('ALTER SEQUENCE reminder_id_seq OWNED BY NONE')
+		cur.execute(PARTITIONED_REMINDER)
+		cur.execute('CREATE TABLE reminder_default PARTITION OF reminder DEFAULT')
+
+		month, last = month_start(first), add_months(month_start(datetime.utcnow()), months_ahead)
+		while month <= last:
+			ensure_partition(cur, month)
+			month = add_months(month, 1)
+
+		cur.execute('INSERT INTO reminder SELECT id, chat_id, reminder_date, reminder_text, claimed_by, claimed_until, recurrence, status, attempts, next_attempt_at, last_error FROM reminder_unpartitioned')
+		cur.execute('DROP TABLE reminder_unpartitioned')
+		cur.execute('ALTER SEQUENCE reminder_id_seq OWNED BY reminder.id')
+		cur.execute('ALTER TABLE reminder ADD PRIMARY KEY (id, reminder_date)')
+		cur.execute('ALTER TABLE reminder ADD UNIQUE (reminder_date, chat_id)')
+		cur.execute('CREATE INDEX reminder_due ON reminder(reminder_date)')
+		cur.execute('CREATE INDEX reminder_chat_page ON reminder(chat_id, reminder_date, id)')
+	con.commit()
+	logger.warning('reminder table is partitioned by month')
+	return True
+
+
+@base_method
+def drop_partitions(con, logger: Logger, before: datetime):
+	"""drops monthly partitions of reminder which end before date. returns names of dropped partitions"""
+	dropped = []
+	with con.cursor() as cur:
+		if not is_partitioned(cur):
+			return dropped
+		cur.execute("SELECT child.relname FROM pg_inherits JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid WHERE pg_inherits.inhparent = 'reminder'::regclass")
+		for (name,) in cur.fetchall():
+			match = PARTITION_RE.fullmatch(name)
+			if match is None:
+				continue
+			if add_months(datetime(int(match.group(1)), int(match.group(2)), 1), 1) <= before:
+				cur.execute('DROP TABLE {name}'.format(name=name))
+				dropped.append(name)
+	con.commit()
+	for name in dropped:
+		logger.warning('dropped partition {}'.format(name))
+	return dropped
+
+
+@base_method
+def prepare_database(logger: Logger):
+	"""applies migrations and creates partitions for coming months"""
+	con = connect_to_db()
+	try:
+		upgrade(con, logger)
+		ensure_partitions(con, logger)
+	finally:
+		con.close()
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Applies database migrations')
+	parser.add_argument('--partition', action='store_true', help='partition reminder table by month')
+	parser.add_argument('--drop-partitions-before', metavar='YYYY-MM', help='drop monthly partitions ending before this month')
+	args = parser.parse_args()
+
+	con = connect_to_db()
+	try:
+		for version in upgrade(con, logger):
+			print('applied migration', version)
+		if args.partition and partition_reminders(con, logger):
+			print('reminder table is partitioned')
+		ensure_partitions(con, logger)
+		if args.drop_partitions_before:
+			for name in drop_partitions(con, logger, datetime.strptime(args.drop_partitions_before, '%Y-%m')):
+				print('dropped', name)
+	finally:
+		con.close()
@@ -0,0 +1,172 @@
+import re
+import time
+
+from psycopg2 import extensions
+
+from .extra import metrics
+
+
+class Statement:
+	"""Named sql statement with $1, $2... parameters of given types"""
+
+	def __init__(self, name: str, types: tuple, sql: str):
+		self.name = name
+		self.sql = sql
+		self.prepare = 'PREPARE {name}({types}) AS {sql}'.format(name=name, types=', '.join(types), sql=sql) if types else 'PREPARE {name} AS {sql}'.format(name=name, sql=sql)
+		self.execute = 'EXECUTE {name}({params})'.format(name=name, params=', '.join(['%s'] * len(types))) if types else 'EXECUTE {name}'.format(name=name)
+		# statement with psycopg2 placeholders for connections which can't keep prepared statements
+		self.query = re.sub(r'\$(\d+)', r'%(p\1)s', sql.replace('%', '%%'))
+
+
+class PreparedConnection(extensions.connection):
+	"""Connection remembering names of statements prepared on it.
+	prepared statements live as long as database session, so they survive rollbacks"""
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.prepared = set()
+
+
+# reminder_date is timestamptz, it is returned as naive utc datetime the rest of bot uses.
+# queries ordering by it name table column, alias would order by expression and miss the index
+REMINDER_COLUMNS = "id, chat_id, reminder_date AT TIME ZONE 'UTC' AS reminder_date, reminder_text, recurrence, attempts, next_attempt_at AT TIME ZONE 'UTC' AS next_attempt_at"
+
+STATEMENTS = {statement.name: statement for statement in [
+	# chat context
+	Statement('load_chat_context', ('bigint',),
+		"SELECT chat.chat_mode, chat.awaits_for, chat.timezone, temp.reminder_date, temp.reminder_time "
+		"FROM (SELECT $1::bigint AS chat_id) AS requested "
+		"LEFT JOIN chat ON chat.chat_id = requested.chat_id "
+		"LEFT JOIN temp_datetime AS temp ON temp.chat_id = requested.chat_id"),
+	Statement('flush_chat', ('bigint', 'varchar', 'varchar', 'integer'),
+		"INSERT INTO chat(chat_id, chat_mode, awaits_for, timezone) VALUES($1, $2, $3, $4) "
+		"ON CONFLICT(chat_id) DO UPDATE SET chat_mode = EXCLUDED.chat_mode, awaits_for = EXCLUDED.awaits_for, timezone = EXCLUDED.timezone"),
+	Statement('flush_temp_datetime', ('bigint', 'varchar', 'varchar'),
+		"INSERT INTO temp_datetime(chat_id, reminder_date, reminder_time) VALUES($1, $2, $3) "
+		"ON CONFLICT(chat_id) DO UPDATE SET reminder_date = EXCLUDED.reminder_date, reminder_time = EXCLUDED.reminder_time"),
+
+	# reminders
+	Statement('set_reminder', ('bigint', 'timestamptz', 'varchar', 'varchar'),
+		"INSERT INTO reminder(chat_id, reminder_date, reminder_text, recurrence) VALUES($1, $2, $3, $4) "
+		"ON CONFLICT(reminder_date, chat_id) DO NOTHING RETURNING " + REMINDER_COLUMNS),
+	Statement('get_chat_reminder_by_dt', ('bigint', 'timestamptz'),
+		"SELECT " + REMINDER_COLUMNS + " FROM reminder WHERE chat_id = $1 AND reminder_date = $2"),
+	Statement('get_reminders_due_before', ('timestamptz',),
+		"SELECT " + REMINDER_COLUMNS + " FROM reminder "
+		"WHERE reminder_date < $1 AND status <> 'failed' AND (next_attempt_at IS NULL OR next_attempt_at < $1) "
+		# reminders being sent are loaded again only when their lease expires, after sender died
+		"AND (status <> 'in_flight' OR claimed_until IS NULL OR claimed_until < NOW()) ORDER BY reminder.reminder_date"),
+	Statement('delete_reminder', ('bigint',),
+		"DELETE FROM reminder WHERE id = $1"),
+	Statement('delete_chat_reminder', ('bigint', 'bigint'),
+		"DELETE FROM reminder WHERE id = $1 AND chat_id = $2 RETURNING " + REMINDER_COLUMNS),
+	Statement('delete_reminders', ('bigint[]',),
+		"DELETE FROM reminder WHERE id = ANY($1) RETURNING " + REMINDER_COLUMNS),
+	Statement('advance_reminders', ('bigint[]', 'timestamptz[]'),
+		"UPDATE reminder SET reminder_date = next.reminder_date, claimed_by = NULL, claimed_until = NULL, "
+		"status = 'pending', attempts = 0, next_attempt_at = NULL, last_error = NULL "
+		"FROM (SELECT UNNEST($1) AS id, UNNEST($2) AS reminder_date) AS next "
+		"WHERE reminder.id = next.id AND NOT EXISTS "
+		"(SELECT 1 FROM reminder AS other WHERE other.chat_id = reminder.chat_id AND other.reminder_date = next.reminder_date) "
+		"RETURNING reminder.id, reminder.chat_id, reminder.reminder_date AT TIME ZONE 'UTC', reminder.reminder_text, reminder.recurrence, "
+		"reminder.attempts, reminder.next_attempt_at AT TIME ZONE 'UTC'"),
+	# sent reminders are deleted or advanced, so only start and failure of delivery are written
+	Statement('start_delivery', ('bigint[]', 'float8'),
+		"UPDATE reminder SET status = 'in_flight', claimed_until = NOW() + $2 * INTERVAL '1 second' WHERE id = ANY($1)"),
+	Statement('delivery_failed', ('bigint[]', 'timestamptz[]', 'varchar[]', 'varchar[]'),
+		"UPDATE reminder SET attempts = reminder.attempts + 1, status = failure.status, next_attempt_at = failure.next_attempt_at, "
+		"last_error = failure.last_error, claimed_by = NULL, claimed_until = NULL "
+		"FROM (SELECT UNNEST($1) AS id, UNNEST($2) AS next_attempt_at, UNNEST($3) AS status, UNNEST($4) AS last_error) AS failure "
+		"WHERE reminder.id = failure.id"),
+	Statement('existing_reminders', ('bigint[]',),
+		"SELECT id FROM reminder WHERE id = ANY($1)"),
+	Statement('get_user_reminders', ('bigint',),
+		"SELECT " + REMINDER_COLUMNS + " FROM reminder WHERE chat_id = $1"),
+	Statement('reminders_page', ('bigint', 'integer'),
+		"SELECT " + REMINDER_COLUMNS + " FROM reminder WHERE chat_id = $1 ORDER BY reminder.reminder_date, reminder.id LIMIT $2"),
+	Statement('reminders_page_after', ('bigint', 'timestamptz', 'bigint', 'integer'),
+		"SELECT " + REMINDER_COLUMNS + " FROM reminder "
+		"WHERE chat_id = $1 AND (reminder_date, id) > ($2, $3) ORDER BY reminder.reminder_date, reminder.id LIMIT $4"),
+	Statement('reminders_page_before', ('bigint', 'timestamptz', 'bigint', 'integer'),
+		"SELECT " + REMINDER_COLUMNS + " FROM reminder "
+		"WHERE chat_id = $1 AND (reminder_date, id) < ($2, $3) ORDER BY reminder.reminder_date DESC, reminder.id DESC LIMIT $4"),
+
+	# chats
+	Statement('set_chat_mode', ('bigint', 'varchar', 'varchar'),
+		"INSERT INTO chat(chat_id, chat_mode, awaits_for) VALUES($1, $2, $3) "
+		"ON CONFLICT(chat_id) DO UPDATE SET chat_mode = EXCLUDED.chat_mode, awaits_for = EXCLUDED.awaits_for RETURNING chat_mode, awaits_for, timezone"),
+	Statement('get_chat', ('bigint',),
+		"SELECT chat_mode, awaits_for, timezone FROM chat WHERE chat_id = $1"),
+	Statement('set_timezone', ('bigint', 'integer'),
+		"INSERT INTO chat(chat_id, chat_mode, timezone) VALUES($1, 'normal', $2) "
+		"ON CONFLICT(chat_id) DO UPDATE SET timezone = EXCLUDED.timezone RETURNING chat_mode, awaits_for, timezone"),
+	Statement('save_temp_date', ('bigint', 'varchar'),
+		"INSERT INTO temp_datetime(chat_id, reminder_date) VALUES($1, $2) ON CONFLICT(chat_id) DO UPDATE SET reminder_date = EXCLUDED.reminder_date"),
+	Statement('save_temp_time', ('bigint', 'varchar'),
+		"INSERT INTO temp_datetime(chat_id, reminder_time) VALUES($1, $2) ON CONFLICT(chat_id) DO UPDATE SET reminder_time = EXCLUDED.reminder_time"),
+	Statement('get_temp_date', ('bigint',),
+		"SELECT reminder_date FROM temp_datetime WHERE chat_id = $1"),
+	Statement('get_temp_time', ('bigint',),
+		"SELECT reminder_time FROM temp_datetime WHERE chat_id = $1"),
+	# foreign keys are checked when statement ends, after rows of all tables are deleted
+	Statement('delete_chats', ('bigint',),
+		"WITH reminders AS (DELETE FROM reminder WHERE chat_id >= $1), temp AS (DELETE FROM temp_datetime WHERE chat_id >= $1) "
+		"DELETE FROM chat WHERE chat_id >= $1"),
+
+	# cluster
+	Statement('heartbeat', ('varchar',),
+		"INSERT INTO bot_instance(instance_id, heartbeat) VALUES($1, NOW()) ON CONFLICT(instance_id) DO UPDATE SET heartbeat = EXCLUDED.heartbeat"),
+	Statement('forget_instances', ('float8',),
+		"DELETE FROM bot_instance WHERE heartbeat < NOW() - $1 * INTERVAL '1 second'"),
+	Statement('get_instances', (),
+		"SELECT instance_id FROM bot_instance ORDER BY instance_id"),
+	Statement('get_state', ('varchar',),
+		"SELECT value FROM bot_state WHERE key = $1"),
+	Statement('get_update_owners', ('bigint[]',),
+		"SELECT DISTINCT ON (chat_id) chat_id, owner FROM pending_update WHERE chat_id = ANY($1)"),
+	Statement('queue_update', ('bigint', 'bigint', 'varchar', 'text'),
+		"INSERT INTO pending_update(update_id, chat_id, owner, payload) VALUES($1, $2, $3, $4) ON CONFLICT(update_id) DO NOTHING"),
+	Statement('set_last_update_id', ('bigint',),
+		"INSERT INTO bot_state(key, value) VALUES('last_update_id', $1) ON CONFLICT(key) DO UPDATE SET value = GREATEST(bot_state.value, EXCLUDED.value)"),
+	# deletes update queued in cluster and saves last processed update id in transaction of update effects
+	Statement('update_processed', ('bigint', 'bigint'),
+		"WITH done AS (DELETE FROM pending_update WHERE update_id = $1) "
+		"INSERT INTO bot_state(key, value) VALUES('last_update_id', $2) ON CONFLICT(key) DO UPDATE SET value = GREATEST(bot_state.value, EXCLUDED.value)"),
+	Statement('get_assigned_updates', ('varchar', 'bigint[]', 'integer'),
+		"SELECT payload FROM pending_update WHERE owner = $1 AND NOT update_id = ANY($2) ORDER BY update_id LIMIT $3"),
+	Statement('delete_pending_updates', ('bigint[]',),
+		"DELETE FROM pending_update WHERE update_id = ANY($1)"),
+	Statement('reassign_updates', ('varchar[]', 'integer'),
+		"UPDATE pending_update SET owner = ($1)[ABS(COALESCE(chat_id, 0)) % $2 + 1] WHERE NOT owner = ANY($1)"),
+	Statement('claim_reminders', ('varchar', 'float8', 'bigint[]'),
+		"UPDATE reminder SET claimed_by = $1, claimed_until = NOW() + $2 * INTERVAL '1 second', status = 'in_flight' "
+		"WHERE id IN (SELECT id FROM reminder WHERE id = ANY($3) AND (claimed_until IS NULL OR claimed_until < NOW() OR claimed_by = $1) FOR UPDATE SKIP LOCKED) "
+		"RETURNING " + REMINDER_COLUMNS),
+]}
+
+# functions called with statement name, duration in seconds and whether it failed after every execution
+hooks = []
+if metrics.ENABLED:
+	hooks.append(lambda name, seconds, error: metrics.registry.function('sql:' + name).observe(seconds, error=error))
+
+
+def execute(cur, name: str, params: tuple = ()):
+	"""executes named statement with bound params. statement is prepared on first use on every connection"""
+	statement = STATEMENTS[name]
+	prepared = getattr(cur.connection, 'prepared', None)
+	started = time.perf_counter()
+	error = True
+	try:
+		if prepared is None:
+			cur.execute(statement.query, {'p{}'.format(i): value for i, value in enumerate(params, 1)})
+		else:
+			if name not in prepared:
+				cur.execute(statement.prepare)
+				prepared.add(name)
+			cur.execute(statement.execute, params)
+		error = False
+	finally:
+		if hooks:
+			seconds = time.perf_counter() - started
+			for hook in hooks:
+				hook(name, seconds, error)
@@ -0,0 +1,201 @@
+import re
+import calendar
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+
+# rule at the beginning of one line reminder: "every 5 minutes", "daily", "every weekday", "cron */5 * * * *"
+RULE_RE = re.compile(
+	r'\s*(?P<rule>every\s+(?:(?P<amount>\d{1,4})\s+)?(?P<unit>minutes?|hours?|days?|weeks?|months?|weekdays?)'
+	r'|(?P<word>hourly|daily|weekly|monthly)'
+	r'|cron\s+(?P<cron>\S+\s+\S+\s+\S+\s+\S+\s+\S+))(?:\s+(?P<rest>.*))?',
+	re.IGNORECASE | re.DOTALL
+)
+WEEKDAY_TIME_RE = re.compile(r'(\d{1,2}):(\d{2})(?:\s+(.*))?', re.DOTALL)
+WORDS = {'hourly': 'hour', 'daily': 'day', 'weekly': 'week', 'monthly': 'month'}
+# cron fields: minute, hour, day of month, month, day of week (0 is sunday)
+CRON_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+# how far cron rule is searched for next occurrence
+CRON_SEARCH_DAYS = 366 * 5
+
+
+class Rule:
+	"""Recurrence rule stored in reminder.recurrence as text.
+	'every N minutes|hours|days|weeks', 'every month on DAY' or 'cron M H DOM MON DOW'.
+	cron and monthly rules are evaluated in chat timezone"""
+
+	def __init__(self, text: str):
+		self.text = text
+		self.interval = None
+		self.monthly = False
+		# day of month monthly rule occurs on, it is kept when month is shorter
+		self.day = None
+		self.cron = None
+
+		words = text.split()
+		if words[0] == 'cron':
+			self.cron = parse_cron(words[1:])
+		elif words[:2] == ['every', 'month']:
+			self.monthly = True
+			if len(words) == 4 and words[2] == 'on' and 1 <= int(words[3]) <= 31:
+				self.day = int(words[3])
+			elif len(words) != 2:
+				raise ValueError
+		else:
+			amount = int(words[1]) if len(words) == 3 else 1
+			self.interval = timedelta(**{words[-1].rstrip('s') + 's': amount})
+
+	def next(self, last: datetime, now: datetime, tz: int = 0):
+		"""returns first occurrence after now of rule which occurred at last. all datetimes are utc"""
+		if self.interval is not None:
+			# missed occurrences are skipped without walking through them
+			passed = max(0, (now - last) // self.interval + 1)
+			return last + self.interval * passed
+
+		offset = timedelta(hours=tz)
+		local_last, local_now = last + offset, now + offset
+		if self.monthly:
+			day = self.day or local_last.day
+			months = 1
+			while True:
+				month = local_last.month - 1 + months
+				year = local_last.year + month // 12
+				month = month % 12 + 1
+				dt = local_last.replace(year=year, month=month, day=min(day, calendar.monthrange(year, month)[1]))
+				if dt > local_now:
+					return dt - offset
+				# jump close to now instead of adding one month at a time
+				months = max(months + 1, (local_now.year - local_last.year) * 12 + local_now.month - local_last.month)
+
+		return next_cron(self.cron, max(local_last, local_now)) - offset
+
+	def __str__(self):
+		return self.text
+
+
+def parse_cron_field(field: str, low: int, high: int):
+	"""returns set of values of one cron field like '*', '*/5', '1-5', '0,30' or None if field is invalid"""
+	values = set()
+	for part in field.split(','):
+		part, _, step = part.partition('/')
+		step = int(step) if step.isdigit() else (1 if step == '' else 0)
+		if step < 1:
+			return None
+		if part == '*':
+			start, end = low, high
+		elif '-' in part:
+			start, _, end = part.partition('-')
+			if not start.isdigit() or not end.isdigit():
+				return None
+			start, end = int(start), int(end)
+		elif part.isdigit():
+			start = end = int(part)
+			if step > 1:
+				end = high
+		else:
+			return None
+		if start < low or end > high or start > end:
+			return None
+		values.update(range(start, end + 1, step))
+	return values
+
+
+def parse_cron(fields: list):
+	"""returns list of value sets of five cron fields or None if rule is invalid"""
+	if len(fields) != 5:
+		return None
+	sets = [parse_cron_field(field, low, high) for field, (low, high) in zip(fields, CRON_RANGES)]
+	if None in sets:
+		return None
+	# 7 is sunday too
+	if 7 in sets[4]:
+		sets[4] = (sets[4] - {7}) | {0}
+	# day is matched by day of month or day of week when both are restricted, like in cron
+	sets.append(fields[2] != '*' and fields[4] != '*')
+	# days months of rule never have, like 31 of february, never occur. 2000 is leap year
+	if not sets[5] and not any(day <= calendar.monthrange(2000, month)[1] for month in sets[3] for day in sets[2]):
+		return None
+	return sets
+
+
+def cron_day_matches(cron: list, day: datetime):
+	minutes, hours, days, months, weekdays, either = cron
+	if day.month not in months:
+		return False
+	in_days = day.day in days
+	in_weekdays = (day.weekday() + 1) % 7 in weekdays
+	return in_days or in_weekdays if either else in_days and in_weekdays
+
+
+def next_cron(cron: list, after: datetime):
+	"""returns first minute after after matching cron rule"""
+	minutes, hours = sorted(cron[0]), sorted(cron[1])
+	start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+	day = start.replace(hour=0, minute=0)
+	for _ in range(CRON_SEARCH_DAYS):
+		if cron_day_matches(cron, day):
+			for hour in hours:
+				for minute in minutes:
+					dt = day.replace(hour=hour, minute=minute)
+					if dt >= start:
+						return dt
+		day += timedelta(days=1)
+	raise ValueError('cron rule never occurs')
+
+
+@lru_cache(maxsize=1024)
+def parse_rule(text: str):
+	"""returns Rule of stored rule text or None if text is not valid rule"""
+	if not text:
+		return None
+	try:
+		rule = Rule(text)
+	except (ValueError, TypeError, IndexError):
+		return None
+	if rule.cron is None and rule.interval is None and not rule.monthly:
+		return None
+	return rule
+
+
+def anchored(rule: Rule, first: datetime, tz: int = 0):
+	"""returns rule bound to its first occurrence, monthly rule keeps day of month of first occurrence in chat timezone"""
+	if rule.monthly and rule.day is None:
+		return parse_rule('every month on {}'.format((first + timedelta(hours=tz)).day))
+	return rule
+
+
+@lru_cache(maxsize=4096)
+def split_rule(text: str):
+	"""splits one line reminder starting with recurrence rule. returns (Rule, rest of text) or None"""
+	match = RULE_RE.fullmatch(text)
+	if match is None:
+		return None
+	rest = (match.group('rest') or '').strip()
+
+	if match.group('cron') is not None:
+		rule = parse_rule('cron ' + ' '.join(match.group('cron').split()))
+	elif match.group('word') is not None:
+		rule = parse_rule('every ' + WORDS[match.group('word').lower()])
+	elif match.group('unit').lower().startswith('weekday'):
+		# weekday rule needs time of day: "every weekday 9:00 text"
+		time = WEEKDAY_TIME_RE.fullmatch(rest)
+		if time is None or match.group('amount') is not None:
+			return None
+		rule = parse_rule('cron {} {} * * 1-5'.format(int(time.group(2)), int(time.group(1))))
+		rest = (time.group(3) or '').strip()
+	else:
+		unit = match.group('unit').lower().rstrip('s')
+		amount = int(match.group('amount') or 1)
+		if amount < 1:
+			return None
+		if unit == 'month':
+			if amount != 1:
+				return None
+			rule = parse_rule('every month')
+		elif amount == 1:
+			rule = parse_rule('every ' + unit)
+		else:
+			rule = parse_rule('every {} {}s'.format(amount, unit))
+	if rule is None:
+		return None
+	return rule, rest
@@ -0,0 +1,104 @@
+import csv
+from datetime import datetime
+from collections import namedtuple
+
+from . import datetime_parser
+
+
+# dt is naive datetime, in utc if utc is True and in user timezone otherwise. error is None for valid row
+Row = namedtuple('Row', ['line', 'dt', 'text', 'utc', 'error'])
+
+CSV_HEADER = ['date', 'text']
+
+
+def parse_local_datetime(text: str):
+	"""parses 'dd/mm/yyyy hh:mm' or iso datetime. returns datetime or None"""
+	parts = text.split()
+	if len(parts) == 2:
+		date = datetime_parser.parse_date(parts[0])
+		time = datetime_parser.parse_time(parts[1])
+		if date is not None and date[2] is not None and time is not None:
+			return datetime(date[2], date[1], date[0], time[0], time[1])
+	try:
+		return datetime.fromisoformat(text.strip()).replace(tzinfo=None, second=0, microsecond=0)
+	except ValueError:
+		return None
+
+
+def read_csv(lines):
+	"""yields Row for every csv record of lines. record is date in user timezone and optional text,
+	header row is skipped"""
+	for line, record in enumerate(csv.reader(lines), 1):
+		if not record or not ''.join(record).strip():
+			continue
+		if line == 1 and [value.strip().lower() for value in record[:2]] == CSV_HEADER[:len(record[:2])]:
+			continue
+
+		dt = parse_local_datetime(record[0])
+		text = ','.join(record[1:]).strip()
+		if dt is None:
+			yield Row(line, None, text, False, 'invalid date')
+		else:
+			yield Row(line, dt, text, False, None)
+
+
+def unfold(lines):
+	"""joins folded icalendar lines. yields (number of first line, logical line)"""
+	current = None
+	start = 0
+	for number, line in enumerate(lines, 1):
+		line = line.rstrip('\r\n')
+		if line[:1] in (' ', '\t') and current is not None:
+			current += line[1:]
+			continue
+		if current is not None:
+			yield start, current
+		current, start = line, number
+	if current is not None:
+		yield start, current
+
+
+def parse_ical_datetime(value: str):
+	"""parses DTSTART value. returns (datetime, is utc) or (None, False)"""
+	utc = value.endswith('Z')
+	value = value.rstrip('Z')
+	for fmt in ('%Y%m%dT%H%M%S', '%Y%m%dT%H%M', '%Y%m%d'):
+		try:
+			return datetime.strptime(value, fmt), utc
+		except ValueError:
+			continue
+	return None, False
+
+
+def unescape_ical(text: str):
+	return text.replace('\\n', '\n').replace('\\N', '\n').replace('\\,', ',').replace('\\;', ';').replace('\\\\', '\\')
+
+
+def read_ical(lines):
+	"""yields Row for every VEVENT of icalendar lines. DTSTART is reminder time, SUMMARY is its text.
+	time without Z or with TZID is taken in user timezone"""
+	event = None
+	for line, content in unfold(lines):
+		name, _, value = content.partition(':')
+		name, _, params = name.partition(';')
+		name = name.upper()
+
+		if name == 'BEGIN' and value.upper() == 'VEVENT':
+			event = {'line': line, 'dt': None, 'utc': False, 'text': ''}
+		elif event is None:
+			continue
+		elif name == 'DTSTART':
+			event['dt'], event['utc'] = parse_ical_datetime(value.strip())
+		elif name == 'SUMMARY':
+			event['text'] = unescape_ical(value).strip()
+		elif name == 'END' and value.upper() == 'VEVENT':
+			error = 'invalid date' if event['dt'] is None else None
+			yield Row(event['line'], event['dt'], event['text'], event['utc'], error)
+			event = None
+
+
+def read_reminders(file_name: str, lines):
+	"""yields Row for every reminder in csv or icalendar file"""
+	if (file_name or '').lower().endswith(('.ics', '.ical', '.ifb', '.icalendar')):
+		return read_ical(lines)
+	return read_csv(lines)
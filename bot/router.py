@@ -0,0 +1,181 @@
+import time
+from random import choice
+
+from .extra.exceptions import base_method
+from .extra.logger import update_logger, log_context
+from .extra import metrics
+
+
+class Request:
+	"""Update routed to handler. kind is command, text, callback, document or other.
+	middleware fills mode and awaits_for of chat and may keep anything else in state"""
+
+	def __init__(self, update: dict, chat_id: int, kind: str, key: str = None, text: str = '', args: str = '', message_id: int = None):
+		self.update = update
+		self.update_id = update.get('update_id')
+		self.chat_id = chat_id
+		self.kind = kind
+		# command, chat mode or callback prefix route is looked up by
+		self.key = key
+		self.text = text
+		# text after command or fields of callback data after prefix
+		self.args = args
+		self.message_id = message_id
+		self.mode = None
+		self.awaits_for = None
+		self.route = None
+		self.state = {}
+
+
+class Route:
+	"""Handler of requests of one command, mode or callback prefix.
+	modes are chat modes handler runs in, any mode if it is None. denied handles request in other modes"""
+
+	def __init__(self, name: str, handler, modes: tuple = None, denied=None):
+		self.name = name
+		self.handler = handler
+		self.modes = modes
+		self.denied = denied
+
+
+class Router:
+	"""Finds handler of request by command, mode or callback prefix in dicts and runs it through middleware.
+	middleware is function taking request and function calling the rest of chain"""
+
+	def __init__(self, logger):
+		self.logger = logger
+		self.commands = {}
+		self.modes = {}
+		self.callbacks = {}
+		# handlers of documents, unknown commands and other messages
+		self.kinds = {}
+		self.middleware = []
+		self.chain = self.call_handler
+
+	def command(self, command: str, handler, modes: tuple = ('normal',), denied=None):
+		self.commands[command] = Route(command, handler, modes, denied)
+
+	def mode(self, mode: str, handler):
+		"""registers handler of text sent in chat mode"""
+		self.modes[mode] = Route('text:' + mode, handler)
+
+	def callback(self, prefix: str, handler, modes: tuple = None, denied=None):
+		"""registers handler of inline buttons which callback data starts with 'prefix:'"""
+		self.callbacks[prefix] = Route('callback:' + prefix, handler, modes, denied)
+
+	def kind(self, kind: str, handler, modes: tuple = None, denied=None):
+		self.kinds[kind] = Route(kind, handler, modes, denied)
+
+	def use(self, middleware):
+		"""adds middleware, the first added one runs first. chain is built once here, not for every request"""
+		self.middleware.append(middleware)
+		chain = self.call_handler
+		for fun in reversed(self.middleware):
+			chain = (lambda fun, rest: lambda request: fun(request, rest))(fun, chain)
+		self.chain = chain
+
+	def request(self, update: dict):
+		"""returns Request of telegram update. raises KeyError if update has no chat"""
+		if 'callback_query' in update:
+			query = update['callback_query']
+			chat_id = query['message']['chat']['id']
+			prefix, _, args = query['data'].partition(':')
+			if prefix in self.callbacks:
+				return Request(update, chat_id, 'callback', prefix, query['data'], args, query['message']['message_id'])
+			# data of unknown buttons is taken as text
+			return self.text_request(update, chat_id, query['data'], query['message']['message_id'])
+
+		message = update['message']
+		chat_id = message['chat']['id']
+		if 'document' in message:
+			return Request(update, chat_id, 'document', 'document')
+		if 'text' not in message:
+			return Request(update, chat_id, 'other', 'other')
+		return self.text_request(update, chat_id, message['text'])
+
+	def text_request(self, update: dict, chat_id: int, text: str, message_id: int = None):
+		if text.startswith('/'):
+			command, _, args = text.partition(' ')
+			return Request(update, chat_id, 'command', command, text, args.strip(), message_id)
+		return Request(update, chat_id, 'text', None, text, '', message_id)
+
+	def find(self, request: Request):
+		"""returns Route of request. text is routed by chat mode, so it is looked up when mode is known"""
+		if request.kind == 'command':
+			return self.commands.get(request.key) or self.kinds.get('unknown_command')
+		if request.kind == 'callback':
+			return self.callbacks[request.key]
+		if request.kind == 'text':
+			return self.modes.get(request.mode or 'normal')
+		return self.kinds.get(request.kind)
+
+	@base_method
+	def dispatch(self, request: Request):
+		"""runs request through middleware and its handler"""
+		if request.kind != 'text':
+			request.route = self.find(request)
+		return self.chain(request)
+
+	def call_handler(self, request: Request):
+		if request.route is None:
+			request.route = self.find(request)
+		route = request.route
+		if route is None:
+			return None
+		if route.modes is not None and (request.mode or 'normal') not in route.modes:
+			return route.denied(request) if route.denied is not None else None
+		return route.handler(request)
+
+
+def route_name(request: Request):
+	if request.route is not None:
+		return request.route.name
+	# text is routed by mode when handler is called
+	return 'text:' + (request.mode or 'normal') if request.kind == 'text' else request.kind
+
+
+def context_middleware(db_handler, checkpoint):
+	"""runs request in chat context committed together with update id. checkpoint returns id saved for update"""
+	def middleware(request: Request, call_next):
+		with log_context(chat_id=request.chat_id, update_id=request.update_id):
+			with db_handler.chat_context(request.chat_id, request.update_id, checkpoint(request.update)):
+				return call_next(request)
+	return middleware
+
+
+def mode_middleware(db_handler):
+	"""loads chat mode once for handler and mode gating"""
+	def middleware(request: Request, call_next):
+		request.mode, request.awaits_for = db_handler.get_chat_mode(request.chat_id)
+		return call_next(request)
+	return middleware
+
+
+def log_middleware(last_id):
+	"""logs one sampled record per update. last_id returns polling offset"""
+	def middleware(request: Request, call_next):
+		label = {'document': 'Document', 'other': 'Not text'}.get(request.kind, request.text)
+		update_logger.info('last_id: {:>8} text: {:>15}'.format(last_id(), label), extra={'handler': route_name(request)})
+		return call_next(request)
+	return middleware
+
+
+def timing_middleware(request: Request, call_next):
+	"""measures every handler separately"""
+	if not metrics.ENABLED:
+		return call_next(request)
+	started = time.perf_counter()
+	error = True
+	try:
+		result = call_next(request)
+		error = False
+		return result
+	finally:
+		metrics.registry.function('route:' + route_name(request)).observe(time.perf_counter() - started, error=error)
+
+
+def chatter(outbox, phrases: list, priority: int):
+	"""returns handler answering with random phrase"""
+	def handler(request: Request):
+		outbox.post('sendMessage', data={'chat_id': request.chat_id, 'text': choice(phrases)}, priority=priority)
+	return handler
@@ -0,0 +1,151 @@
+import os
+import time
+import heapq
+import threading
+from logging import Logger
+from datetime import datetime, timedelta
+
+from .extra.exceptions import base_method
+
+
+class ReminderScheduler:
+	"""Keeps reminders due in the nearest time window in a heap ordered by due time.
+	Heap is refilled from database every reconcile_interval seconds and updated
+	when reminders are set or deleted, so database is not polled for due reminders"""
+
+	def __init__(self, db_handler, logger: Logger):
+		self.logger = logger
+		self.DBHandler = db_handler
+		# reminders due in next WINDOW seconds are kept in memory
+		self.WINDOW = int(os.getenv('REMEMBERANCER_SCHEDULER_WINDOW', 600))
+		self.RECONCILE_INTERVAL = int(os.getenv('REMEMBERANCER_SCHEDULER_RECONCILE_INTERVAL', 60))
+		# delay before sending reminder again if sending failed
+		self.RETRY_DELAY = 5
+		# heap of (due date, sequence number, reminder id)
+		self._heap = []
+		# reminder id -> (due date, sequence number, reminder)
+		self._entries = {}
+		# ids of reminders returned by pop_due and not yet finished
+		self._in_flight = set()
+		self._seq = 0
+		self._lock = threading.RLock()
+		self.window_end = None
+		self.next_reconcile = 0
+
+	@base_method
+	def reconcile(self, reset: bool = False):
+		"""reloads reminders due before the end of window from database.
+		reset forgets reminders in flight, so they are loaded again"""
+		if reset:
+			with self._lock:
+				self._in_flight.clear()
+		window_end = datetime.utcnow() + timedelta(seconds=self.WINDOW)
+		reminders = self.DBHandler.get_reminders_due_before(window_end)
+		self.next_reconcile = time.monotonic() + self.RECONCILE_INTERVAL
+		if reminders is None:
+			return
+
+		with self._lock:
+			self._heap = []
+			self._entries = {}
+			for reminder in reminders:
+				if reminder['id'] not in self._in_flight:
+					# failed delivery is tried again at its next attempt
+					self._push(reminder, reminder.get('next_attempt_at') or reminder['reminder_date'])
+			self.window_end = window_end
+
+	def maybe_reconcile(self):
+		"""reconciles with database if reconcile interval has passed"""
+		if time.monotonic() >= self.next_reconcile:
+			self.reconcile()
+
+	def seconds_until_reconcile(self):
+		return max(0.0, self.next_reconcile - time.monotonic())
+
+	def add(self, reminder: dict):
+		"""schedules new reminder if it is due in current window"""
+		with self._lock:
+			if self.window_end is not None and reminder['reminder_date'] < self.window_end:
+				self._push(reminder, reminder['reminder_date'])
+
+	def remove(self, reminder_id: int):
+		"""unschedules reminder. heap entry is dropped lazily"""
+		with self._lock:
+			self._entries.pop(reminder_id, None)
+
+	def next_due(self):
+		"""returns due date of the nearest reminder or None if nothing is scheduled"""
+		with self._lock:
+			self._drop_stale()
+			if not self._heap:
+				return None
+			return self._heap[0][0]
+
+	def seconds_until_next(self):
+		"""returns seconds until the nearest reminder is due or None if nothing is scheduled"""
+		next_due = self.next_due()
+		if next_due is None:
+			return None
+		return (next_due - datetime.utcnow()).total_seconds()
+
+	def pop_due(self, now: datetime = None):
+		"""removes and returns reminders which are due.
+		returned reminders are in flight until finish or retry is called"""
+		if now is None:
+			now = datetime.utcnow()
+
+		due = []
+		with self._lock:
+			while True:
+				self._drop_stale()
+				if not self._heap or self._heap[0][0] > now:
+					break
+				_, _, reminder_id = heapq.heappop(self._heap)
+				_, _, reminder = self._entries.pop(reminder_id)
+				self._in_flight.add(reminder_id)
+				due.append(reminder)
+		return due
+
+	def finish(self, reminder_id: int):
+		"""marks in flight reminder as done"""
+		with self._lock:
+			self._in_flight.discard(reminder_id)
+
+	def retry(self, reminder: dict, delay: float = None):
+		"""schedules in flight reminder again after delay seconds"""
+		if delay is None:
+			delay = self.RETRY_DELAY
+		with self._lock:
+			self._in_flight.discard(reminder['id'])
+			self._push(reminder, datetime.utcnow() + timedelta(seconds=delay))
+
+	def on_reminder_set(self, reminder: dict):
+		self.add(reminder)
+
+	def on_reminder_deleted(self, reminder: dict):
+		self.remove(reminder['id'])
+
+	def due_count(self, now: datetime = None):
+		"""returns number of reminders which are due but not delivered yet"""
+		if now is None:
+			now = datetime.utcnow()
+		with self._lock:
+			return len(self._in_flight) + sum(1 for due, _, _ in self._entries.values() if due <= now)
+
+	def __len__(self):
+		return len(self._entries)
+
+	def _push(self, reminder: dict, due: datetime):
+		self._seq += 1
+		entry = (due, self._seq, reminder['id'])
+		self._entries[reminder['id']] = (due, self._seq, reminder)
+		heapq.heappush(self._heap, entry)
+
+	def _drop_stale(self):
+		# pops heap entries of removed or rescheduled reminders
+		while self._heap:
+			due, seq, reminder_id = self._heap[0]
+			entry = self._entries.get(reminder_id)
+			if entry is not None and entry[1] == seq:
+				return
+			heapq.heappop(self._heap)
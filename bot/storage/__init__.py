@@ -0,0 +1,28 @@
+import os
+from logging import Logger
+
+from .base import Storage, ChatContext
+
+__all__ = ['Storage', 'ChatContext', 'STORAGE', 'SQLITE_PATH', 'BACKENDS', 'create_storage']
+
+
+# backend bot keeps its data in: postgres, sqlite or memory
+STORAGE = os.getenv('REMEMBERANCER_STORAGE', 'postgres')
+SQLITE_PATH = os.getenv('REMEMBERANCER_SQLITE_PATH', 'rememberancer.db')
+BACKENDS = ('postgres', 'sqlite', 'memory')
+
+
+def create_storage(logger: Logger, kind: str = None):
+	"""returns storage backend of kind, STORAGE by default.
+	backends are imported on demand, so psycopg2 is needed only for postgres"""
+	kind = kind or STORAGE
+	if kind == 'postgres':
+		from .postgres import PostgresStorage
+		return PostgresStorage(logger)
+	if kind == 'sqlite':
+		from .sqlite import SqliteStorage
+		return SqliteStorage(logger, SQLITE_PATH)
+	if kind == 'memory':
+		from .memory import MemoryStorage
+		return MemoryStorage(logger)
+	raise ValueError('unknown storage {}, expected one of {}'.format(kind, ', '.join(BACKENDS)))
@@ -0,0 +1,247 @@
+import io
+import csv
+import threading
+from logging import Logger
+from datetime import datetime, timedelta
+
+from ..extra.exceptions import base_method
+
+
+class ChatContext:
+	"""Chat and temp_datetime rows of one chat loaded once per update and changed in memory.
+	Changes are written when update is processed"""
+
+	def __init__(self, chat_id: int, con=None):
+		self.chat_id = chat_id
+		# connection all queries made while processing update run on, if backend has connections
+		self.con = con
+		# dict with chat_mode, awaits_for and timezone or None if chat is unknown
+		self.chat = None
+		self.temp_date = None
+		self.temp_time = None
+		self.chat_changed = False
+		self.temp_changed = False
+		# functions called after changes are committed
+		self.after_commit = []
+		# update processed in context and last update id saved with its effects, None outside of update
+		self.update_id = None
+		self.checkpoint = None
+
+	def change_chat(self, **values):
+		if self.chat is None:
+			self.chat = {'chat_mode': 'normal', 'awaits_for': '', 'timezone': None}
+		self.chat.update(values)
+		self.chat_changed = True
+
+
+class Storage:
+	"""Interface of storage backends keeping chats, their temporary date and time, reminders and bot state.
+	Reminders are dicts with reminder_keys, datetimes are naive utc.
+	Methods report unavailable storage by returning None or False like described in their docstrings"""
+
+	def __init__(self, logger: Logger):
+		# all code uses one logger
+		self.logger = logger
+		# objects notified when reminders are set or deleted
+		self.listeners = []
+		self.mode_list = ['normal', 'reminder', 'timezone', 'delete', 'import']
+		self.awaits_for_list = ['date', 'time', 'text']
+		self.reminder_keys = ['id', 'chat_id', 'reminder_date', 'reminder_text', 'recurrence', 'attempts', 'next_attempt_at']
+		# LRUCache of chat rows if backend caches them
+		self.chat_cache = None
+		# True if several bot instances can share storage and run as cluster
+		self.SHARED = False
+		# ChatContext of update processed by current thread
+		self._local = threading.local()
+
+	def context(self, chat_id: int = None):
+		"""returns chat context active in current thread, only if it belongs to chat_id when chat_id is given"""
+		context = getattr(self._local, 'context', None)
+		if context is None or (chat_id is not None and context.chat_id != chat_id):
+			return None
+		return context
+
+	def chat_context(self, chat_id: int, update_id: int = None, checkpoint: int = None):
+		"""context manager processing update of chat in one transaction. update is marked as processed
+		and checkpoint is saved as last processed update id together with effects of update"""
+		raise NotImplementedError
+
+	def add_listener(self, listener):
+		"""listener must have on_reminder_set and on_reminder_deleted methods taking reminder dict"""
+		self.listeners.append(listener)
+
+	def notify(self, event: str, reminder: dict):
+		"""calls event method of listeners, after commit if chat context is active"""
+		def call():
+			for listener in self.listeners:
+				getattr(listener, event)(reminder)
+
+		context = self.context()
+		if context is not None:
+			context.after_commit.append(call)
+		else:
+			call()
+
+	def check_chat_mode(self, mode: str, awaits_for: str = None):
+		"""raises ValueError if chat can't be in mode awaiting for awaits_for"""
+		if mode not in self.mode_list:
+			raise ValueError
+		if mode == 'reminder':
+			if awaits_for not in self.awaits_for_list:
+				raise ValueError
+		elif awaits_for is not None:
+			raise ValueError
+
+	# reminders
+
+	def set_reminder(self, chat_id: int, dt: datetime, reminder_text: str, recurrence: str = None):
+		"""adds reminder, recurrence is rule of recurring reminder. returns False if it is not added.
+		reminders are kept to the minute, seconds of dt are dropped and chat has one reminder per minute"""
+		raise NotImplementedError
+
+	def get_chat_reminder_by_dt(self, chat_id: int, dt: datetime):
+		"""returns reminder of chat at dt or None"""
+		raise NotImplementedError
+
+	def get_reminders_due_before(self, dt: datetime):
+		"""returns reminders which delivery is due before dt ordered by reminder_date or None if storage is unavailable.
+		reminders being delivered are skipped until their lease expires"""
+		raise NotImplementedError
+
+	def delete_reminder(self, reminder: dict):
+		raise NotImplementedError
+
+	def delete_chat_reminder(self, chat_id: int, reminder_id: int):
+		"""returns deleted reminder or None if chat has no such reminder"""
+		raise NotImplementedError
+
+	def delete_reminders(self, reminder_ids: list):
+		"""returns deleted reminders or None if storage is unavailable"""
+		raise NotImplementedError
+
+	def complete_reminders(self, deleted_ids: list, advanced: dict):
+		"""deletes delivered one-shot reminders and moves recurring ones to their next occurrence.
+		returns (deleted reminders, moved reminders, ids of not moved reminders) or None if storage is unavailable"""
+		raise NotImplementedError
+
+	def start_delivery(self, reminder_ids: list, lease: float):
+		"""marks reminders as being delivered, they are not due again for lease seconds"""
+		raise NotImplementedError
+
+	def delivery_failed(self, failures: list):
+		"""saves tuples (reminder id, next attempt time or None, status, error). returns False if storage is unavailable"""
+		raise NotImplementedError
+
+	def import_reminders(self, chat_id: int, rows: list):
+		"""adds reminders from rows (line, utc datetime, text). returns lines which were not added or None"""
+		raise NotImplementedError
+
+	def export_reminders(self, chat_id: int, tz: int, f):
+		"""writes csv with header date,text of chat reminders in chat timezone to binary file f.
+		returns False if storage is unavailable"""
+		raise NotImplementedError
+
+	def get_reminders_page(self, chat_id: int, limit: int, after: tuple = None, before: tuple = None):
+		"""returns (page of chat reminders ordered by (reminder_date, id), whether there are more in page direction)"""
+		raise NotImplementedError
+
+	def get_user_reminders(self, chat_id: int):
+		raise NotImplementedError
+
+	# chats
+
+	def set_chat_mode(self, chat_id: int, mode: str, awaits_for: str = None):
+		raise NotImplementedError
+
+	def get_chat(self, chat_id: int, quiet: bool = False):
+		"""returns dict with chat_mode, awaits_for and timezone of chat or None if chat is unknown.
+		quiet lookup doesn't tell chat that storage is unavailable, it is used when chat did nothing"""
+		raise NotImplementedError
+
+	@base_method
+	def get_chat_mode(self, chat_id):
+		"""returns chat_mode and awaits_for of chat"""
+		chat = self.get_chat(chat_id)
+		if chat is None:
+			return None, None
+		return chat['chat_mode'], chat['awaits_for']
+
+	def save_temp_date(self, chat_id: int, date: str):
+		raise NotImplementedError
+
+	def save_temp_time(self, chat_id: int, time: str):
+		raise NotImplementedError
+
+	def get_temp_date(self, chat_id: int):
+		raise NotImplementedError
+
+	def get_temp_time(self, chat_id: int):
+		raise NotImplementedError
+
+	def set_timezone(self, chat_id: int, tz: int):
+		raise NotImplementedError
+
+	@base_method
+	def get_timezone(self, chat_id: int, quiet: bool = False):
+		"""returns timezone of chat.
+		tz is difference between utc time and local user time in hours"""
+		chat = self.get_chat(chat_id, quiet)
+		if chat is None:
+			return None
+		return chat['timezone']
+
+	def delete_chats(self, first_chat_id: int):
+		"""deletes chats with id from first_chat_id on with their reminders, used by benchmarks to clean up.
+		listeners are not notified"""
+		raise NotImplementedError
+
+	def close(self):
+		"""closes connections of storage when bot stops"""
+		pass
+
+	# bot state
+
+	def get_state(self, key: str):
+		"""returns value saved in bot state or None"""
+		raise NotImplementedError
+
+	def set_last_update_id(self, update_id: int):
+		"""saves id of the last processed update. saved id never moves back"""
+		raise NotImplementedError
+
+	# cluster, implemented by SHARED storages
+
+	def heartbeat(self, instance_id: str, timeout: float):
+		raise NotImplementedError
+
+	def get_update_owners(self, chat_ids: list):
+		raise NotImplementedError
+
+	def queue_updates(self, updates: list, owners: list):
+		raise NotImplementedError
+
+	def get_assigned_updates(self, instance_id: str, limit: int, exclude: list = ()):
+		raise NotImplementedError
+
+	def delete_pending_updates(self, update_ids: list):
+		raise NotImplementedError
+
+	def reassign_updates(self, instance_ids: list):
+		raise NotImplementedError
+
+	def claim_reminders(self, reminder_ids: list, instance_id: str, lease: float):
+		raise NotImplementedError
+
+
+def write_export(f, rows, tz: int):
+	"""writes (utc datetime, text) rows to binary file f as csv in format of postgres export.
+	rows are written one at a time, f stays open"""
+	text = io.TextIOWrapper(f, encoding='utf-8', newline='', write_through=True)
+	try:
+		writer = csv.writer(text, lineterminator='\n')
+		writer.writerow(['date', 'text'])
+		for dt, reminder_text in rows:
+			writer.writerow([(dt + timedelta(hours=tz)).strftime('%d/%m/%Y %H:%M'), reminder_text])
+	finally:
+		# wrapper closes f when it is collected unless it is detached
+		text.detach()
@@ -0,0 +1,328 @@
+import threading
+from logging import Logger
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+
+from ..extra.exceptions import base_method
+from ..api_functions import post
+from .base import Storage, ChatContext, write_export
+
+
+class MemoryStorage(Storage):
+	"""Storage keeping everything in dicts of bot process, data is lost when bot stops.
+	One lock serializes all changes, chat context holds it until update is processed"""
+
+	def __init__(self, logger: Logger):
+		super().__init__(logger)
+		self._lock = threading.RLock()
+		# chat_id -> dict with chat_mode, awaits_for and timezone
+		self.chats = {}
+		# chat_id -> [date, time] saved while reminder is set step by step
+		self.temp = {}
+		# reminder id -> row with reminder_keys, status, last_error and claimed_until
+		self.reminders = {}
+		# (chat_id, reminder_date) -> reminder id, chat has one reminder at a time
+		self.by_date = {}
+		self.state = {}
+		self._next_id = 1
+
+	@contextmanager
+	def chat_context(self, chat_id: int, update_id: int = None, checkpoint: int = None):
+		"""holds storage lock until block ends, so other threads see update applied at once.
+		checkpoint is saved as last processed update id, reminder events are sent after lock is released.
+		memory storage has no rollback, changes made before block raised are kept"""
+		if self.context() is not None:
+			yield self.context()
+			return
+
+		context = ChatContext(chat_id)
+		context.update_id = update_id
+		context.checkpoint = checkpoint if checkpoint is not None else update_id
+		try:
+			with self._lock:
+				self._local.context = context
+				try:
+					yield context
+				finally:
+					self._local.context = None
+					if context.checkpoint is not None:
+						self._save_last_update_id(context.checkpoint)
+		finally:
+			for fun in context.after_commit:
+				fun()
+
+	def reminder(self, row: dict):
+		"""returns reminder dict of row"""
+		return {key: row[key] for key in self.reminder_keys}
+
+	def _insert(self, chat_id: int, dt: datetime, reminder_text: str, recurrence: str = None):
+		"""adds reminder row and returns it, returns None if chat has reminder at dt"""
+		if (chat_id, dt) in self.by_date:
+			return None
+		row = {
+			'id': self._next_id, 'chat_id': chat_id, 'reminder_date': dt, 'reminder_text': reminder_text, 'recurrence': recurrence,
+			'attempts': 0, 'next_attempt_at': None, 'status': 'pending', 'last_error': None, 'claimed_until': None
+		}
+		self._next_id += 1
+		self.reminders[row['id']] = row
+		self.by_date[(chat_id, dt)] = row['id']
+		return row
+
+	def _delete(self, reminder_id: int):
+		"""removes reminder row and returns it, returns None if there is no such reminder"""
+		row = self.reminders.pop(reminder_id, None)
+		if row is not None:
+			del self.by_date[(row['chat_id'], row['reminder_date'])]
+		return row
+
+	@base_method
+	def set_reminder(self, chat_id: int, dt: datetime, reminder_text: str, recurrence: str = None):
+		"""adds reminder. recurrence is rule of recurring reminder"""
+		if reminder_text == '-':
+			reminder_text = ''
+
+		with self._lock:
+			row = self._insert(chat_id, dt.replace(second=0, microsecond=0), reminder_text, recurrence)
+			reminder = self.reminder(row) if row is not None else None
+
+		if reminder is None:
+			post('sendMessage', data={'chat_id': chat_id, 'text': 'Error. You already have reminder with the same time'})
+			return False
+
+		self.notify('on_reminder_set', reminder)
+		return True
+
+	@base_method
+	def get_chat_reminder_by_dt(self, chat_id: int, dt: datetime):
+		"""returns reminder of chat at dt"""
+		with self._lock:
+			reminder_id = self.by_date.get((chat_id, dt.replace(second=0, microsecond=0)))
+			if reminder_id is None:
+				return None
+			return self.reminder(self.reminders[reminder_id])
+
+	@base_method
+	def get_reminders_due_before(self, dt: datetime):
+		"""returns list of dicts for every reminder due before dt(in utc), including overdue ones.
+		reminders being sent are skipped until their lease expires"""
+		now = datetime.utcnow()
+		with self._lock:
+			rows = [
+				row for row in self.reminders.values()
+				if row['reminder_date'] < dt and row['status'] != 'failed' and (row['next_attempt_at'] is None or row['next_attempt_at'] < dt)
+				and (row['status'] != 'in_flight' or row['claimed_until'] is None or row['claimed_until'] < now)
+			]
+			rows.sort(key=lambda row: (row['reminder_date'], row['id']))
+			return list(map(self.reminder, rows))
+
+	@base_method
+	def delete_reminder(self, reminder: dict):
+		"""deletes reminder"""
+		with self._lock:
+			self._delete(reminder['id'])
+
+		self.notify('on_reminder_deleted', reminder)
+
+	@base_method
+	def delete_chat_reminder(self, chat_id: int, reminder_id: int):
+		"""deletes reminder of chat by id. returns deleted reminder or None if chat has no such reminder"""
+		with self._lock:
+			row = self.reminders.get(reminder_id)
+			if row is None or row['chat_id'] != chat_id:
+				return None
+			reminder = self.reminder(self._delete(reminder_id))
+
+		self.notify('on_reminder_deleted', reminder)
+		return reminder
+
+	@base_method
+	def delete_reminders(self, reminder_ids: list):
+		"""deletes reminders by id. returns list of deleted reminders"""
+		with self._lock:
+			rows = [self._delete(reminder_id) for reminder_id in reminder_ids]
+			reminders = [self.reminder(row) for row in rows if row is not None]
+
+		for reminder in reminders:
+			self.notify('on_reminder_deleted', reminder)
+
+		return reminders
+
+	@base_method
+	def complete_reminders(self, deleted_ids: list, advanced: dict):
+		"""deletes delivered one-shot reminders and moves recurring ones to their next occurrence.
+		advanced maps reminder id to next due date, reminders which next date is taken by other reminder of chat are not moved.
+		returns (deleted reminders, moved reminders, ids of not moved reminders)"""
+		with self._lock:
+			rows = [self._delete(reminder_id) for reminder_id in deleted_ids]
+			deleted = [self.reminder(row) for row in rows if row is not None]
+
+			moved = []
+			conflicting = []
+			for reminder_id, dt in advanced.items():
+				row = self.reminders.get(reminder_id)
+				if row is None:
+					# deleted meanwhile, neither moved nor conflicting
+					continue
+				if (row['chat_id'], dt) in self.by_date:
+					conflicting.append(reminder_id)
+					continue
+				del self.by_date[(row['chat_id'], row['reminder_date'])]
+				row.update(reminder_date=dt, status='pending', attempts=0, next_attempt_at=None, last_error=None, claimed_until=None)
+				self.by_date[(row['chat_id'], dt)] = reminder_id
+				moved.append(self.reminder(row))
+
+		for reminder in deleted:
+			self.notify('on_reminder_deleted', reminder)
+		for reminder in moved:
+			self.notify('on_reminder_set', reminder)
+
+		return deleted, moved, conflicting
+
+	@base_method
+	def start_delivery(self, reminder_ids: list, lease: float):
+		"""marks reminders as being delivered for lease seconds"""
+		claimed_until = datetime.utcnow() + timedelta(seconds=lease)
+		with self._lock:
+			for reminder_id in reminder_ids:
+				row = self.reminders.get(reminder_id)
+				if row is not None:
+					row.update(status='in_flight', claimed_until=claimed_until)
+
+	@base_method
+	def delivery_failed(self, failures: list):
+		"""saves failed deliveries. failures are tuples (reminder id, next attempt time or None, status, error)"""
+		with self._lock:
+			for reminder_id, next_attempt_at, status, error in failures:
+				row = self.reminders.get(reminder_id)
+				if row is not None:
+					row.update(attempts=row['attempts'] + 1, status=status, next_attempt_at=next_attempt_at, last_error=error, claimed_until=None)
+
+		return True
+
+	@base_method
+	def import_reminders(self, chat_id: int, rows: list):
+		"""adds batch of (line, utc datetime, text) rows.
+		rows conflicting with existing reminders or earlier rows of batch are skipped. returns lines of skipped rows"""
+		skipped = []
+		reminders = []
+		with self._lock:
+			for line, dt, text in sorted(rows, key=lambda row: row[0]):
+				row = self._insert(chat_id, dt.replace(microsecond=0), text)
+				if row is None:
+					skipped.append(line)
+				else:
+					reminders.append(self.reminder(row))
+
+		for reminder in reminders:
+			self.notify('on_reminder_set', reminder)
+		return skipped
+
+	@base_method
+	def export_reminders(self, chat_id: int, tz: int, f):
+		"""writes csv with reminders of chat in chat timezone to binary file f"""
+		with self._lock:
+			rows = sorted((row['reminder_date'], row['reminder_text']) for row in self.reminders.values() if row['chat_id'] == chat_id)
+
+		write_export(f, rows, tz)
+		return True
+
+	@base_method
+	def get_reminders_page(self, chat_id: int, limit: int, after: tuple = None, before: tuple = None):
+		"""returns page of chat reminders ordered by (reminder_date, id) and whether there are more reminders in page direction.
+		page starts after key after or ends before key before, keys are (reminder_date, id)"""
+		with self._lock:
+			rows = sorted(
+				(row for row in self.reminders.values() if row['chat_id'] == chat_id),
+				key=lambda row: (row['reminder_date'], row['id'])
+			)
+			if before is not None:
+				rows = [row for row in rows if (row['reminder_date'], row['id']) < tuple(before)]
+				more = len(rows) > limit
+				rows = rows[max(len(rows) - limit, 0):]
+			else:
+				if after is not None:
+					rows = [row for row in rows if (row['reminder_date'], row['id']) > tuple(after)]
+				more = len(rows) > limit
+				rows = rows[:limit]
+			return list(map(self.reminder, rows)), more
+
+	@base_method
+	def get_user_reminders(self, chat_id: int):
+		"""returns chat reminders"""
+		with self._lock:
+			return [self.reminder(row) for row in self.reminders.values() if row['chat_id'] == chat_id]
+
+	@base_method
+	def set_chat_mode(self, chat_id: int, mode: str, awaits_for: str = None):
+		"""changes chat mode"""
+		self.check_chat_mode(mode, awaits_for)
+
+		if awaits_for is None:
+			awaits_for = ''
+
+		with self._lock:
+			chat = self.chats.setdefault(chat_id, {'chat_mode': mode, 'awaits_for': awaits_for, 'timezone': None})
+			chat.update(chat_mode=mode, awaits_for=awaits_for)
+
+	@base_method
+	def get_chat(self, chat_id: int, quiet: bool = False):
+		"""returns dict with chat_mode, awaits_for and timezone of chat or None if chat is unknown"""
+		with self._lock:
+			chat = self.chats.get(chat_id)
+			return dict(chat) if chat is not None else None
+
+	@base_method
+	def save_temp_date(self, chat_id: int, date: str):
+		"""saves date of reminder being set"""
+		with self._lock:
+			self.temp.setdefault(chat_id, [None, None])[0] = date
+
+	@base_method
+	def save_temp_time(self, chat_id: int, time: str):
+		"""saves time of reminder being set"""
+		with self._lock:
+			self.temp.setdefault(chat_id, [None, None])[1] = time
+
+	@base_method
+	def get_temp_date(self, chat_id: int):
+		"""returns saved date"""
+		with self._lock:
+			return self.temp.get(chat_id, [None, None])[0]
+
+	@base_method
+	def get_temp_time(self, chat_id: int):
+		"""returns saved time"""
+		with self._lock:
+			return self.temp.get(chat_id, [None, None])[1]
+
+	@base_method
+	def set_timezone(self, chat_id: int, tz: int):
+		"""sets chat timezone"""
+		with self._lock:
+			chat = self.chats.setdefault(chat_id, {'chat_mode': 'normal', 'awaits_for': None, 'timezone': tz})
+			chat['timezone'] = tz
+
+	@base_method
+	def delete_chats(self, first_chat_id: int):
+		"""deletes chats with id from first_chat_id on with their reminders and temp dates"""
+		with self._lock:
+			for reminder_id in [row['id'] for row in self.reminders.values() if row['chat_id'] >= first_chat_id]:
+				self._delete(reminder_id)
+			for rows in (self.chats, self.temp):
+				for chat_id in [chat_id for chat_id in rows if chat_id >= first_chat_id]:
+					del rows[chat_id]
+
+	@base_method
+	def get_state(self, key: str):
+		"""returns value saved in bot state or None"""
+		with self._lock:
+			return self.state.get(key)
+
+	@base_method
+	def set_last_update_id(self, update_id: int):
+		"""saves id of the last processed update. saved id never moves back"""
+		with self._lock:
+			self._save_last_update_id(update_id)
+
+	def _save_last_update_id(self, update_id: int):
+		self.state['last_update_id'] = max(self.state.get('last_update_id', update_id), update_id)
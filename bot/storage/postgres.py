@@ -0,0 +1,664 @@
+import io
+import os
+import csv
+import json
+import threading
+import psycopg2
+from logging import Logger
+from datetime import datetime
+from contextlib import contextmanager
+
+from ..extra.exceptions import TokenError, PoolTimeoutError, base_method
+from ..extra.cache import LRUCache
+from .. import queries
+from ..api_functions import post
+from ..db_pool import ConnectionPool
+from .base import Storage, ChatContext
+
+
+@base_method
+def connect_to_db(dbname: str = 'rememberancer', user: str = 'postgres', password: str = 'postgres', host: str = 'localhost'):
+	"""opens new connection to database. raises psycopg2.OperationalError if fails"""
+	return psycopg2.connect(dbname=dbname, user=user, password=password, host=host, options='-c TimeZone=UTC', connection_factory=queries.PreparedConnection)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(logger: Logger):
+	"""returns connection pool shared by all PostgresStorage instances. creates it on first call"""
+	global _pool
+	with _pool_lock:
+		if _pool is None:
+			_pool = ConnectionPool(
+				connect_to_db,
+				logger,
+				minconn=int(os.getenv('REMEMBERANCER_DB_POOL_MIN', 1)),
+				maxconn=int(os.getenv('REMEMBERANCER_DB_POOL_MAX', 10)),
+				timeout=float(os.getenv('REMEMBERANCER_DB_POOL_TIMEOUT', 5)),
+				check_interval=float(os.getenv('REMEMBERANCER_DB_POOL_CHECK_INTERVAL', 30))
+			)
+		return _pool
+
+
+# chat rows cached by chat_id, shared by all PostgresStorage instances
+chat_cache = LRUCache(
+	maxsize=int(os.getenv('REMEMBERANCER_CHAT_CACHE_SIZE', 10000)),
+	ttl=float(os.getenv('REMEMBERANCER_CHAT_CACHE_TTL', 300))
+)
+# marks cache miss because None is cached for unknown chats
+_MISSING = object()
+
+
+class PostgresStorage(Storage):
+	"""Storage in PostgreSQL database"""
+
+	def __init__(self, logger: Logger, pool: ConnectionPool = None):
+		super().__init__(logger)
+		self.TOKEN = os.getenv('REMEMBERANCER_BOT_TOKEN')
+		if self.TOKEN is None:
+			raise TokenError
+		# all handlers share one pool unless other is given
+		self.pool = pool if pool is not None else get_pool(logger)
+		self.chat_cache = chat_cache
+		self.SHARED = True
+
+	def close(self):
+		"""closes pooled connections, connections in use are closed when they are returned"""
+		self.pool.closeall()
+
+	@contextmanager
+	def chat_context(self, chat_id: int, update_id: int = None, checkpoint: int = None):
+		"""loads chat and temp_datetime rows of chat with one query.
+		until block ends chat methods read and change them in memory and all other queries
+		run in the same transaction, which is committed together with changed rows when block ends.
+		update is marked as processed in the same transaction, checkpoint is saved as last processed update id.
+		if block raises, transaction is rolled back and only update is marked as processed"""
+		if self.context() is not None:
+			yield self.context()
+			return
+
+		try:
+			con = self.pool.getconn()
+		except (psycopg2.OperationalError, PoolTimeoutError) as e:
+			# methods fall back to their own connections and report failure to chat
+			self.logger.error("can't get database connection: {}".format(e))
+			yield None
+			return
+
+		try:
+			context = ChatContext(chat_id, con)
+			context.update_id = update_id
+			context.checkpoint = checkpoint if checkpoint is not None else update_id
+			with con.cursor() as cur:
+				queries.execute(cur, 'load_chat_context', (chat_id,))
+				chat_mode, awaits_for, timezone, context.temp_date, context.temp_time = cur.fetchone()
+			if chat_mode is not None:
+				context.chat = {'chat_mode': chat_mode, 'awaits_for': awaits_for, 'timezone': timezone}
+
+			self._local.context = context
+			try:
+				yield context
+			except BaseException:
+				self._local.context = None
+				self.discard(context)
+				raise
+			self._local.context = None
+			self.flush(context)
+		finally:
+			self.pool.putconn(con)
+
+	def flush(self, context: ChatContext):
+		"""writes changed rows of chat context and commits its transaction"""
+		with context.con.cursor() as cur:
+			if context.chat_changed:
+				chat = context.chat
+				queries.execute(cur, 'flush_chat', (context.chat_id, chat['chat_mode'], chat['awaits_for'], chat['timezone']))
+			if context.temp_changed:
+				queries.execute(cur, 'flush_temp_datetime', (context.chat_id, context.temp_date, context.temp_time))
+			if context.update_id is not None:
+				queries.execute(cur, 'update_processed', (context.update_id, context.checkpoint))
+		context.con.commit()
+
+		if context.chat_changed:
+			self.chat_cache.set(context.chat_id, dict(context.chat))
+		for fun in context.after_commit:
+			fun()
+
+	def discard(self, context: ChatContext):
+		"""rolls back changes of failed update and marks update as processed in separate transaction,
+		so it is not processed again. errors are logged, error of update is the one raised"""
+		try:
+			context.con.rollback()
+			if context.update_id is not None:
+				with context.con.cursor() as cur:
+					queries.execute(cur, 'update_processed', (context.update_id, context.checkpoint))
+				context.con.commit()
+		except psycopg2.Error as e:
+			self.logger.error("can't discard update {}: {}".format(context.update_id, e))
+
+	@contextmanager
+	def cursor(self, chat_id: int = None):
+		"""yields cursor of pooled connection and commits when block ends.
+		inside chat context yields cursor of context connection, which is committed when context ends.
+		yields None if database is unavailable"""
+		context = self.context()
+		if context is not None:
+			with context.con.cursor() as cur:
+				yield cur
+			return
+
+		try:
+			con = self.pool.getconn()
+		except (psycopg2.OperationalError, PoolTimeoutError) as e:
+			self.logger.error("can't get database connection: {}".format(e))
+			if chat_id is not None:
+				post('sendMessage', data={'chat_id': chat_id, 'text': "Error with connection to database. It's bad. Trying again won't help. I'm useless piece of garbage. Try something else. Sorry for this"})
+			yield None
+			return
+
+		try:
+			with con.cursor() as cur:
+				yield cur
+			con.commit()
+		finally:
+			# broken connections are closed by pool and reopened on next checkout
+			self.pool.putconn(con)
+
+	@base_method
+	def set_reminder(self, chat_id: int, dt: datetime, reminder_text: str, recurrence: str = None):
+		"""adds reminder to database. recurrence is rule of recurring reminder"""
+		if reminder_text == '-':
+			reminder_text = ''
+
+		with self.cursor(chat_id) as cur:
+			if cur is None:
+				return False
+
+			# conflict does not raise, so transaction of chat context stays usable
+			queries.execute(cur, 'set_reminder', (chat_id, dt.replace(second=0, microsecond=0), reminder_text, recurrence))
+			result = cur.fetchall()
+
+		if result == []:
+			post('sendMessage', data={'chat_id': chat_id, 'text': 'Error. You already have reminder with the same time'})
+			return False
+
+		self.notify('on_reminder_set', dict(zip(self.reminder_keys, result[0])))
+		return True
+
+	@base_method
+	def get_chat_reminder_by_dt(self, chat_id: int, dt: datetime):
+		"""queries db using chat_id and datetime and returns reminder dict"""
+		with self.cursor() as cur:
+			if cur is None:
+				return None
+
+			queries.execute(cur, 'get_chat_reminder_by_dt', (chat_id, dt.replace(second=0, microsecond=0)))
+			result = cur.fetchall()
+
+		if result == []:
+			return None
+
+		return dict(zip(self.reminder_keys, result[0]))
+
+	@base_method
+	def get_reminders_due_before(self, dt: datetime):
+		"""returns list of dicts for every reminder due before dt(in utc), including overdue ones"""
+		with self.cursor() as cur:
+			if cur is None:
+				return None
+
+			queries.execute(cur, 'get_reminders_due_before', (dt,))
+			reminders = cur.fetchall()
+
+		return list(map(lambda rem: dict(zip(self.reminder_keys, rem)), reminders))
+
+	@base_method
+	def delete_reminder(self, reminder: dict):
+		"""deletes reminder"""
+		with self.cursor(reminder['chat_id']) as cur:
+			if cur is None:
+				return
+
+			queries.execute(cur, 'delete_reminder', (reminder['id'],))
+
+		self.notify('on_reminder_deleted', reminder)
+
+	@base_method
+	def delete_chat_reminder(self, chat_id: int, reminder_id: int):
+		"""deletes reminder of chat by id. returns deleted reminder or None if chat has no such reminder"""
+		with self.cursor(chat_id) as cur:
+			if cur is None:
+				return None
+
+			queries.execute(cur, 'delete_chat_reminder', (reminder_id, chat_id))
+			result = cur.fetchall()
+
+		if result == []:
+			return None
+
+		reminder = dict(zip(self.reminder_keys, result[0]))
+		self.notify('on_reminder_deleted', reminder)
+		return reminder
+
+	@base_method
+	def delete_reminders(self, reminder_ids: list):
+		"""deletes reminders by id in one transaction.
+		returns list of deleted reminders or None if database is unavailable"""
+		if not reminder_ids:
+			return []
+
+		with self.cursor() as cur:
+			if cur is None:
+				return None
+
+			queries.execute(cur, 'delete_reminders', (list(reminder_ids),))
+			reminders = list(map(lambda rem: dict(zip(self.reminder_keys, rem)), cur.fetchall()))
+
+		for reminder in reminders:
+			self.notify('on_reminder_deleted', reminder)
+
+		return reminders
+
+	@base_method
+	def complete_reminders(self, deleted_ids: list, advanced: dict):
+		"""deletes delivered one-shot reminders and moves recurring ones to their next occurrence in one transaction.
+		advanced maps reminder id to next due date, reminders which next date is taken by other reminder of chat are not moved.
+		returns (deleted reminders, moved reminders, ids of not moved reminders) or None if database is unavailable"""
+		if not deleted_ids and not advanced:
+			return [], [], []
+
+		with self.cursor() as cur:
+			if cur is None:
+				return None
+
+			deleted = []
+			if deleted_ids:
+				queries.execute(cur, 'delete_reminders', (list(deleted_ids),))
+				deleted = list(map(lambda rem: dict(zip(self.reminder_keys, rem)), cur.fetchall()))
+
+			moved = []
+			if advanced:
+				queries.execute(cur, 'advance_reminders', (list(advanced), list(advanced.values())))
+				moved = list(map(lambda rem: dict(zip(self.reminder_keys, rem)), cur.fetchall()))
+
+			conflicting = []
+			if len(moved) < len(advanced):
+				# reminders deleted meanwhile are neither moved nor conflicting
+				queries.execute(cur, 'existing_reminders', (list(set(advanced) - {reminder['id'] for reminder in moved}),))
+				conflicting = [row[0] for row in cur.fetchall()]
+
+		for reminder in deleted:
+			self.notify('on_reminder_deleted', reminder)
+		for reminder in moved:
+			self.notify('on_reminder_set', reminder)
+
+		return deleted, moved, conflicting
+
+	@base_method
+	def start_delivery(self, reminder_ids: list, lease: float):
+		"""marks reminders as being delivered for lease seconds"""
+		if not reminder_ids:
+			return
+
+		with self.cursor() as cur:
+			if cur is None:
+				return
+
+			queries.execute(cur, 'start_delivery', (list(reminder_ids), lease))
+
+	@base_method
+	def delivery_failed(self, failures: list):
+		"""saves failed deliveries. failures are tuples (reminder id, next attempt time or None, status, error).
+		returns False if database is unavailable"""
+		if not failures:
+			return True
+
+		with self.cursor() as cur:
+			if cur is None:
+				return False
+
+			ids, next_attempts, statuses, errors = (list(column) for column in zip(*failures))
+			queries.execute(cur, 'delivery_failed', (ids, next_attempts, statuses, errors))
+
+		return True
+
+	@base_method
+	def import_reminders(self, chat_id: int, rows: list):
+		"""inserts batch of (line, utc datetime, text) rows with COPY.
+		rows conflicting with existing reminders or earlier rows of batch are skipped.
+		returns lines of skipped rows or None if database is unavailable"""
+		if not rows:
+			return []
+
+		buffer = io.StringIO()
+		csv.writer(buffer).writerows((line, dt.strftime('%Y-%m-%d %H:%M:%S'), text) for line, dt, text in rows)
+		buffer.seek(0)
+
+		with self.cursor(chat_id) as cur:
+			if cur is None:
+				return None
+
+			cur.execute("CREATE TEMP TABLE IF NOT EXISTS import_reminder(line INTEGER, reminder_date TIMESTAMP, reminder_text VARCHAR(200)) ON COMMIT DROP")
+			cur.execute("TRUNCATE import_reminder")
+			cur.copy_expert("COPY import_reminder(line, reminder_date, reminder_text) FROM STDIN WITH (FORMAT csv)", buffer)
+			# first row of every time is inserted, rows joined to nothing were skipped
+			cur.execute(
+				"WITH inserted AS ("
+				"INSERT INTO reminder(chat_id, reminder_date, reminder_text) "
+				"SELECT DISTINCT ON (reminder_date) %s, reminder_date, reminder_text FROM import_reminder ORDER BY reminder_date, line "
+				"ON CONFLICT(reminder_date, chat_id) DO NOTHING RETURNING id, chat_id, reminder_date, reminder_text, recurrence, attempts, next_attempt_at), "
+				"first AS (SELECT MIN(line) AS line FROM import_reminder GROUP BY reminder_date) "
+				"SELECT imported.line, inserted.id, inserted.chat_id, inserted.reminder_date AT TIME ZONE 'UTC', inserted.reminder_text, inserted.recurrence, inserted.attempts, inserted.next_attempt_at AT TIME ZONE 'UTC' "
+				"FROM import_reminder AS imported "
+				"LEFT JOIN first ON first.line = imported.line "
+				"LEFT JOIN inserted ON first.line IS NOT NULL AND inserted.reminder_date = imported.reminder_date "
+				"ORDER BY imported.line",
+				(chat_id,)
+			)
+			result = cur.fetchall()
+
+		skipped = []
+		for line, *reminder in result:
+			if reminder[0] is None:
+				skipped.append(line)
+			else:
+				self.notify('on_reminder_set', dict(zip(self.reminder_keys, reminder)))
+		return skipped
+
+	@base_method
+	def export_reminders(self, chat_id: int, tz: int, f):
+		"""writes csv with reminders of chat in chat timezone to binary file f with COPY.
+		returns False if database is unavailable"""
+		with self.cursor(chat_id) as cur:
+			if cur is None:
+				return False
+
+			query = cur.mogrify(
+				"SELECT to_char(reminder_date + make_interval(hours => %s), 'DD/MM/YYYY HH24:MI') AS date, reminder_text AS text "
+				"FROM reminder WHERE chat_id = %s ORDER BY reminder_date",
+				(tz, chat_id)
+			).decode()
+			cur.copy_expert("COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)".format(query=query), f)
+		return True
+
+	@base_method
+	def set_chat_mode(self, chat_id: int, mode: str, awaits_for: str = None):
+		"""Changes chat mode in chat_mode table"""
+		self.check_chat_mode(mode, awaits_for)
+
+		if awaits_for is None:
+			awaits_for = ''
+
+		context = self.context(chat_id)
+		if context is not None:
+			context.change_chat(chat_mode=mode, awaits_for=awaits_for)
+			return
+
+		with self.cursor(chat_id) as cur:
+			if cur is None:
+				return
+
+			queries.execute(cur, 'set_chat_mode', (chat_id, mode, awaits_for))
+			row = cur.fetchall()[0]
+
+		# cache is written after commit
+		self.cache_chat(chat_id, row)
+
+	@base_method
+	def get_chat(self, chat_id: int, quiet: bool = False):
+		"""returns dict with chat_mode, awaits_for and timezone of chat or None if chat is unknown.
+		rows are served from chat cache when possible, quiet lookup doesn't message chat when database is unavailable"""
+		context = self.context(chat_id)
+		if context is not None:
+			return context.chat
+
+		chat = self.chat_cache.get(chat_id, _MISSING)
+		if chat is not _MISSING:
+			return chat
+
+		with self.cursor(None if quiet else chat_id) as cur:
+			if cur is None:
+				return
+
+			queries.execute(cur, 'get_chat', (chat_id,))
+			result = cur.fetchall()
+
+		return self.cache_chat(chat_id, result[0] if result else None)
+
+	def cache_chat(self, chat_id: int, row: tuple):
+		"""puts chat row to chat cache and returns it as dict"""
+		chat = None
+		if row is not None:
+			chat = dict(zip(['chat_mode', 'awaits_for', 'timezone'], row))
+		self.chat_cache.set(chat_id, chat)
+		return chat
+
+	@base_method
+	def save_temp_date(self, chat_id: int, date: str):
+		"""saves date to temp_datetime table"""
+		context = self.context(chat_id)
+		if context is not None:
+			context.temp_date = date
+			context.temp_changed = True
+			return
+
+		with self.cursor(chat_id) as cur:
+			if cur is None:
+				return
+
+			queries.execute(cur, 'save_temp_date', (chat_id, date))
+
+	@base_method
+	def save_temp_time(self, chat_id: int, time: str):
+		"""saves time to temp_dateitme table"""
+		context = self.context(chat_id)
+		if context is not None:
+			context.temp_time = time
+			context.temp_changed = True
+			return
+
+		with self.cursor(chat_id) as cur:
+			if cur is None:
+				return
+
+			queries.execute(cur, 'save_temp_time', (chat_id, time))
+
+	@base_method
+	def get_temp_date(self, chat_id: int):
+		"""returns date from temp_datetime"""
+		context = self.context(chat_id)
+		if context is not None:
+			return context.temp_date
+
+		with self.cursor(chat_id) as cur:
+			if cur is None:
+				return
+
+			queries.execute(cur, 'get_temp_date', (chat_id,))
+			return cur.fetchall()[0][0]
+
+	@base_method
+	def get_temp_time(self, chat_id: int):
+		"""returns time from temp_datetime"""
+		context = self.context(chat_id)
+		if context is not None:
+			return context.temp_time
+
+		with self.cursor(chat_id) as cur:
+			if cur is None:
+				return
+
+			queries.execute(cur, 'get_temp_time', (chat_id,))
+			return cur.fetchall()[0][0]
+
+	@base_method
+	def get_reminders_page(self, chat_id: int, limit: int, after: tuple = None, before: tuple = None):
+		"""returns page of chat reminders ordered by (reminder_date, id) and whether there are more reminders in page direction.
+		page starts after key after or ends before key before, keys are (reminder_date, id).
+		returns (None, False) if database is unavailable"""
+		with self.cursor(chat_id) as cur:
+			if cur is None:
+				return None, False
+
+			# one extra row tells if there is next page
+			if before is not None:
+				queries.execute(cur, 'reminders_page_before', (chat_id, before[0], before[1], limit + 1))
+			elif after is not None:
+				queries.execute(cur, 'reminders_page_after', (chat_id, after[0], after[1], limit + 1))
+			else:
+				queries.execute(cur, 'reminders_page', (chat_id, limit + 1))
+			rows = cur.fetchall()
+
+		more = len(rows) > limit
+		rows = rows[:limit]
+		if before is not None:
+			rows.reverse()
+		return list(map(lambda rem: dict(zip(self.reminder_keys, rem)), rows)), more
+
+	@base_method
+	def get_user_reminders(self, chat_id: int):
+		"""returns chat reminders from database"""
+		with self.cursor(chat_id) as cur:
+			if cur is None:
+				return
+
+			queries.execute(cur, 'get_user_reminders', (chat_id,))
+			reminders = cur.fetchall()
+
+		return list(map(lambda rem: dict(zip(self.reminder_keys, rem)), reminders))
+
+	@base_method
+	def set_timezone(self, chat_id: int, tz: int):
+		"""sets chat timezone"""
+		context = self.context(chat_id)
+		if context is not None:
+			context.change_chat(timezone=tz)
+			return
+
+		with self.cursor(chat_id) as cur:
+			if cur is None:
+				return
+
+			queries.execute(cur, 'set_timezone', (chat_id, tz))
+			row = cur.fetchall()[0]
+
+		# cache is written after commit
+		self.cache_chat(chat_id, row)
+
+	@base_method
+	def delete_chats(self, first_chat_id: int):
+		"""deletes chats with id from first_chat_id on with their reminders and temp_datetime rows"""
+		with self.cursor() as cur:
+			if cur is None:
+				return
+
+			queries.execute(cur, 'delete_chats', (first_chat_id,))
+
+		self.chat_cache.clear()
+
+	@base_method
+	def heartbeat(self, instance_id: str, timeout: float):
+		"""records that instance is alive and forgets instances silent for timeout seconds.
+		returns sorted list of live instance ids or None if database is unavailable"""
+		with self.cursor() as cur:
+			if cur is None:
+				return None
+
+			queries.execute(cur, 'heartbeat', (instance_id,))
+			queries.execute(cur, 'forget_instances', (timeout,))
+			queries.execute(cur, 'get_instances')
+			return [row[0] for row in cur.fetchall()]
+
+	@base_method
+	def get_state(self, key: str):
+		"""returns value saved in bot_state or None"""
+		with self.cursor() as cur:
+			if cur is None:
+				return None
+
+			queries.execute(cur, 'get_state', (key,))
+			result = cur.fetchall()
+
+		return result[0][0] if result else None
+
+	@base_method
+	def set_last_update_id(self, update_id: int):
+		"""saves id of the last processed update. saved id never moves back"""
+		with self.cursor() as cur:
+			if cur is None:
+				return
+
+			queries.execute(cur, 'set_last_update_id', (update_id,))
+
+	@base_method
+	def get_update_owners(self, chat_ids: list):
+		"""returns dict chat_id -> instance which has pending updates of this chat"""
+		with self.cursor() as cur:
+			if cur is None:
+				return {}
+
+			queries.execute(cur, 'get_update_owners', (list(chat_ids),))
+			return dict(cur.fetchall())
+
+	@base_method
+	def queue_updates(self, updates: list, owners: list):
+		"""saves updates assigned to owner instances and id of the last one in one transaction.
+		returns False if database is unavailable"""
+		with self.cursor() as cur:
+			if cur is None:
+				return False
+
+			for update, (chat_id, owner) in zip(updates, owners):
+				queries.execute(cur, 'queue_update', (update['update_id'], chat_id, owner, json.dumps(update)))
+			queries.execute(cur, 'set_last_update_id', (updates[-1]['update_id'],))
+			# wakes up instances waiting for updates
+			cur.execute("NOTIFY pending_update")
+
+		return True
+
+	@base_method
+	def get_assigned_updates(self, instance_id: str, limit: int, exclude: list = ()):
+		"""returns updates assigned to instance in order they were received"""
+		with self.cursor() as cur:
+			if cur is None:
+				return []
+
+			queries.execute(cur, 'get_assigned_updates', (instance_id, list(exclude), limit))
+			return [json.loads(row[0]) for row in cur.fetchall()]
+
+	@base_method
+	def delete_pending_updates(self, update_ids: list):
+		"""deletes processed updates"""
+		if not update_ids:
+			return
+
+		with self.cursor() as cur:
+			if cur is None:
+				return
+
+			queries.execute(cur, 'delete_pending_updates', (list(update_ids),))
+
+	@base_method
+	def reassign_updates(self, instance_ids: list):
+		"""assigns pending updates of dead instances to live ones by chat"""
+		with self.cursor() as cur:
+			if cur is None:
+				return
+
+			queries.execute(cur, 'reassign_updates', (instance_ids, len(instance_ids)))
+
+	@base_method
+	def claim_reminders(self, reminder_ids: list, instance_id: str, lease: float):
+		"""claims reminders for instance for lease seconds. reminders claimed by other live instances are skipped.
+		returns list of claimed reminders or None if database is unavailable"""
+		if not reminder_ids:
+			return []
+
+		with self.cursor() as cur:
+			if cur is None:
+				return None
+
+			queries.execute(cur, 'claim_reminders', (instance_id, lease, list(reminder_ids)))
+			return list(map(lambda rem: dict(zip(self.reminder_keys, rem)), cur.fetchall()))
@@ -0,0 +1,448 @@
+import sqlite3
+import threading
+from logging import Logger
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+
+from ..extra.exceptions import base_method
+from ..api_functions import post
+from .base import Storage, ChatContext, write_export
+
+
+# same tables as in postgres without cluster ones. created on start, sqlite storage has no migrations
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat(
+	chat_id INTEGER PRIMARY KEY,
+	chat_mode TEXT NOT NULL,
+	awaits_for TEXT,
+	timezone INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS temp_datetime(
+	chat_id INTEGER PRIMARY KEY,
+	reminder_date TEXT,
+	reminder_time TEXT
+);
+
+-- dates are utc in iso format, so they are ordered as text
+CREATE TABLE IF NOT EXISTS reminder(
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	chat_id INTEGER NOT NULL,
+	reminder_date TEXT NOT NULL,
+	reminder_text TEXT,
+	recurrence TEXT,
+	status TEXT NOT NULL DEFAULT 'pending',
+	attempts INTEGER NOT NULL DEFAULT 0,
+	next_attempt_at TEXT,
+	last_error TEXT,
+	-- until when reminder being sent is not loaded again
+	claimed_until TEXT,
+
+	UNIQUE(reminder_date, chat_id)
+);
+
+CREATE INDEX IF NOT EXISTS reminder_chat_page ON reminder(chat_id, reminder_date, id);
+
+CREATE TABLE IF NOT EXISTS bot_state(
+	key TEXT PRIMARY KEY,
+	value INTEGER
+);
+"""
+
+# reminder columns added after table was first created, added to existing databases on start
+ADDED_COLUMNS = {'claimed_until': 'TEXT'}
+
+REMINDER_COLUMNS = 'id, chat_id, reminder_date, reminder_text, recurrence, attempts, next_attempt_at'
+
+
+def to_text(dt: datetime):
+	return dt.strftime('%Y-%m-%d %H:%M:%S') if dt is not None else None
+
+
+def to_datetime(text: str):
+	return datetime.strptime(text, '%Y-%m-%d %H:%M:%S') if text is not None else None
+
+
+class SqliteStorage(Storage):
+	"""Storage in sqlite database file for bot running alone.
+	One connection is shared by threads, lock serializes its use and chat context holds it until update is processed,
+	so sqlite handles one update at a time and other updates and the due scan wait for it"""
+
+	def __init__(self, logger: Logger, path: str = 'rememberancer.db'):
+		super().__init__(logger)
+		self.path = path
+		self._lock = threading.RLock()
+		self.con = sqlite3.connect(path, check_same_thread=False)
+		# wal with synchronous=NORMAL doesn't sync database file on every commit
+		self.con.execute('PRAGMA journal_mode=WAL')
+		self.con.execute('PRAGMA synchronous=NORMAL')
+		self.con.executescript(SCHEMA)
+		existing = {row[1] for row in self.con.execute('PRAGMA table_info(reminder)')}
+		for column, column_type in ADDED_COLUMNS.items():
+			if column not in existing:
+				self.con.execute('ALTER TABLE reminder ADD COLUMN {} {}'.format(column, column_type))
+		self.con.commit()
+
+	def close(self):
+		with self._lock:
+			self.con.close()
+
+	@contextmanager
+	def chat_context(self, chat_id: int, update_id: int = None, checkpoint: int = None):
+		"""runs all queries until block ends in one transaction, which is committed with
+		checkpoint saved as last processed update id. reminder events are sent after commit.
+		if block raises, transaction is rolled back and only checkpoint is saved"""
+		if self.context() is not None:
+			yield self.context()
+			return
+
+		context = ChatContext(chat_id, self.con)
+		context.update_id = update_id
+		context.checkpoint = checkpoint if checkpoint is not None else update_id
+		with self._lock:
+			self._local.context = context
+			try:
+				yield context
+			except BaseException:
+				self._local.context = None
+				self.discard(context)
+				raise
+			self._local.context = None
+			if context.checkpoint is not None:
+				self._save_last_update_id(self.con.cursor(), context.checkpoint)
+			self.con.commit()
+
+		for fun in context.after_commit:
+			fun()
+
+	def discard(self, context: ChatContext):
+		"""rolls back changes of failed update and saves checkpoint in separate transaction,
+		so update is not processed again. errors are logged, error of update is the one raised"""
+		try:
+			self.con.rollback()
+			if context.checkpoint is not None:
+				self._save_last_update_id(self.con.cursor(), context.checkpoint)
+				self.con.commit()
+		except sqlite3.Error as e:
+			self.logger.error("can't discard update {}: {}".format(context.update_id, e))
+
+	@contextmanager
+	def cursor(self):
+		"""yields cursor and commits when block ends, inside chat context transaction is committed when context ends"""
+		if self.context() is not None:
+			yield self.con.cursor()
+			return
+
+		with self._lock:
+			cur = self.con.cursor()
+			try:
+				yield cur
+				self.con.commit()
+			except BaseException:
+				self.con.rollback()
+				raise
+
+	def reminder(self, row: tuple):
+		"""returns reminder dict of reminder row"""
+		reminder = dict(zip(self.reminder_keys, row))
+		reminder['reminder_date'] = to_datetime(reminder['reminder_date'])
+		reminder['next_attempt_at'] = to_datetime(reminder['next_attempt_at'])
+		return reminder
+
+	def _select(self, cur, where: str, params: tuple):
+		cur.execute('SELECT ' + REMINDER_COLUMNS + ' FROM reminder WHERE ' + where, params)
+		return list(map(self.reminder, cur.fetchall()))
+
+	def _delete(self, cur, reminder_ids: list):
+		"""deletes reminders by id and returns deleted ones"""
+		deleted = []
+		for reminder_id in reminder_ids:
+			found = self._select(cur, 'id = ?', (reminder_id,))
+			if found:
+				cur.execute('DELETE FROM reminder WHERE id = ?', (reminder_id,))
+				deleted.extend(found)
+		return deleted
+
+	@base_method
+	def set_reminder(self, chat_id: int, dt: datetime, reminder_text: str, recurrence: str = None):
+		"""adds reminder. recurrence is rule of recurring reminder"""
+		if reminder_text == '-':
+			reminder_text = ''
+
+		with self.cursor() as cur:
+			cur.execute(
+				'INSERT OR IGNORE INTO reminder(chat_id, reminder_date, reminder_text, recurrence) VALUES(?, ?, ?, ?)',
+				(chat_id, to_text(dt.replace(second=0, microsecond=0)), reminder_text, recurrence)
+			)
+			result = self._select(cur, 'id = ?', (cur.lastrowid,)) if cur.rowcount else []
+
+		if result == []:
+			post('sendMessage', data={'chat_id': chat_id, 'text': 'Error. You already have reminder with the same time'})
+			return False
+
+		self.notify('on_reminder_set', result[0])
+		return True
+
+	@base_method
+	def get_chat_reminder_by_dt(self, chat_id: int, dt: datetime):
+		"""returns reminder of chat at dt"""
+		with self.cursor() as cur:
+			result = self._select(cur, 'chat_id = ? AND reminder_date = ?', (chat_id, to_text(dt.replace(second=0, microsecond=0))))
+
+		return result[0] if result else None
+
+	@base_method
+	def get_reminders_due_before(self, dt: datetime):
+		"""returns list of dicts for every reminder due before dt(in utc), including overdue ones.
+		reminders being sent are skipped until their lease expires"""
+		with self.cursor() as cur:
+			return self._select(
+				cur,
+				"reminder_date < ?1 AND status <> 'failed' AND (next_attempt_at IS NULL OR next_attempt_at < ?1) "
+				"AND (status <> 'in_flight' OR claimed_until IS NULL OR claimed_until < ?2) ORDER BY reminder_date, id",
+				(to_text(dt), to_text(datetime.utcnow()))
+			)
+
+	@base_method
+	def delete_reminder(self, reminder: dict):
+		"""deletes reminder"""
+		with self.cursor() as cur:
+			cur.execute('DELETE FROM reminder WHERE id = ?', (reminder['id'],))
+
+		self.notify('on_reminder_deleted', reminder)
+
+	@base_method
+	def delete_chat_reminder(self, chat_id: int, reminder_id: int):
+		"""deletes reminder of chat by id. returns deleted reminder or None if chat has no such reminder"""
+		with self.cursor() as cur:
+			result = self._select(cur, 'id = ? AND chat_id = ?', (reminder_id, chat_id))
+			if result:
+				cur.execute('DELETE FROM reminder WHERE id = ?', (reminder_id,))
+
+		if not result:
+			return None
+
+		self.notify('on_reminder_deleted', result[0])
+		return result[0]
+
+	@base_method
+	def delete_reminders(self, reminder_ids: list):
+		"""deletes reminders by id in one transaction. returns list of deleted reminders"""
+		if not reminder_ids:
+			return []
+
+		with self.cursor() as cur:
+			reminders = self._delete(cur, reminder_ids)
+
+		for reminder in reminders:
+			self.notify('on_reminder_deleted', reminder)
+
+		return reminders
+
+	@base_method
+	def complete_reminders(self, deleted_ids: list, advanced: dict):
+		"""deletes delivered one-shot reminders and moves recurring ones to their next occurrence in one transaction.
+		advanced maps reminder id to next due date, reminders which next date is taken by other reminder of chat are not moved.
+		returns (deleted reminders, moved reminders, ids of not moved reminders)"""
+		if not deleted_ids and not advanced:
+			return [], [], []
+
+		with self.cursor() as cur:
+			deleted = self._delete(cur, deleted_ids)
+
+			moved = []
+			conflicting = []
+			for reminder_id, dt in advanced.items():
+				cur.execute(
+					"UPDATE OR IGNORE reminder SET reminder_date = ?, status = 'pending', attempts = 0, next_attempt_at = NULL, last_error = NULL, claimed_until = NULL WHERE id = ?",
+					(to_text(dt), reminder_id)
+				)
+				if cur.rowcount:
+					moved.extend(self._select(cur, 'id = ?', (reminder_id,)))
+					continue
+				# reminders deleted meanwhile are neither moved nor conflicting
+				cur.execute('SELECT id FROM reminder WHERE id = ?', (reminder_id,))
+				if cur.fetchall():
+					conflicting.append(reminder_id)
+
+		for reminder in deleted:
+			self.notify('on_reminder_deleted', reminder)
+		for reminder in moved:
+			self.notify('on_reminder_set', reminder)
+
+		return deleted, moved, conflicting
+
+	@base_method
+	def start_delivery(self, reminder_ids: list, lease: float):
+		"""marks reminders as being delivered for lease seconds"""
+		if not reminder_ids:
+			return
+
+		claimed_until = to_text(datetime.utcnow() + timedelta(seconds=lease))
+		with self.cursor() as cur:
+			cur.executemany("UPDATE reminder SET status = 'in_flight', claimed_until = ? WHERE id = ?", [(claimed_until, reminder_id) for reminder_id in reminder_ids])
+
+	@base_method
+	def delivery_failed(self, failures: list):
+		"""saves failed deliveries. failures are tuples (reminder id, next attempt time or None, status, error)"""
+		if not failures:
+			return True
+
+		with self.cursor() as cur:
+			cur.executemany(
+				'UPDATE reminder SET attempts = attempts + 1, status = ?, next_attempt_at = ?, last_error = ?, claimed_until = NULL WHERE id = ?',
+				[(status, to_text(next_attempt_at), error, reminder_id) for reminder_id, next_attempt_at, status, error in failures]
+			)
+
+		return True
+
+	@base_method
+	def import_reminders(self, chat_id: int, rows: list):
+		"""inserts batch of (line, utc datetime, text) rows in one transaction.
+		rows conflicting with existing reminders or earlier rows of batch are skipped. returns lines of skipped rows"""
+		if not rows:
+			return []
+
+		skipped = []
+		reminders = []
+		with self.cursor() as cur:
+			for line, dt, text in sorted(rows, key=lambda row: row[0]):
+				cur.execute('INSERT OR IGNORE INTO reminder(chat_id, reminder_date, reminder_text) VALUES(?, ?, ?)', (chat_id, to_text(dt), text))
+				if cur.rowcount:
+					reminders.extend(self._select(cur, 'id = ?', (cur.lastrowid,)))
+				else:
+					skipped.append(line)
+
+		for reminder in reminders:
+			self.notify('on_reminder_set', reminder)
+		return skipped
+
+	@base_method
+	def export_reminders(self, chat_id: int, tz: int, f):
+		"""writes csv with reminders of chat in chat timezone to binary file f"""
+		with self.cursor() as cur:
+			cur.execute('SELECT reminder_date, reminder_text FROM reminder WHERE chat_id = ? ORDER BY reminder_date', (chat_id,))
+			write_export(f, ((to_datetime(dt), text) for dt, text in cur), tz)
+		return True
+
+	@base_method
+	def get_reminders_page(self, chat_id: int, limit: int, after: tuple = None, before: tuple = None):
+		"""returns page of chat reminders ordered by (reminder_date, id) and whether there are more reminders in page direction.
+		page starts after key after or ends before key before, keys are (reminder_date, id)"""
+		with self.cursor() as cur:
+			# one extra row tells if there is next page
+			if before is not None:
+				reminders = self._select(cur, '(reminder_date, id) < (?, ?) AND chat_id = ? ORDER BY reminder_date DESC, id DESC LIMIT ?', (to_text(before[0]), before[1], chat_id, limit + 1))
+			elif after is not None:
+				reminders = self._select(cur, '(reminder_date, id) > (?, ?) AND chat_id = ? ORDER BY reminder_date, id LIMIT ?', (to_text(after[0]), after[1], chat_id, limit + 1))
+			else:
+				reminders = self._select(cur, 'chat_id = ? ORDER BY reminder_date, id LIMIT ?', (chat_id, limit + 1))
+
+		more = len(reminders) > limit
+		reminders = reminders[:limit]
+		if before is not None:
+			reminders.reverse()
+		return reminders, more
+
+	@base_method
+	def get_user_reminders(self, chat_id: int):
+		"""returns chat reminders"""
+		with self.cursor() as cur:
+			return self._select(cur, 'chat_id = ?', (chat_id,))
+
+	@base_method
+	def set_chat_mode(self, chat_id: int, mode: str, awaits_for: str = None):
+		"""changes chat mode"""
+		self.check_chat_mode(mode, awaits_for)
+
+		if awaits_for is None:
+			awaits_for = ''
+
+		with self.cursor() as cur:
+			cur.execute(
+				'INSERT INTO chat(chat_id, chat_mode, awaits_for) VALUES(?, ?, ?) '
+				'ON CONFLICT(chat_id) DO UPDATE SET chat_mode = excluded.chat_mode, awaits_for = excluded.awaits_for',
+				(chat_id, mode, awaits_for)
+			)
+
+	@base_method
+	def get_chat(self, chat_id: int, quiet: bool = False):
+		"""returns dict with chat_mode, awaits_for and timezone of chat or None if chat is unknown"""
+		with self.cursor() as cur:
+			cur.execute('SELECT chat_mode, awaits_for, timezone FROM chat WHERE chat_id = ?', (chat_id,))
+			result = cur.fetchall()
+
+		return dict(zip(['chat_mode', 'awaits_for', 'timezone'], result[0])) if result else None
+
+	@base_method
+	def save_temp_date(self, chat_id: int, date: str):
+		"""saves date to temp_datetime table"""
+		with self.cursor() as cur:
+			cur.execute(
+				'INSERT INTO temp_datetime(chat_id, reminder_date) VALUES(?, ?) ON CONFLICT(chat_id) DO UPDATE SET reminder_date = excluded.reminder_date',
+				(chat_id, date)
+			)
+
+	@base_method
+	def save_temp_time(self, chat_id: int, time: str):
+		"""saves time to temp_datetime table"""
+		with self.cursor() as cur:
+			cur.execute(
+				'INSERT INTO temp_datetime(chat_id, reminder_time) VALUES(?, ?) ON CONFLICT(chat_id) DO UPDATE SET reminder_time = excluded.reminder_time',
+				(chat_id, time)
+			)
+
+	@base_method
+	def get_temp_date(self, chat_id: int):
+		"""returns date from temp_datetime"""
+		with self.cursor() as cur:
+			cur.execute('SELECT reminder_date FROM temp_datetime WHERE chat_id = ?', (chat_id,))
+			result = cur.fetchall()
+
+		return result[0][0] if result else None
+
+	@base_method
+	def get_temp_time(self, chat_id: int):
+		"""returns time from temp_datetime"""
+		with self.cursor() as cur:
+			cur.execute('SELECT reminder_time FROM temp_datetime WHERE chat_id = ?', (chat_id,))
+			result = cur.fetchall()
+
+		return result[0][0] if result else None
+
+	@base_method
+	def set_timezone(self, chat_id: int, tz: int):
+		"""sets chat timezone"""
+		with self.cursor() as cur:
+			cur.execute(
+				"INSERT INTO chat(chat_id, chat_mode, timezone) VALUES(?, 'normal', ?) ON CONFLICT(chat_id) DO UPDATE SET timezone = excluded.timezone",
+				(chat_id, tz)
+			)
+
+	@base_method
+	def delete_chats(self, first_chat_id: int):
+		"""deletes chats with id from first_chat_id on with their reminders and temp_datetime rows"""
+		with self.cursor() as cur:
+			for table in ['reminder', 'temp_datetime', 'chat']:
+				cur.execute('DELETE FROM {} WHERE chat_id >= ?'.format(table), (first_chat_id,))
+
+	@base_method
+	def get_state(self, key: str):
+		"""returns value saved in bot_state or None"""
+		with self.cursor() as cur:
+			cur.execute('SELECT value FROM bot_state WHERE key = ?', (key,))
+			result = cur.fetchall()
+
+		return result[0][0] if result else None
+
+	@base_method
+	def set_last_update_id(self, update_id: int):
+		"""saves id of the last processed update. saved id never moves back"""
+		with self.cursor() as cur:
+			self._save_last_update_id(cur, update_id)
+
+	def _save_last_update_id(self, cur, update_id: int):
+		cur.execute(
+			"INSERT INTO bot_state(key, value) VALUES('last_update_id', ?) ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)",
+			(update_id,)
+		)
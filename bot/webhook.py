@@ -0,0 +1,104 @@
+import ssl
+import hmac
+import json
+import queue
+import threading
+from logging import Logger
+from urllib.parse import urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class WebhookServer:
+	"""HTTP server receiving updates which telegram pushes to webhook.
+	Updates are acknowledged immediately and handed to bot through bounded queue"""
+
+	def __init__(self, logger: Logger, url: str, host: str = '0.0.0.0', port: int = 8443, secret_token: str = None, queue_size: int = 1000, certfile: str = None, keyfile: str = None):
+		self.logger = logger
+		# public url given to telegram, it may differ from host and port if server is behind proxy
+		self.url = url
+		self.path = urlparse(url).path or '/'
+		self.host = host
+		self.port = port
+		self.secret_token = secret_token
+		self.certfile = certfile
+		self.keyfile = keyfile
+		self.updates = queue.Queue(maxsize=queue_size)
+		self.server = None
+
+	def start(self):
+		"""starts server in background thread if it is not running"""
+		if self.server is not None:
+			return
+
+		self.server = ThreadingHTTPServer((self.host, self.port), self._handler_class())
+		self.server.daemon_threads = True
+		if self.certfile is not None:
+			context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+			context.load_cert_chain(self.certfile, self.keyfile)
+			self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+
+		threading.Thread(target=self.server.serve_forever, name='webhook', daemon=True).start()
+		self.logger.warning('webhook server listens on {host}:{port}{path}'.format(host=self.host, port=self.port, path=self.path))
+
+	def stop(self):
+		if self.server is not None:
+			self.server.shutdown()
+			self.server.server_close()
+			self.server = None
+
+	def get_updates(self, timeout: float, limit: int = 100):
+		"""waits up to timeout seconds for update. returns list of at most limit received updates"""
+		try:
+			updates = [self.updates.get(timeout=timeout) if timeout > 0 else self.updates.get_nowait()]
+		except queue.Empty:
+			return []
+
+		while len(updates) < limit:
+			try:
+				updates.append(self.updates.get_nowait())
+			except queue.Empty:
+				break
+		return updates
+
+	def accept(self, headers, body: bytes):
+		"""validates pushed update and queues it. returns http status code for telegram"""
+		if self.secret_token is not None:
+			token = headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+			# str with non-ascii characters can't be compared, forged header must get 403 too
+			if not hmac.compare_digest(token.encode('utf-8', 'surrogateescape'), self.secret_token.encode()):
+				return 403
+
+		try:
+			update = json.loads(body)
+		except ValueError:
+			return 400
+		if not isinstance(update, dict) or 'update_id' not in update:
+			return 400
+
+		try:
+			self.updates.put_nowait(update)
+		except queue.Full:
+			# telegram delivers update again later
+			self.logger.warning('webhook queue is full, update {} is rejected'.format(update['update_id']))
+			return 503
+		return 200
+
+	def _handler_class(self):
+		webhook = self
+
+		class Handler(BaseHTTPRequestHandler):
+
+			def do_POST(self):
+				if self.path != webhook.path:
+					status = 404
+				else:
+					length = int(self.headers.get('Content-Length', 0))
+					status = webhook.accept(self.headers, self.rfile.read(length))
+				self.send_response(status)
+				self.send_header('Content-Length', '0')
+				self.end_headers()
+
+			def log_message(self, format, *args):
+				pass
+
+		return Handler
@@ -0,0 +1,53 @@
+-- schema before versioned migrations, statements are idempotent so databases created from create_tables.sql are upgraded too
+
+CREATE TABLE IF NOT EXISTS chat(
+	chat_id	BIGINT PRIMARY KEY,
+	chat_mode VARCHAR(100) NOT NULL,
+	awaits_for VARCHAR(200),
+	timezone INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS reminder(
+	id BIGSERIAL PRIMARY KEY,
+	chat_id	BIGINT NOT NULL REFERENCES chat,
+	reminder_date TIMESTAMP NOT NULL,
+	reminder_text VARCHAR(200),
+	-- instance which sends reminder and until when it holds it
+	claimed_by VARCHAR(100),
+	claimed_until TIMESTAMP,
+	-- rule of recurring reminder, NULL for one-shot reminder
+	recurrence VARCHAR(100),
+
+	UNIQUE(reminder_date, chat_id)
+);
+
+ALTER TABLE reminder ADD COLUMN IF NOT EXISTS claimed_by VARCHAR(100);
+ALTER TABLE reminder ADD COLUMN IF NOT EXISTS claimed_until TIMESTAMP;
+ALTER TABLE reminder ADD COLUMN IF NOT EXISTS recurrence VARCHAR(100);
+
+CREATE TABLE IF NOT EXISTS temp_datetime(
+	id BIGSERIAL PRIMARY KEY,
+	chat_id	BIGINT REFERENCES chat UNIQUE NOT NULL,
+	reminder_date VARCHAR(20),
+	reminder_time VARCHAR(20)
+);
+
+CREATE TABLE IF NOT EXISTS bot_instance(
+	instance_id VARCHAR(100) PRIMARY KEY,
+	heartbeat TIMESTAMP NOT NULL
+);
+
+-- updates received by leader instance and assigned to instances by chat
+CREATE TABLE IF NOT EXISTS pending_update(
+	update_id BIGINT PRIMARY KEY,
+	chat_id BIGINT,
+	owner VARCHAR(100) NOT NULL,
+	payload TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS pending_update_owner ON pending_update(owner, update_id);
+
+CREATE TABLE IF NOT EXISTS bot_state(
+	key VARCHAR(100) PRIMARY KEY,
+	value BIGINT
+);
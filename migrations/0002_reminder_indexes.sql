@@ -0,0 +1,5 @@
+-- due reminder scan: reminder_date < $1 ORDER BY reminder_date
+CREATE INDEX IF NOT EXISTS reminder_due ON reminder(reminder_date);
+
+-- per chat listing and keyset pagination by (reminder_date, id)
+CREATE INDEX IF NOT EXISTS reminder_chat_page ON reminder(chat_id, reminder_date, id);
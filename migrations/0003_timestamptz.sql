@@ -0,0 +1,7 @@
+-- stored values are utc, sessions of bot use TimeZone UTC
+ALTER TABLE reminder
+	ALTER COLUMN reminder_date TYPE TIMESTAMPTZ USING reminder_date AT TIME ZONE 'UTC',
+	ALTER COLUMN claimed_until TYPE TIMESTAMPTZ USING claimed_until AT TIME ZONE 'UTC';
+
+ALTER TABLE bot_instance
+	ALTER COLUMN heartbeat TYPE TIMESTAMPTZ USING heartbeat AT TIME ZONE 'UTC';
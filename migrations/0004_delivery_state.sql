@@ -0,0 +1,8 @@
+-- delivery state of reminder: pending, in_flight or failed. sent one-shot reminders are deleted,
+-- sent recurring ones are moved to their next occurrence and become pending again
+ALTER TABLE reminder
+	ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'pending',
+	ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0,
+	-- when failed delivery is tried again, NULL if it was not tried yet
+	ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMPTZ,
+	ADD COLUMN IF NOT EXISTS last_error VARCHAR(200);
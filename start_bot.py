@@ -1,13 +1,46 @@
+import os
+import argparse
+
 from bot.bot import Bot
+from bot.storage import STORAGE
 from bot.extra.logger import logger
 
 
-bot = Bot()
+parser = argparse.ArgumentParser(description='Starts rememberancer bot')
+parser.add_argument('--runtime', choices=['sync', 'asyncio'], default=os.getenv('REMEMBERANCER_RUNTIME', 'sync'), help='sync runs everything in one loop, asyncio runs polling, handling and sending as concurrent tasks')
+parser.add_argument('--webhook-url', default=os.getenv('REMEMBERANCER_WEBHOOK_URL'), help='public https url telegram pushes updates to. bot polls getUpdates if it is not set')
+parser.add_argument('--webhook-host', default=os.getenv('REMEMBERANCER_WEBHOOK_HOST', '0.0.0.0'))
+parser.add_argument('--webhook-port', type=int, default=int(os.getenv('REMEMBERANCER_WEBHOOK_PORT', 8443)))
+parser.add_argument('--webhook-secret', default=os.getenv('REMEMBERANCER_WEBHOOK_SECRET'), help='token telegram sends in X-Telegram-Bot-Api-Secret-Token header')
+parser.add_argument('--webhook-cert', default=os.getenv('REMEMBERANCER_WEBHOOK_CERT'), help='certificate file if server is not behind https proxy')
+parser.add_argument('--webhook-key', default=os.getenv('REMEMBERANCER_WEBHOOK_KEY'))
+parser.add_argument('--cluster', action='store_true', default=bool(os.getenv('REMEMBERANCER_CLUSTER')), help='run as one of several instances sharing database')
+parser.add_argument('--no-migrate', action='store_true', help='do not apply database migrations on start')
+args = parser.parse_args()
+
+# sqlite and in-memory storages create their tables themselves
+if STORAGE == 'postgres' and not args.no_migrate:
+	from bot.migrate import prepare_database
+	prepare_database(logger)
+
+webhook = None
+if args.webhook_url:
+	from bot.webhook import WebhookServer
+	webhook = WebhookServer(logger, args.webhook_url, host=args.webhook_host, port=args.webhook_port, secret_token=args.webhook_secret, certfile=args.webhook_cert, keyfile=args.webhook_key)
+
+if args.runtime == 'asyncio':
+	from bot.async_bot import AsyncBot
+	bot = AsyncBot(webhook, args.cluster)
+else:
+	bot = Bot(webhook, args.cluster)
 
-print('start')
-while True:
-	try:
-		bot.start()
-	except Exception as e:
-		print(e)
-		logger.error('something went wrong')
+logger.warning('start')
+try:
+	while True:
+		try:
+			bot.start()
+		except Exception as e:
+			logger.error('something went wrong: {}'.format(e))
+finally:
+	bot.stop()
+	logger.warning('stop')
@@ -0,0 +1,25 @@
+import os
+import tempfile
+
+import pytest
+
+# bot modules read configuration on import
+os.environ.setdefault('REMEMBERANCER_BOT_TOKEN', 'test')
+os.environ.setdefault('REMEMBERANCER_LOG_FILE', os.path.join(tempfile.gettempdir(), 'rememberancer-test.log'))
+
+from bench.fake_telegram import FakeTelegram
+
+
+@pytest.fixture(scope='session')
+def fake_telegram():
+	fake = FakeTelegram().start()
+	yield fake
+	fake.stop()
+
+
+@pytest.fixture(autouse=True)
+def telegram_api(fake_telegram, monkeypatch):
+	"""messages sent by code under test go to local fake telegram"""
+	from bot import api_functions
+	monkeypatch.setattr(api_functions, 'API_URL', fake_telegram.url)
+	return fake_telegram
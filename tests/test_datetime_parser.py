@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from bot.datetime_parser import parse_date, parse_time, parse_reminder
+
+
+NOW = datetime(2030, 6, 15, 10, 30, 42)
+
+
+@pytest.mark.parametrize('text, expected', [
+	('25/12', (25, 12, None)),
+	('1/1/2030', (1, 1, 2030)),
+	# checked against 1900 like strptime('%d/%m') does
+	('29/02', None),
+	('29/02/2028', (29, 2, 2028)),
+	('29/02/2030', None),
+	('31/04', None),
+	('0/1', None),
+	('1/13', None),
+	('25-12', None),
+	('hello', None),
+])
+def test_parse_date(text, expected):
+	assert parse_date(text) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+	('18:30', (18, 30)),
+	('9:05', (9, 5)),
+	('0:00', (0, 0)),
+	('23:59', (23, 59)),
+	('24:00', None),
+	('12:60', None),
+	('9:5', None),
+	('noon', None),
+])
+def test_parse_time(text, expected):
+	assert parse_time(text) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+	('25/12 18:30 call mom', (datetime(2030, 12, 25, 18, 30), 'call mom', None)),
+	('1/1/2031 9:00 new year', (datetime(2031, 1, 1, 9, 0), 'new year', None)),
+	('today 18:00 dinner', (datetime(2030, 6, 15, 18, 0), 'dinner', None)),
+	('Tomorrow 9:00 call mom', (datetime(2030, 6, 16, 9, 0), 'call mom', None)),
+	('tomorrow 9:00', (datetime(2030, 6, 16, 9, 0), '', None)),
+	('15/06 8:00 earlier today', (datetime(2030, 6, 15, 8, 0), 'earlier today', None)),
+	('25/12 18:30 two\nlines', (datetime(2030, 12, 25, 18, 30), 'two\nlines', None)),
+])
+def test_one_line_reminder(text, expected):
+	assert parse_reminder(text, NOW) == expected
+
+
+@pytest.mark.parametrize('text', ['25/12', '18:30 text', '31/02 9:00 text', '25/12 25:00 text', 'tomorrow', 'hello', '', 'in', 'in two hours'])
+def test_not_reminder(text):
+	assert parse_reminder(text, NOW) is None
+
+
+@pytest.mark.parametrize('text, delta, reminder_text', [
+	('in 2h', timedelta(hours=2), ''),
+	('in 15 minutes stretch', timedelta(minutes=15), 'stretch'),
+	('in 1 min', timedelta(minutes=1), ''),
+	('in 3 days pay rent', timedelta(days=3), 'pay rent'),
+	('IN 1 Week', timedelta(weeks=1), ''),
+	('in 10d', timedelta(days=10), ''),
+])
+def test_relative_reminder(text, delta, reminder_text):
+	# relative times count from current minute, like stored reminders
+	assert parse_reminder(text, NOW) == (datetime(2030, 6, 15, 10, 30) + delta, reminder_text, None)
+
+
+@pytest.mark.parametrize('text, expected', [
+	('1/1 9:00 new year', datetime(2031, 1, 1, 9, 0)),
+	('14/06 23:00 yesterday', datetime(2031, 6, 14, 23, 0)),
+	('31/12 23:59 last minute', datetime(2030, 12, 31, 23, 59)),
+])
+def test_date_without_year_rolls_over(text, expected):
+	assert parse_reminder(text, NOW)[0] == expected
+
+
+@pytest.mark.parametrize('text, expected, rule', [
+	('every day 9:00 exercise', (datetime(2030, 6, 16, 9, 0), 'exercise'), 'every day'),
+	('daily 11:00', (datetime(2030, 6, 15, 11, 0), ''), 'every day'),
+	('every 2 hours drink water', (datetime(2030, 6, 15, 12, 30), 'drink water'), 'every 2 hours'),
+	('every weekday 9:00 standup', (datetime(2030, 6, 17, 9, 0), 'standup'), 'cron 0 9 * * 1-5'),
+	('monthly 31/01 9:00 rent', (datetime(2031, 1, 31, 9, 0), 'rent'), 'every month on 31'),
+	('cron 0 8 1 * * report', (datetime(2030, 7, 1, 8, 0), 'report'), 'cron 0 8 1 * *'),
+])
+def test_recurring_reminder(text, expected, rule):
+	dt, reminder_text, parsed_rule = parse_reminder(text, NOW)
+	assert (dt, reminder_text, str(parsed_rule)) == expected + (rule,)
+
+
+@pytest.mark.parametrize('text', ['cron 0 0 31 2 * never', 'cron 60 * * * * text', 'cron * * * text', 'every 0 days text', 'every 2 months text', 'every 3 weekdays 9:00 text', 'every weekday text'])
+def test_invalid_recurring_reminder(text):
+	assert parse_reminder(text, NOW) is None
@@ -0,0 +1,110 @@
+from datetime import datetime
+
+import pytest
+
+from bot.recurrence import parse_rule, split_rule, anchored, next_cron, parse_cron
+
+
+@pytest.mark.parametrize('text, rest, rule', [
+	('every 5 minutes stretch', 'stretch', 'every 5 minutes'),
+	('every hour', '', 'every hour'),
+	('Hourly water', 'water', 'every hour'),
+	('weekly 9:00 plan', '9:00 plan', 'every week'),
+	('every month', '', 'every month'),
+	('every weekday 8:05 standup', 'standup', 'cron 5 8 * * 1-5'),
+	('cron */15  9-17 * * 1-5 check', 'check', 'cron */15 9-17 * * 1-5'),
+])
+def test_split_rule(text, rest, rule):
+	parsed, parsed_rest = split_rule(text)
+	assert (str(parsed), parsed_rest) == (rule, rest)
+
+
+@pytest.mark.parametrize('text', ['every', 'every 0 hours', 'every 2 months', 'every year', 'every weekday', 'cron * * * *', 'hello'])
+def test_split_invalid_rule(text):
+	assert split_rule(text) is None
+
+
+@pytest.mark.parametrize('text', [
+	'', 'every', 'every 2', 'every month on 0', 'every month on 32', 'every month on first',
+	'cron', 'cron * * * * * *', 'cron 60 * * * *', 'cron * 24 * * *', 'cron * * 0 * *', 'cron * * * 13 *', 'cron * * * * 8',
+	'cron */0 * * * *', 'cron 5-1 * * * *', 'cron a * * * *', 'cron 1-x * * * *',
+])
+def test_invalid_rule(text):
+	assert parse_rule(text) is None
+
+
+@pytest.mark.parametrize('text', ['cron 0 0 31 2 *', 'cron 0 0 30,31 2 *', 'cron 0 0 31 4,6,9,11 *'])
+def test_never_occurring_cron_rule(text):
+	assert parse_rule(text) is None
+
+
+@pytest.mark.parametrize('text', ['cron 0 0 29 2 *', 'cron 0 0 31 2,3 *', 'cron 0 0 31 2 1'])
+def test_rarely_occurring_cron_rule(text):
+	# 29 of february occurs in leap years, day of week makes rule occur any month
+	assert parse_rule(text) is not None
+
+
+def test_interval_skips_missed_occurrences():
+	rule = parse_rule('every 2 hours')
+	last = datetime(2030, 1, 1, 9, 0)
+	assert rule.next(last, last) == datetime(2030, 1, 1, 11, 0)
+	assert rule.next(last, datetime(2030, 1, 3, 10, 0)) == datetime(2030, 1, 3, 11, 0)
+	assert rule.next(last, datetime(2030, 1, 3, 11, 0)) == datetime(2030, 1, 3, 13, 0)
+
+
+@pytest.mark.parametrize('first, expected', [
+	(datetime(2030, 1, 31, 9, 0), [datetime(2030, 2, 28, 9, 0), datetime(2030, 3, 31, 9, 0), datetime(2030, 4, 30, 9, 0), datetime(2030, 5, 31, 9, 0)]),
+	(datetime(2031, 12, 31, 9, 0), [datetime(2032, 1, 31, 9, 0), datetime(2032, 2, 29, 9, 0), datetime(2032, 3, 31, 9, 0), datetime(2032, 4, 30, 9, 0)]),
+	(datetime(2030, 1, 15, 9, 0), [datetime(2030, 2, 15, 9, 0), datetime(2030, 3, 15, 9, 0), datetime(2030, 4, 15, 9, 0), datetime(2030, 5, 15, 9, 0)]),
+])
+def test_monthly_rule_clamps_day(first, expected):
+	# day of first occurrence is kept after shorter months
+	rule = anchored(parse_rule('every month'), first)
+	occurrences = []
+	dt = first
+	for _ in expected:
+		dt = rule.next(dt, dt)
+		occurrences.append(dt)
+	assert occurrences == expected
+
+
+def test_monthly_rule_in_chat_timezone():
+	# 31 of january 1:00 at utc+3 is 30 of january in utc
+	first = datetime(2030, 1, 30, 22, 0)
+	rule = anchored(parse_rule('every month'), first, 3)
+	assert str(rule) == 'every month on 31'
+	assert rule.next(first, first, 3) == datetime(2030, 2, 27, 22, 0)
+
+
+def test_monthly_rule_skips_missed_months():
+	rule = parse_rule('every month on 31')
+	last = datetime(2030, 1, 31, 9, 0)
+	assert rule.next(last, datetime(2030, 11, 15, 0, 0)) == datetime(2030, 11, 30, 9, 0)
+	assert rule.next(last, datetime(2030, 12, 31, 10, 0)) == datetime(2031, 1, 31, 9, 0)
+
+
+@pytest.mark.parametrize('text, after, expected', [
+	('cron */15 * * * *', datetime(2030, 1, 1, 9, 7, 30), datetime(2030, 1, 1, 9, 15)),
+	('cron 0 9 * * 1-5', datetime(2030, 1, 4, 9, 0), datetime(2030, 1, 7, 9, 0)),
+	('cron 30 23 31 12 *', datetime(2030, 12, 31, 23, 30), datetime(2031, 12, 31, 23, 30)),
+	('cron 0 0 29 2 *', datetime(2030, 1, 1, 0, 0), datetime(2032, 2, 29, 0, 0)),
+	# day of month or day of week when both are restricted, 7 is sunday
+	('cron 0 12 13 * 7', datetime(2030, 1, 1, 0, 0), datetime(2030, 1, 6, 12, 0)),
+])
+def test_next_cron(text, after, expected):
+	assert next_cron(parse_rule(text).cron, after) == expected
+
+
+def test_cron_rule_in_chat_timezone():
+	rule = parse_rule('cron 0 9 * * *')
+	now = datetime(2030, 1, 1, 5, 0)
+	assert rule.next(now, now, 3) == datetime(2030, 1, 1, 6, 0)
+	assert rule.next(now, now, -5) == datetime(2030, 1, 1, 14, 0)
+
+
+def test_cron_search_is_bounded():
+	# search for rule matching no day ends instead of running forever
+	cron = parse_cron(['0', '0', '1', '1', '*'])
+	cron[3] = set()
+	with pytest.raises(ValueError):
+		next_cron(cron, datetime(2030, 1, 1))
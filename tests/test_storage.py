@@ -0,0 +1,254 @@
+"""Conformance tests every storage backend must pass.
+postgres runs only when REMEMBERANCER_TEST_POSTGRES is set, it needs scratch database"""
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+from bot.extra.logger import logger
+from bot.storage import create_storage
+
+
+# chat ids used by tests, far from real telegram chat ids
+CHAT_BASE = 8 * 10 ** 15
+A, B = CHAT_BASE, CHAT_BASE + 1
+T0 = datetime(2030, 1, 1, 12, 0)
+BACKENDS = ['memory', 'sqlite'] + (['postgres'] if os.getenv('REMEMBERANCER_TEST_POSTGRES') else [])
+
+
+class Recorder:
+	"""Listener recording reminder events storage sends"""
+
+	def __init__(self):
+		self.events = []
+
+	def on_reminder_set(self, reminder: dict):
+		self.events.append(('set', reminder['reminder_text']))
+
+	def on_reminder_deleted(self, reminder: dict):
+		self.events.append(('deleted', reminder['reminder_text']))
+
+
+@pytest.fixture(params=BACKENDS)
+def storage(request, tmp_path, monkeypatch):
+	from bot import storage as storage_module
+	monkeypatch.setattr(storage_module, 'SQLITE_PATH', str(tmp_path / 'test.db'))
+	storage = create_storage(logger, request.param)
+	storage.kind = request.param
+	storage.delete_chats(CHAT_BASE)
+	storage.set_timezone(A, 3)
+	storage.set_timezone(B, -5)
+	yield storage
+	storage.delete_chats(CHAT_BASE)
+
+
+@pytest.fixture
+def recorder(storage):
+	recorder = Recorder()
+	storage.add_listener(recorder)
+	return recorder
+
+
+def texts(reminders: list):
+	"""reminders without ids, which differ between backends"""
+	return [(reminder['chat_id'] - CHAT_BASE, reminder['reminder_date'], reminder['reminder_text'], reminder['recurrence'], reminder['attempts'], reminder['next_attempt_at']) for reminder in reminders]
+
+
+def ids(storage, chat_id: int = A):
+	return {reminder['reminder_text']: reminder['id'] for reminder in storage.get_user_reminders(chat_id)}
+
+
+def test_unknown_chat(storage):
+	assert storage.get_chat(CHAT_BASE + 2) is None
+	assert storage.get_chat_mode(CHAT_BASE + 2) == (None, None)
+	assert storage.get_timezone(CHAT_BASE + 2) is None
+
+
+def test_chat_mode_and_timezone(storage):
+	storage.set_chat_mode(A, 'reminder', 'date')
+	assert storage.get_chat_mode(A) == ('reminder', 'date')
+	assert storage.get_timezone(A) == 3
+	storage.set_timezone(A, 4)
+	assert storage.get_chat_mode(A) == ('reminder', 'date')
+	storage.set_chat_mode(A, 'normal')
+	assert storage.get_chat(A) == {'chat_mode': 'normal', 'awaits_for': '', 'timezone': 4}
+
+
+@pytest.mark.parametrize('mode, awaits_for', [('reminder', None), ('reminder', 'place'), ('normal', 'date'), ('sleep', None)])
+def test_invalid_chat_mode(storage, mode, awaits_for):
+	with pytest.raises(ValueError):
+		storage.set_chat_mode(A, mode, awaits_for)
+
+
+def test_temp_datetime(storage):
+	storage.save_temp_date(A, '1/1/2030')
+	storage.save_temp_time(A, '12:00')
+	assert (storage.get_temp_date(A), storage.get_temp_time(A)) == ('1/1/2030', '12:00')
+
+
+def test_set_reminder(storage, recorder):
+	assert storage.set_reminder(A, T0, 'first')
+	assert storage.set_reminder(A, T0 + timedelta(hours=1), '-', 'daily')
+	assert storage.set_reminder(B, T0, 'other')
+	assert texts([storage.get_chat_reminder_by_dt(A, T0)]) == [(0, T0, 'first', None, 0, None)]
+	assert texts([storage.get_chat_reminder_by_dt(A, T0 + timedelta(hours=1))]) == [(0, T0 + timedelta(hours=1), '', 'daily', 0, None)]
+	assert storage.get_chat_reminder_by_dt(A, T0 + timedelta(days=1)) is None
+	assert recorder.events == [('set', 'first'), ('set', ''), ('set', 'other')]
+
+
+def test_reminders_are_kept_to_the_minute(storage, telegram_api):
+	assert storage.set_reminder(A, T0 + timedelta(seconds=59), 'first')
+	assert storage.get_chat_reminder_by_dt(A, T0)['reminder_text'] == 'first'
+	sent = len(telegram_api.sent)
+	assert not storage.set_reminder(A, T0 + timedelta(seconds=30), 'taken')
+	assert len(telegram_api.sent) == sent + 1
+
+
+def test_import_skips_conflicts(storage, recorder):
+	storage.set_reminder(A, T0, 'first')
+	rows = [(1, T0 + timedelta(hours=2), 'import 1'), (2, T0 + timedelta(hours=2), 'import 2'), (3, T0, 'import 3'), (4, T0 + timedelta(hours=3), 'import 4')]
+	assert storage.import_reminders(A, rows) == [2, 3]
+	assert sorted(texts(storage.get_user_reminders(A))) == [
+		(0, T0, 'first', None, 0, None), (0, T0 + timedelta(hours=2), 'import 1', None, 0, None), (0, T0 + timedelta(hours=3), 'import 4', None, 0, None)
+	]
+	assert recorder.events == [('set', 'first'), ('set', 'import 1'), ('set', 'import 4')]
+
+
+def test_pages(storage):
+	dates = [T0 + timedelta(hours=hours) for hours in range(5)]
+	for dt in dates:
+		storage.set_reminder(A, dt, str(dt))
+	storage.set_reminder(B, T0, 'other')
+
+	first, more = storage.get_reminders_page(A, 2)
+	assert ([reminder['reminder_date'] for reminder in first], more) == (dates[:2], True)
+	second, more = storage.get_reminders_page(A, 2, after=(first[-1]['reminder_date'], first[-1]['id']))
+	assert ([reminder['reminder_date'] for reminder in second], more) == (dates[2:4], True)
+	last, more = storage.get_reminders_page(A, 2, after=(second[-1]['reminder_date'], second[-1]['id']))
+	assert ([reminder['reminder_date'] for reminder in last], more) == (dates[4:], False)
+	previous, more = storage.get_reminders_page(A, 2, before=(last[0]['reminder_date'], last[0]['id']))
+	assert ([reminder['reminder_date'] for reminder in previous], more) == (dates[2:4], True)
+	previous, more = storage.get_reminders_page(A, 2, before=(previous[0]['reminder_date'], previous[0]['id']))
+	assert ([reminder['reminder_date'] for reminder in previous], more) == (dates[:2], False)
+
+
+def test_export(storage):
+	storage.set_reminder(A, T0 + timedelta(hours=1), '-')
+	storage.set_reminder(A, T0, 'call mom, then dad')
+	storage.set_reminder(B, T0, 'other')
+	# export command spools file to disk when it grows and sends it after export
+	with tempfile.SpooledTemporaryFile(max_size=16) as f:
+		assert storage.export_reminders(A, 3, f)
+		assert not f.closed
+		f.seek(0)
+		assert f.read().decode().splitlines() == ['date,text', '01/01/2030 15:00,"call mom, then dad"', '01/01/2030 16:00,']
+
+
+def test_due_reminders(storage):
+	storage.set_reminder(A, T0, 'first')
+	storage.set_reminder(B, T0, 'other')
+	storage.set_reminder(A, T0 + timedelta(minutes=1), 'later')
+	due = storage.get_reminders_due_before(T0 + timedelta(minutes=1))
+	assert sorted(texts(due)) == [(0, T0, 'first', None, 0, None), (1, T0, 'other', None, 0, None)]
+
+
+def test_reminders_being_sent_are_not_due(storage):
+	storage.set_reminder(A, T0, 'first')
+	storage.set_reminder(A, T0 + timedelta(minutes=1), 'expired lease')
+	storage.start_delivery([ids(storage)['first']], 60)
+	storage.start_delivery([ids(storage)['expired lease']], -1)
+	assert [reminder['reminder_text'] for reminder in storage.get_reminders_due_before(T0 + timedelta(minutes=5))] == ['expired lease']
+
+
+def test_failed_delivery(storage):
+	storage.set_reminder(A, T0, 'first')
+	storage.set_reminder(B, T0, 'other')
+	first, other = ids(storage)['first'], ids(storage, B)['other']
+	storage.start_delivery([first, other], 60)
+	retry = T0 + timedelta(minutes=10)
+	assert storage.delivery_failed([(first, retry, 'pending', 'timeout'), (other, None, 'failed', 'forbidden')])
+	assert storage.get_reminders_due_before(T0 + timedelta(minutes=5)) == []
+	assert texts(storage.get_reminders_due_before(retry + timedelta(minutes=1))) == [(0, T0, 'first', None, 1, retry)]
+
+
+def test_complete_reminders(storage, recorder):
+	storage.set_reminder(A, T0, 'first')
+	storage.set_reminder(A, T0 + timedelta(hours=1), 'daily', 'daily')
+	storage.set_reminder(A, T0 + timedelta(hours=2), 'blocked', 'daily')
+	storage.set_reminder(A, T0 + timedelta(hours=3), 'blocker')
+	reminder_ids = ids(storage)
+	storage.delivery_failed([(reminder_ids['daily'], T0 + timedelta(hours=2), 'pending', 'timeout')])
+
+	deleted, moved, conflicting = storage.complete_reminders(
+		[reminder_ids['first']],
+		{reminder_ids['daily']: T0 + timedelta(days=1), reminder_ids['blocked']: T0 + timedelta(hours=3), -1: T0}
+	)
+	assert texts(deleted) == [(0, T0, 'first', None, 0, None)]
+	# delivery state is reset for the next occurrence
+	assert texts(moved) == [(0, T0 + timedelta(days=1), 'daily', 'daily', 0, None)]
+	assert conflicting == [reminder_ids['blocked']]
+	assert recorder.events[-2:] == [('deleted', 'first'), ('set', 'daily')]
+	assert storage.complete_reminders([], {}) == ([], [], [])
+
+
+def test_delete_reminders(storage, recorder):
+	for hours, text in enumerate(['one', 'two', 'three', 'four']):
+		storage.set_reminder(A, T0 + timedelta(hours=hours), text)
+	reminder_ids = ids(storage)
+
+	assert storage.delete_chat_reminder(B, reminder_ids['one']) is None
+	assert texts([storage.delete_chat_reminder(A, reminder_ids['one'])]) == [(0, T0, 'one', None, 0, None)]
+	assert [reminder['reminder_text'] for reminder in storage.delete_reminders([reminder_ids['two'], reminder_ids['one']])] == ['two']
+	storage.delete_reminder(storage.get_chat_reminder_by_dt(A, T0 + timedelta(hours=2)))
+	assert [reminder['reminder_text'] for reminder in storage.get_user_reminders(A)] == ['four']
+	assert recorder.events[4:] == [('deleted', 'one'), ('deleted', 'two'), ('deleted', 'three')]
+
+
+def test_chat_context_commits_update(storage, recorder):
+	update_id = 10 ** 12 + 1
+	with storage.chat_context(A, update_id) as context:
+		assert context is not None
+		storage.set_chat_mode(A, 'reminder', 'time')
+		storage.save_temp_date(A, '1/1/2030')
+		storage.set_reminder(A, T0, 'in context')
+		assert storage.get_chat_mode(A) == ('reminder', 'time')
+		assert storage.get_temp_date(A) == '1/1/2030'
+		# events are sent after commit
+		assert recorder.events == []
+	assert storage.get_chat_mode(A) == ('reminder', 'time')
+	assert storage.get_temp_date(A) == '1/1/2030'
+	assert recorder.events == [('set', 'in context')]
+	assert storage.get_state('last_update_id') >= update_id
+
+
+def test_chat_context_rolls_back_failed_update(storage, recorder):
+	if storage.kind == 'memory':
+		pytest.skip('memory storage has no rollback')
+	update_id = 10 ** 12 + 2
+	with pytest.raises(RuntimeError):
+		with storage.chat_context(A, update_id):
+			storage.set_chat_mode(A, 'import')
+			storage.set_reminder(A, T0, 'failed')
+			raise RuntimeError
+	assert storage.get_chat_mode(A) == ('normal', None)
+	assert storage.get_user_reminders(A) == []
+	assert recorder.events == []
+	# failed update is not processed again
+	assert storage.get_state('last_update_id') >= update_id
+
+
+def test_last_update_id_never_moves_back(storage):
+	update_id = 10 ** 12 + 3
+	storage.set_last_update_id(update_id)
+	storage.set_last_update_id(update_id - 5)
+	assert storage.get_state('last_update_id') >= update_id
+
+
+def test_delete_chats(storage):
+	storage.set_reminder(A, T0, 'first')
+	storage.save_temp_date(B, '1/1/2030')
+	storage.delete_chats(CHAT_BASE)
+	assert storage.get_chat(A) is None
+	assert storage.get_user_reminders(A) == []
+	assert storage.get_temp_date(B) is None
@@ -0,0 +1,21 @@
+import pytest
+
+from bot.extra.logger import logger
+from bot.webhook import WebhookServer
+
+
+@pytest.fixture
+def webhook():
+	return WebhookServer(logger, 'https://example.com/hook', secret_token='secret')
+
+
+@pytest.mark.parametrize('headers', [{}, {'X-Telegram-Bot-Api-Secret-Token': 'wrong'}, {'X-Telegram-Bot-Api-Secret-Token': 'sécret'}])
+def test_wrong_secret_token(webhook, headers):
+	assert webhook.accept(headers, b'{"update_id": 1}') == 403
+	assert webhook.get_updates(0) == []
+
+
+@pytest.mark.parametrize('body, status', [(b'{"update_id": 1}', 200), (b'not json', 400), (b'[1]', 400), (b'{"message": {}}', 400)])
+def test_accept(webhook, body, status):
+	assert webhook.accept({'X-Telegram-Bot-Api-Secret-Token': 'secret'}, body) == status
+	assert len(webhook.get_updates(0)) == (status == 200)